@@ -0,0 +1,135 @@
+"""
+Cold-start benchmark of the API server.
+
+Starts a fresh uvicorn process per run and measures the time from spawning it
+until /health answers, until /ready reports ready and until the first question
+sent over the /text2text WebSocket is answered. With the default stub backend
+the server uses StubLLM and AsyncStubNeo4jDatabase, --db-startup-latency
+simulates connecting to Neo4j and loading the schema. --backend real uses the
+configured Neo4j and OpenAI instead. Run from api/src:
+
+    python -m benchmarks.cold_start --runs 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+import websockets
+
+from benchmarks.stubs import DEFAULT_SCRIPT
+from benchmarks.utils import format_latencies
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get_status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+async def wait_for(url: str, start: float, timeout: float, interval: float) -> float:
+    while time.perf_counter() - start < timeout:
+        if await asyncio.to_thread(get_status, url) == 200:
+            return time.perf_counter() - start
+        await asyncio.sleep(interval)
+    raise TimeoutError(f"{url} did not answer within {timeout}s")
+
+
+async def ask(url: str, question: str, start: float) -> float:
+    async with websockets.connect(url) as websocket:
+        await websocket.send(json.dumps({"type": "question", "question": question}))
+        async for message in websocket:
+            frame = json.loads(message)
+            if frame["type"] == "error":
+                raise RuntimeError(frame["detail"])
+            if frame["type"] == "end" and "generated_cypher" in frame:
+                return time.perf_counter() - start
+
+
+async def measure(args, stages) -> None:
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.cold_start", "--serve"]
+    command += ["--port", str(port), "--backend", args.backend]
+    command += ["--db-startup-latency", str(args.db_startup_latency)]
+    start = time.perf_counter()
+    server = subprocess.Popen(command, env={**os.environ, "LOG_LEVEL": "WARNING"})
+    try:
+        base = f"127.0.0.1:{port}"
+        stages["health"].append(
+            await wait_for(f"http://{base}/health", start, args.timeout, args.interval)
+        )
+        # Ask before waiting for readiness, the question waits for startup itself
+        answer = asyncio.create_task(
+            ask(f"ws://{base}/text2text", args.question, start)
+        )
+        stages["ready"].append(
+            await wait_for(f"http://{base}/ready", start, args.timeout, args.interval)
+        )
+        stages["first_answer"].append(await answer)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def serve(args) -> None:
+    import uvicorn
+
+    if args.backend == "stub":
+        from benchmarks.replay import load_app
+
+        args.script = DEFAULT_SCRIPT
+        args.db_latency = 0.05
+        args.llm_latency = 0.1
+        args.token_latency = 0.0
+        app = load_app(args)
+    else:
+        from main import app
+
+    uvicorn.run(app, port=args.port, host="127.0.0.1", log_level="warning")
+
+
+async def run(args) -> None:
+    stages = defaultdict(list)
+    for _ in range(args.runs):
+        await measure(args, stages)
+    print(f"backend={args.backend} runs={args.runs}")
+    for stage in ["health", "ready", "first_answer"]:
+        print(format_latencies(stage, stages[stage]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--backend", choices=["stub", "real"], default="stub")
+    parser.add_argument("--db-startup-latency", type=float, default=1.0)
+    parser.add_argument("--question", default=DEFAULT_SCRIPT[0]["question"])
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--interval", type=float, default=0.01)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
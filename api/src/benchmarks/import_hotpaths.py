@@ -0,0 +1,160 @@
+"""
+Microbenchmarks for the CPU-bound steps of the unstructured import path.
+
+Runs splitString, splitStringToFitTokenSpace, getNodesAndRelationshipsFromResult,
+nodesTextToListOfDict, relationshipTextToListOfDict and DataDisambiguation.run
+on synthetic documents and LLM outputs of increasing size and reports the time
+and peak memory of each. The time per MB column makes super-linear growth easy
+to spot. Runs offline with StubLLM. Run from api/src:
+
+    python -m benchmarks.import_hotpaths --sizes 1KB,100KB,1MB,10MB
+"""
+import argparse
+import json
+import random
+import re
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.stubs import StubLLM
+from components.data_disambiguation import DataDisambiguation
+from components.unstructured_data_extractor import (
+    getNodesAndRelationshipsFromResult,
+    splitString,
+    splitStringToFitTokenSpace,
+)
+from utils.unstructured_data_utils import (
+    nodesTextToListOfDict,
+    relationshipTextToListOfDict,
+)
+
+WORDS = (
+    "the national society responded to the flood in the northern region with "
+    "cash assistance shelter kits and health teams while volunteers coordinated "
+    "with local authorities to reach affected communities"
+).split()
+LABELS = ["Person", "Organization", "Country", "Crisis", "Hazard", "Project"]
+RELATIONSHIPS = ["LOCATED_IN", "AFFECTED_BY", "WORKS_FOR", "FUNDED_BY"]
+
+UNITS = {"B": 1, "KB": 1_000, "MB": 1_000_000}
+
+
+def parse_size(size: str) -> int:
+    match = re.fullmatch(r"(\d+)([KM]?B)", size.strip().upper())
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def synthetic_document(size: int, rng: random.Random) -> str:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def synthetic_node(i: int, rng: random.Random) -> str:
+    properties = {"name": f"entity {i}", "score": rng.randint(0, 100)}
+    return f'["entity{i}", "{rng.choice(LABELS)}", {json.dumps(properties)}]'
+
+
+def synthetic_relationship(n: int, rng: random.Random) -> str:
+    return (
+        f'["entity{rng.randrange(n)}", "{rng.choice(RELATIONSHIPS)}", '
+        f'"entity{rng.randrange(n)}", {{"since": {rng.randint(1990, 2023)}}}]'
+    )
+
+
+def synthetic_llm_output(size: int, rng: random.Random) -> Tuple[List[str], List[str]]:
+    """Returns node and relationship strings whose rendered output is about `size` bytes"""
+    nodes = []
+    relationships = []
+    length = 0
+    while length < size:
+        nodes.append(synthetic_node(len(nodes), rng))
+        relationships.append(synthetic_relationship(len(nodes), rng))
+        length += len(nodes[-1]) + len(relationships[-1]) + 4
+    return nodes, relationships
+
+
+def render_llm_output(nodes: List[str], relationships: List[str]) -> str:
+    return f"Nodes: {', '.join(nodes)}\nRelationships: {', '.join(relationships)}"
+
+
+def echo_responder(messages: List[Dict[str, str]]) -> str:
+    # Return the data unchanged, as if there was nothing to merge
+    return messages[-1]["content"]
+
+
+def measure(func: Callable[[], object]) -> Tuple[float, int]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def stages_for_size(size: int, llm: StubLLM, rng: random.Random):
+    document = synthetic_document(size, rng)
+    nodes, relationships = synthetic_llm_output(size, rng)
+    llm_output = render_llm_output(nodes, relationships)
+    inner_nodes = [node[1:-1] for node in nodes]
+    inner_relationships = [rel[1:-1] for rel in relationships]
+    parsed = getNodesAndRelationshipsFromResult([llm_output])
+    disambiguation = DataDisambiguation(llm=llm)
+
+    return {
+        "splitString": lambda: splitString(document, 500),
+        "splitStringToFitTokenSpace": lambda: splitStringToFitTokenSpace(
+            llm=llm, string=document, token_use_per_string=500
+        ),
+        "getNodesAndRelationshipsFromResult": lambda: getNodesAndRelationshipsFromResult(
+            [llm_output]
+        ),
+        "nodesTextToListOfDict": lambda: nodesTextToListOfDict(inner_nodes),
+        "relationshipTextToListOfDict": lambda: relationshipTextToListOfDict(
+            inner_relationships
+        ),
+        "DataDisambiguation.run": lambda: disambiguation.run(parsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1KB,100KB,1MB,10MB")
+    parser.add_argument(
+        "--tokenizer",
+        choices=["approximate", "tiktoken"],
+        default="approximate",
+        help="tiktoken needs the cl100k_base encoding to be cached or downloadable",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    llm = StubLLM(responder=echo_responder, latency=0, model_name="gpt-3.5-turbo")
+    if args.tokenizer == "tiktoken":
+        from llm.openai import OpenAIChat
+
+        llm.num_tokens_from_string = lambda string: OpenAIChat.num_tokens_from_string(
+            llm, string
+        )
+
+    print(f"{'stage':<36} {'size':>8} {'time':>10} {'time/MB':>10} {'peak mem':>10}")
+    for size_arg in args.sizes.split(","):
+        size = parse_size(size_arg)
+        rng = random.Random(args.seed)
+        for stage, func in stages_for_size(size, llm, rng).items():
+            elapsed, peak = measure(func)
+            print(
+                f"{stage:<36} {size_arg:>8} {elapsed * 1000:8.1f}ms "
+                f"{elapsed / (size / 1_000_000) * 1000:8.1f}ms "
+                f"{peak / 1_000_000:8.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
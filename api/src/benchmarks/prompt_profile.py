@@ -0,0 +1,77 @@
+"""
+Offline report of how the prompt tokens split between prompt segments.
+
+Runs Text2Cypher and SummarizeCypherResult for every question of a script,
+with a growing chat history, and the data extractors on a synthetic document,
+all against StubLLM and AsyncStubNeo4jDatabase. Prints the mean and largest
+tokens per segment and each segment's share of the prompts, as recorded by
+the prompt profiler. Run from api/src:
+
+    python -m benchmarks.prompt_profile --script recorded.jsonl
+"""
+import argparse
+import asyncio
+import random
+
+from benchmarks.import_hotpaths import synthetic_document
+from benchmarks.stubs import (
+    DEFAULT_SCHEMA,
+    DEFAULT_SCRIPT,
+    AsyncStubNeo4jDatabase,
+    StubLLM,
+    load_script,
+)
+from components.summarize_cypher_result import SummarizeCypherResult
+from components.text2cypher import Text2Cypher
+from components.unstructured_data_extractor import (
+    DataExtractor,
+    DataExtractorWithSchema,
+)
+from driver.neo4j import schema_text
+from fewshot_examples import get_fewshot_examples
+from llm.prompt_profiler import profiler
+
+
+async def profile_chat(script, model: str) -> None:
+    llm = StubLLM(latency=0, token_latency=0, model_name=model)
+    database = AsyncStubNeo4jDatabase(script=script, latency=0)
+    text2cypher = Text2Cypher(
+        llm=llm,
+        database=database,
+        cypher_examples=get_fewshot_examples("offline"),
+        ignore_relationship_direction=False,
+    )
+    summarize = SummarizeCypherResult(llm=llm)
+    history = []
+    for entry in script:
+        results = await text2cypher.run_async(entry["question"], history)
+        output = await summarize.run_async(entry["question"], results["output"])
+        history += [
+            {"role": "user", "content": entry["question"]},
+            {"role": "system", "content": output},
+        ]
+
+
+def profile_extraction(model: str, size: int) -> None:
+    llm = StubLLM(latency=0, token_latency=0, model_name=model)
+    document = synthetic_document(size, random.Random(0))
+    DataExtractor(llm=llm).run(document)
+    DataExtractorWithSchema(llm=llm).run(document, schema_text(**DEFAULT_SCHEMA))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--script", help="JSON lines with question, cypher, rows and summary"
+    )
+    parser.add_argument("--model", default="gpt-3.5-turbo-16k")
+    parser.add_argument("--document-size", type=int, default=20_000)
+    args = parser.parse_args()
+    script = load_script(args.script) if args.script else DEFAULT_SCRIPT
+    asyncio.run(profile_chat(script, args.model))
+    profile_extraction(args.model, args.document_size)
+    print(profiler.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Offline end-to-end benchmark of the chat pipeline.
+
+Drives either the components (Text2Cypher -> AsyncNeo4jDatabase.query ->
+SummarizeCypherResult) or the /text2text WebSocket endpoint itself with many
+concurrent simulated clients, using StubLLM and AsyncStubNeo4jDatabase. Reports
+throughput, per-stage latency percentiles and event-loop lag. With --pipelined
+every WebSocket client sends all its questions at once, tagged with request
+ids, instead of waiting for each answer. The response caches are off unless
+--cache is given, so repeated questions measure the pipeline and not a cache
+lookup. Run from api/src:
+
+    python -m benchmarks.replay --mode websocket --clients 50 --questions 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from benchmarks.stubs import (
+    DEFAULT_SCRIPT,
+    AsyncStubNeo4jDatabase,
+    ScriptedResponder,
+    StubLLM,
+    load_script,
+)
+from benchmarks.utils import format_latencies
+from cache.lru import LRUCache
+from components.summarize_cypher_result import SummarizeCypherResult
+from components.text2cypher import Text2Cypher
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up a task that sleeps `interval` seconds"""
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        self._task.cancel()
+
+
+async def pipeline_client(
+    questions: List[str], args, stages: Dict[str, List[float]]
+) -> None:
+    llm = StubLLM(
+        responder=ScriptedResponder(args.script),
+        latency=args.llm_latency,
+        token_latency=args.token_latency,
+    )
+    database = AsyncStubNeo4jDatabase(script=args.script, latency=args.db_latency)
+    cache = LRUCache() if args.cache else None
+    text2cypher = Text2Cypher(llm=llm, database=database, cache=cache)
+    summarize = SummarizeCypherResult(llm=llm, cache=cache)
+    for question in questions:
+        start = time.perf_counter()
+        results = await text2cypher.run_async(question, [])
+        stages["cypher"].append(time.perf_counter() - start)
+
+        first_token = None
+
+        async def onToken(token):
+            nonlocal first_token
+            if first_token is None:
+                first_token = time.perf_counter()
+
+        summary_start = time.perf_counter()
+        await summarize.run_async(question, results["output"], callback=onToken)
+        end = time.perf_counter()
+        stages["summary_first_token"].append(first_token - summary_start)
+        stages["summary"].append(end - summary_start)
+        stages["total"].append(end - start)
+
+
+async def websocket_client(
+    app, questions: List[str], stages: Dict[str, List[float]], pipelined: bool = False
+) -> None:
+    inbound = asyncio.Queue()
+    outbound = asyncio.Queue()
+    scope = {
+        "type": "websocket",
+        "asgi": {"version": "3.0"},
+        "scheme": "ws",
+        "path": "/text2text",
+        "raw_path": b"/text2text",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 7860),
+        "subprotocols": [],
+    }
+
+    async def send(message):
+        await outbound.put(message)
+
+    await inbound.put({"type": "websocket.connect"})
+    server = asyncio.create_task(app(scope, inbound.get, send))
+
+    async def next_frame():
+        while True:
+            message = await outbound.get()
+            if message["type"] == "websocket.send":
+                return json.loads(message["text"])
+            if message["type"] == "websocket.close":
+                raise RuntimeError("WebSocket closed by the server")
+
+    async def ask(request_ids: List[int]) -> None:
+        starts, summary_starts, first_tokens = {}, {}, set()
+        for request_id in request_ids:
+            message = {"type": "question", "question": questions[request_id]}
+            if pipelined:
+                message["id"] = request_id
+            starts[request_id] = time.perf_counter()
+            await inbound.put(
+                {"type": "websocket.receive", "text": json.dumps(message)}
+            )
+        while starts:
+            frame = await next_frame()
+            now = time.perf_counter()
+            request_id = frame.get("id", request_ids[0])
+            if frame["type"] == "start":
+                stages["cypher"].append(now - starts[request_id])
+                summary_starts[request_id] = now
+            elif frame["type"] == "stream" and request_id not in first_tokens:
+                first_tokens.add(request_id)
+                stages["summary_first_token"].append(
+                    now - summary_starts[request_id]
+                )
+            elif frame["type"] == "error":
+                stages["errors"].append(now - starts.pop(request_id))
+            elif frame["type"] == "end" and "generated_cypher" in frame:
+                stages["summary"].append(now - summary_starts[request_id])
+                stages["total"].append(now - starts.pop(request_id))
+
+    if pipelined:
+        await ask(list(range(len(questions))))
+    else:
+        for request_id in range(len(questions)):
+            await ask([request_id])
+
+    await inbound.put({"type": "websocket.disconnect", "code": 1000})
+    await server
+
+
+def load_app(args):
+    # Swap the real backends for the stubs before main creates its connection
+    import driver.neo4j
+    import llm.openai
+
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    cache = getattr(args, "cache", False)
+    os.environ["RESPONSE_CACHE"] = "on" if cache else "off"
+    if not cache:
+        os.environ["LLM_CACHE"] = "off"
+    driver.neo4j.AsyncNeo4jDatabase = lambda **kwargs: AsyncStubNeo4jDatabase(
+        script=args.script,
+        latency=args.db_latency,
+        initialize_latency=getattr(args, "db_startup_latency", 0.0),
+    )
+    llm.openai.OpenAIChat = lambda **kwargs: StubLLM(
+        responder=ScriptedResponder(args.script),
+        latency=args.llm_latency,
+        token_latency=args.token_latency,
+        block_event_loop=getattr(args, "block_event_loop", False),
+        **kwargs,
+    )
+    import main
+
+    return main.app
+
+
+async def run(args) -> None:
+    questions = [entry["question"] for entry in args.script]
+    # With --same-question every client asks the same questions in the same order
+    per_client = [
+        [
+            questions[(i if args.same_question else c + i) % len(questions)]
+            for i in range(args.questions)
+        ]
+        for c in range(args.clients)
+    ]
+    stages = defaultdict(list)
+    monitor = LoopLagMonitor()
+
+    if args.mode == "websocket":
+        app = load_app(args)
+        # The app is driven without a server, so run its startup handlers here
+        await app.router.startup()
+        await app.state.startup_task
+        clients = [
+            websocket_client(app, q, stages, args.pipelined) for q in per_client
+        ]
+    else:
+        clients = [pipeline_client(q, args, stages) for q in per_client]
+
+    monitor.start()
+    start = time.perf_counter()
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - start
+    monitor.stop()
+    if args.mode == "websocket":
+        await app.router.shutdown()
+
+    answered = len(stages["total"])
+    print(
+        f"mode={args.mode} clients={args.clients} answered={answered} "
+        f"errors={len(stages['errors'])} elapsed={elapsed:.2f}s "
+        f"throughput={answered / elapsed:.2f} questions/s"
+    )
+    for stage in ["cypher", "summary_first_token", "summary", "total"]:
+        print(format_latencies(stage, stages[stage]))
+    print(format_latencies("event loop lag", monitor.lags))
+    if args.mode == "websocket":
+        from utils.metrics import COALESCED_REQUESTS
+
+        counts = {key[0]: int(n) for _, _, key, n in COALESCED_REQUESTS.samples()}
+        print(f"coalesced requests: {counts}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--mode", choices=["pipeline", "websocket"], default="websocket"
+    )
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--db-latency", type=float, default=0.05)
+    parser.add_argument(
+        "--script", help="JSON lines file with question, cypher, rows and summary"
+    )
+    parser.add_argument("--same-question", action="store_true")
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="reuse generated Cypher and summaries, as the server does by default",
+    )
+    args = parser.parse_args()
+    args.script = load_script(args.script) if args.script else DEFAULT_SCRIPT
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Token counts of Cypher results in summarisation prompts, repr versus the
+compact encoding of utils.result_encoding.
+
+The result shapes follow the queries of the app: counts, lists of names,
+dotted property columns like the company report, whole nodes, relationships
+and article chunks. Tokens are counted with the cl100k_base encoding of the
+gpt-3.5 models if tiktoken can load it, otherwise estimated from the length.
+Run from api/src:
+
+    python -m benchmarks.result_encoding --rows 10
+"""
+import argparse
+import random
+from typing import Any, Callable, Dict, List
+
+from benchmarks.stubs import DEFAULT_SCRIPT, approximate_num_tokens
+from utils.result_encoding import encode_results
+
+COUNTRIES = ["Nepal", "Haiti", "Ecuador", "Japan", "Indonesia", "Mexico", "Turkey"]
+HAZARDS = ["Cyclone", "Drought", "Earthquake", "Flood", "Strong Wind"]
+
+
+def national_society(i: int, rng: random.Random) -> Dict[str, Any]:
+    country = rng.choice(COUNTRIES)
+    return {
+        "name": f"{country} Red Cross Society {i}",
+        "iso3": country[:3].upper(),
+        "founded": rng.randint(1863, 1990),
+        "volunteers": rng.randint(1000, 500000),
+        "website": f"https://www.redcross-{country.lower()}-{i}.org",
+        "isMember": True,
+    }
+
+
+def result_shapes(rows: int, seed: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    rng = random.Random(seed)
+    societies = [national_society(i, rng) for i in range(rows)]
+    return {
+        "count": DEFAULT_SCRIPT[0]["rows"],
+        "names": DEFAULT_SCRIPT[2]["rows"],
+        "property columns": [
+            {f"n.{key}": value for key, value in society.items()}
+            for society in societies
+        ],
+        "nodes": [{"n": society} for society in societies],
+        "relationships": [
+            {
+                "n": {"name": society["name"]},
+                "r": ({"name": society["name"]}, "AFFECTED_BY", {}),
+                "c": {"name": rng.choice(HAZARDS), "year": rng.randint(2000, 2023)},
+            }
+            for society in societies
+        ],
+        "single node": [{"n": societies[0]}],
+        "article chunks": [
+            {
+                "c.text": " ".join(rng.choice(HAZARDS).lower() for _ in range(80)),
+                "a.title": f"Response to the {rng.choice(HAZARDS)} in {rng.choice(COUNTRIES)}",
+                "a.siteName": "IFRC",
+            }
+            for _ in range(min(rows, 5))
+        ],
+    }
+
+
+def token_counter() -> Callable[[str], int]:
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        print("tokens counted with cl100k_base")
+        return lambda string: len(encoding.encode(string))
+    except Exception:
+        print("tokens estimated as four characters per token, tiktoken is unavailable")
+        return approximate_num_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10)
+    args = parser.parse_args()
+    count = token_counter()
+    total_repr = total_encoded = 0
+    for name, results in result_shapes(args.rows).items():
+        repr_tokens = count(str(results))
+        encoded_tokens = count(encode_results(results))
+        total_repr += repr_tokens
+        total_encoded += encoded_tokens
+        print(
+            f"{name:<18} repr={repr_tokens:6} encoded={encoded_tokens:6} "
+            f"saved={1 - encoded_tokens / repr_tokens:6.1%}"
+        )
+    print(
+        f"{'total':<18} repr={total_repr:6} encoded={total_encoded:6} "
+        f"saved={1 - total_encoded / total_repr:6.1%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Prompt tokens of the schema serialisations in driver.neo4j.SCHEMA_FORMATS.
+
+Uses the benchmark schema modelled on the IFRC graph, or a structured schema
+saved as JSON with `node_props`, `rel_props` and `rels`, e.g. the
+`structured_schema` of a connected database. Tokens are counted with the
+model's tiktoken encoder if it can be loaded, otherwise estimated from the
+length. Run from api/src:
+
+    python -m benchmarks.schema_formats --schema schema.json
+"""
+import argparse
+import json
+
+from benchmarks.stubs import DEFAULT_SCHEMA
+from driver.neo4j import SCHEMA_FORMATS, format_schema
+from llm.prompt_profiler import count_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--schema", help="structured schema as JSON")
+    parser.add_argument("--model", default="gpt-3.5-turbo-16k")
+    args = parser.parse_args()
+    schema = DEFAULT_SCHEMA
+    if args.schema:
+        with open(args.schema) as f:
+            schema = json.load(f)
+
+    raw_tokens = count_tokens(args.model, format_schema(schema, "raw"))
+    for schema_format in SCHEMA_FORMATS:
+        text = format_schema(schema, schema_format)
+        tokens = count_tokens(args.model, text)
+        print(
+            f"{schema_format:<8} chars={len(text):6} tokens={tokens:6} "
+            f"saved={1 - tokens / raw_tokens:6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
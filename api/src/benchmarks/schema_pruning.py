@@ -0,0 +1,55 @@
+"""
+Checks Text2Cypher schema pruning against a script of questions and Cypher.
+
+For every question, prints the labels the schema index selects, or that the
+full schema is used, and the labels of the scripted Cypher that pruning would
+drop. Uses the benchmark schema modelled on the IFRC graph, or a structured
+schema saved as JSON with `node_props`, `rel_props` and `rels`. Exits with
+status 1 if any question loses a label its Cypher needs. Run from api/src:
+
+    python -m benchmarks.schema_pruning --script recorded.jsonl --schema schema.json
+"""
+import argparse
+import json
+import re
+import sys
+
+from benchmarks.stubs import DEFAULT_SCHEMA, DEFAULT_SCRIPT, load_script
+from driver.schema_index import SchemaIndex
+
+
+def cypher_labels(cypher: str) -> set:
+    """Node labels in the patterns of a Cypher statement"""
+    return set(re.findall(r"\(\s*\w*\s*:\s*`?(\w+)`?", cypher))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--script", help="JSON lines file with question, cypher, rows and summary"
+    )
+    parser.add_argument("--schema", help="structured schema as JSON")
+    args = parser.parse_args()
+    script = load_script(args.script) if args.script else DEFAULT_SCRIPT
+    schema = DEFAULT_SCHEMA
+    if args.schema:
+        with open(args.schema) as f:
+            schema = json.load(f)
+
+    index = SchemaIndex(**schema)
+    failures = 0
+    for entry in script:
+        selected = index.select(entry["question"])
+        needed = cypher_labels(entry["cypher"])
+        missing = set() if selected is None else needed - selected
+        failures += bool(missing)
+        print(entry["question"])
+        print(f"  selected: {'full schema' if selected is None else sorted(selected)}")
+        if missing:
+            print(f"  MISSING:  {sorted(missing)}")
+    print(f"{len(script)} questions, {failures} lose labels their Cypher needs")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmark of the WebSocket framing of streamed answers.
+
+Starts a uvicorn server with the stub backend per configuration and has many
+concurrent clients ask the same question, whose scripted answer streams a few
+hundred tokens. Reports the frames each session received, the frames per
+second the server sent and the server's CPU time per session, read from
+/proc (Linux only). The configurations compare sending every token as its own
+frame with the StreamBatcher, with and without permessage-deflate. Run from
+api/src:
+
+    python -m benchmarks.stream_frames --clients 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import websockets
+
+from benchmarks.cold_start import free_port, wait_for
+
+QUESTION = "Can you give me a report on the national societies?"
+
+# name, flush interval in milliseconds, permessage-deflate
+CONFIGURATIONS = [
+    ("per token", 0, False),
+    ("per token + deflate", 0, True),
+    ("batched", 50, False),
+    ("batched + deflate", 50, True),
+]
+
+
+def long_script(words: int):
+    summary = " ".join(
+        f"The national society number {i} responded to the floods."
+        for i in range(words // 9 + 1)
+    )
+    return [
+        {
+            "question": QUESTION,
+            "cypher": "MATCH (n:NationalSociety) RETURN n.name AS name",
+            "rows": [{"name": "Nepal Red Cross Society"}],
+            "summary": summary,
+        }
+    ]
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        # utime and stime, after the command name which may contain spaces
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def session(url: str, deflate: bool) -> int:
+    frames = 0
+    compression = "deflate" if deflate else None
+    async with websockets.connect(url, compression=compression) as websocket:
+        await websocket.send(json.dumps({"type": "question", "question": QUESTION}))
+        async for message in websocket:
+            frame = json.loads(message)
+            if frame["type"] == "error":
+                raise RuntimeError(frame["detail"])
+            if frame["type"] == "stream":
+                frames += 1
+            if frame["type"] == "end" and "generated_cypher" in frame:
+                return frames
+
+
+async def measure(args, interval_ms: int, deflate: bool):
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.stream_frames", "--serve"]
+    command += ["--port", str(port), "--words", str(args.words)]
+    command += ["--token-latency", str(args.token_latency)]
+    if deflate:
+        command.append("--deflate")
+    env = {
+        **os.environ,
+        "LOG_LEVEL": "WARNING",
+        "STREAM_FLUSH_INTERVAL_MS": str(interval_ms),
+    }
+    server = subprocess.Popen(command, env=env)
+    try:
+        base = f"127.0.0.1:{port}"
+        await wait_for(f"http://{base}/ready", time.perf_counter(), 60, 0.05)
+        cpu = cpu_seconds(server.pid)
+        start = time.perf_counter()
+        frames = await asyncio.gather(
+            *[session(f"ws://{base}/text2text", deflate) for _ in range(args.clients)]
+        )
+        duration = time.perf_counter() - start
+        cpu = cpu_seconds(server.pid) - cpu
+    finally:
+        server.terminate()
+        server.wait()
+    return sum(frames), duration, cpu
+
+
+def serve(args) -> None:
+    import uvicorn
+
+    from benchmarks.replay import load_app
+
+    args.script = long_script(args.words)
+    args.db_latency = 0.05
+    args.llm_latency = 0.1
+    app = load_app(args)
+    uvicorn.run(
+        app,
+        port=args.port,
+        host="127.0.0.1",
+        log_level="warning",
+        ws_per_message_deflate=args.deflate,
+    )
+
+
+async def run(args) -> None:
+    print(f"clients={args.clients} tokens per answer={args.words}")
+    for name, interval_ms, deflate in CONFIGURATIONS:
+        frames, duration, cpu = await measure(args, interval_ms, deflate)
+        print(
+            f"{name:<22} frames/session={frames / args.clients:7.1f} "
+            f"frames/s={frames / duration:9.0f} "
+            f"cpu/session={cpu / args.clients * 1000:7.2f}ms"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--token-latency", type=float, default=0.005)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--deflate", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
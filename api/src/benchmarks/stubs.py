@@ -0,0 +1,292 @@
+"""
+Offline stand-ins for the OpenAI and Neo4j backends used by the benchmarks.
+
+StubLLM replays scripted responses with a configurable latency and
+StubNeo4jDatabase returns canned rows, so the real components can be driven
+without network access or API spend.
+"""
+import asyncio
+import json
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from driver.neo4j import AsyncNeo4jDatabase, BaseNeo4jDatabase, Neo4jDatabase
+from llm.basellm import BaseLLM
+
+def schema_node(label: str, **properties: str) -> Dict[str, Any]:
+    return {
+        "labels": label,
+        "properties": [
+            {"property": name, "type": type} for name, type in properties.items()
+        ],
+    }
+
+
+def schema_rel(start: str, type: str, end: str) -> Dict[str, str]:
+    return {"start": start, "type": type, "end": end}
+
+
+# Modelled on the IFRC knowledge graph the few-shot examples are written for
+DEFAULT_SCHEMA = {
+    "node_props": [
+        schema_node("NationalSociety", name="STRING", founded="INTEGER", website="STRING"),
+        schema_node("Country", iso3="STRING", name="STRING", population="INTEGER"),
+        schema_node("Region", name="STRING"),
+        schema_node("IncomeGroup", name="STRING"),
+        schema_node("Crisis", name="STRING", startDate="DATE", peopleAffected="INTEGER"),
+        schema_node("Driver", name="STRING"),
+        schema_node("Hazard", name="STRING"),
+        schema_node("Appeal", code="STRING", amountRequested="FLOAT", startDate="DATE"),
+        schema_node("ResearchProject", project_title="STRING", year="INTEGER"),
+        schema_node("Lesson", excerpt="STRING", embedding="LIST"),
+        schema_node("Per_Component", name="STRING", area="STRING"),
+        schema_node("Principle", name="STRING", description="STRING"),
+        schema_node("Document", title="STRING", url="STRING", published="DATE"),
+        schema_node("Chunk", text="STRING", embedding="LIST"),
+    ],
+    "rel_props": [
+        {"type": "FUNDED_BY", "properties": [{"property": "amount", "type": "FLOAT"}]},
+    ],
+    "rels": [
+        schema_rel("NationalSociety", "LOCATED_IN", "Country"),
+        schema_rel("Country", "LOCATED_IN", "Region"),
+        schema_rel("Country", "IN_INCOME_GROUP", "IncomeGroup"),
+        schema_rel("Country", "AFFECTED_BY", "Crisis"),
+        schema_rel("Crisis", "HAS_DRIVER", "Driver"),
+        schema_rel("Crisis", "HAS_HAZARD", "Hazard"),
+        schema_rel("Appeal", "RESPONDS_TO", "Crisis"),
+        schema_rel("Appeal", "FUNDED_BY", "NationalSociety"),
+        schema_rel("ResearchProject", "INCLUDES", "Country"),
+        schema_rel("Lesson", "RELATED_TO", "Hazard"),
+        schema_rel("Lesson", "RELATED_TO", "Per_Component"),
+        schema_rel("Lesson", "FROM_APPEAL", "Appeal"),
+        schema_rel("Document", "HAS_CHUNK", "Chunk"),
+        schema_rel("Document", "ABOUT", "Crisis"),
+    ],
+}
+
+# question, cypher, rows returned by the database and the summary of them
+DEFAULT_SCRIPT = [
+    {
+        "question": "How many national societies are there?",
+        "cypher": "MATCH (n:NationalSociety) RETURN count(n) AS numberOfNationalSocieties",
+        "rows": [{"numberOfNationalSocieties": 191}],
+        "summary": "There are 191 national societies.",
+    },
+    {
+        "question": "How many national societies are there in Africa?",
+        "cypher": "MATCH (n:NationalSociety)-[:LOCATED_IN]->(:Country)-[:LOCATED_IN*]->(:Region {name: 'Africa'}) RETURN count(n) AS numberOfNationalSocieties",
+        "rows": [{"numberOfNationalSocieties": 49}],
+        "summary": "There are 49 national societies in Africa.",
+    },
+    {
+        "question": "Which national societies have been affected by an earthquake?",
+        "cypher": "MATCH (n:NationalSociety)-[:LOCATED_IN]->(:Country)-[:AFFECTED_BY]->(:Crisis)-[:HAS_DRIVER]->(:Driver {name: 'Earthquake'}) RETURN DISTINCT n.name AS NationalSociety",
+        "rows": [
+            {"NationalSociety": name}
+            for name in [
+                "Turkish Red Crescent",
+                "Syrian Arab Red Crescent",
+                "Nepal Red Cross Society",
+                "Haitian National Red Cross Society",
+                "Ecuadorian Red Cross",
+                "Japanese Red Cross Society",
+                "Indonesian Red Cross Society",
+                "Mexican Red Cross",
+                "Afghan Red Crescent Society",
+                "Moroccan Red Crescent",
+            ]
+        ],
+        "summary": "The national societies affected by an earthquake include the Turkish Red Crescent, the Syrian Arab Red Crescent, the Nepal Red Cross Society and seven others.",
+    },
+    {
+        "question": "What are the hazards?",
+        "cypher": "MATCH (h:Hazard) RETURN h.name AS hazard",
+        "rows": [
+            {"hazard": name}
+            for name in ["Cyclone", "Drought", "Earthquake", "Flood", "Strong Wind"]
+        ],
+        "summary": "- Cyclone\n- Drought\n- Earthquake\n- Flood\n- Strong Wind",
+    },
+]
+
+
+def load_script(path: str) -> List[Dict[str, Any]]:
+    """Loads a script recorded as JSON lines with question, cypher, rows and summary"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def approximate_num_tokens(string: str) -> int:
+    # Roughly four characters per token for English text, avoids downloading encodings
+    return (len(string) + 3) // 4
+
+
+class ScriptedResponder:
+    """Answers Text2Cypher and summary prompts from a script keyed by question"""
+
+    def __init__(self, script: List[Dict[str, Any]] = DEFAULT_SCRIPT) -> None:
+        self.script = script
+        self.by_question = {entry["question"].lower(): entry for entry in script}
+
+    def find(self, text: str) -> Dict[str, Any]:
+        text = text.lower()
+        for question, entry in self.by_question.items():
+            if question in text:
+                return entry
+        return self.script[0]
+
+    def __call__(self, messages: List[Dict[str, str]]) -> str:
+        system = messages[0]["content"]
+        prompt = messages[-1]["content"]
+        if "into Cypher query statements" in system:
+            return "```" + self.find(prompt)["cypher"] + "```"
+        if "natural language answer" in system:
+            question = re.search("Question: ```([\\w\\W]*?)```", prompt)
+            return self.find(question.group(1) if question else prompt)["summary"]
+        return "The user asked questions about national societies."
+
+
+class StubLLM(BaseLLM):
+    def __init__(
+        self,
+        responder: Callable[[List[Dict[str, str]]], str] = None,
+        latency: float = 0.5,
+        token_latency: float = 0.01,
+        block_event_loop: bool = False,
+        model_name: str = "stub",
+        **kwargs,
+    ) -> None:
+        """
+        latency is the time until a response or the first streamed token and
+        token_latency the time between streamed tokens. With block_event_loop
+        the async calls sleep synchronously, like a blocking client.
+        """
+        self.responder = responder or ScriptedResponder()
+        self.latency = latency
+        self.token_latency = token_latency
+        self.block_event_loop = block_event_loop
+        self.model = model_name
+        self.max_tokens = kwargs.get("max_tokens", 1000)
+        self.temperature = kwargs.get("temperature", 0.0)
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        time.sleep(self.latency)
+        return self.responder(messages)
+
+    async def generate_async(self, messages: List[Dict[str, str]]) -> str:
+        await self._sleep(self.latency)
+        return self.responder(messages)
+
+    async def _sleep(self, seconds: float) -> None:
+        if self.block_event_loop:
+            time.sleep(seconds)
+        else:
+            await asyncio.sleep(seconds)
+
+    async def generateStreaming(
+        self, messages: List[Dict[str, str]], onTokenCallback=None
+    ) -> List[str]:
+        response = self.responder(messages)
+        # Split into word sized tokens that keep their leading whitespace
+        tokens = re.findall(r"\s*\S+", response)
+        await self._sleep(self.latency)
+        for token in tokens:
+            await onTokenCallback(
+                {"choices": [{"delta": {"content": token}, "finish_reason": None}]}
+            )
+            await self._sleep(self.token_latency)
+        await onTokenCallback({"choices": [{"delta": {}, "finish_reason": "stop"}]})
+        return tokens
+
+    def num_tokens_from_string(self, string: str) -> int:
+        return approximate_num_tokens(string)
+
+    def max_allowed_token_length(self) -> int:
+        return 2049
+
+
+class StubNeo4jDatabase(Neo4jDatabase):
+    def __init__(
+        self,
+        script: List[Dict[str, Any]] = DEFAULT_SCRIPT,
+        latency: float = 0.05,
+        schema: Dict[str, List] = DEFAULT_SCHEMA,
+        **kwargs,
+    ) -> None:
+        """Returns the scripted rows for known Cypher statements after `latency` seconds"""
+        BaseNeo4jDatabase.__init__(self, host="stub")
+        self.rows = {entry["cypher"].strip(): entry["rows"] for entry in script}
+        self.latency = latency
+        self._set_schema(schema)
+
+    def _query(
+        self,
+        cypher_query: str,
+        params: Optional[Dict],
+        query_id: Optional[str],
+        enforce_limits: bool,
+    ) -> List[Dict[str, Any]]:
+        time.sleep(self.latency)
+        return self.rows.get(cypher_query.strip(), [])
+
+    def explain(self, cypher_query: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def cancel(self, query_id: str) -> None:
+        pass
+
+    def refresh_schema(self, use_cache: bool = True) -> None:
+        pass
+
+    def data_version(self) -> Optional[str]:
+        return None
+
+
+class AsyncStubNeo4jDatabase(AsyncNeo4jDatabase):
+    def __init__(
+        self,
+        script: List[Dict[str, Any]] = DEFAULT_SCRIPT,
+        latency: float = 0.05,
+        schema: Dict[str, List] = DEFAULT_SCHEMA,
+        initialize_latency: float = 0.0,
+        **kwargs,
+    ) -> None:
+        """
+        Async variant of StubNeo4jDatabase that waits without blocking the event
+        loop. initialize_latency stands in for connecting and loading the schema.
+        """
+        BaseNeo4jDatabase.__init__(self, host="stub")
+        self.rows = {entry["cypher"].strip(): entry["rows"] for entry in script}
+        self.latency = latency
+        self._set_schema(schema)
+        self.initialize_latency = initialize_latency
+
+    async def initialize(self) -> None:
+        await asyncio.sleep(self.initialize_latency)
+
+    async def close(self) -> None:
+        pass
+
+    async def _query(
+        self,
+        cypher_query: str,
+        params: Optional[Dict],
+        query_id: Optional[str],
+        enforce_limits: bool,
+    ) -> List[Dict[str, Any]]:
+        await asyncio.sleep(self.latency)
+        return self.rows.get(cypher_query.strip(), [])
+
+    async def explain(self, cypher_query: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    async def cancel(self, query_id: str) -> None:
+        pass
+
+    async def refresh_schema(self, use_cache: bool = True) -> None:
+        pass
+
+    async def data_version(self) -> Optional[str]:
+        return None
@@ -0,0 +1,83 @@
+"""
+Compares the latency of the sequential self-heal loop in Text2Cypher with the
+parallel candidate mode on a fixed question set.
+
+Uses the same environment variables as main.py and talks to the real OpenAI API
+and Neo4j database. Run from api/src:
+
+    python -m benchmarks.text2cypher_candidates --repeat 3 --candidates 3
+"""
+import argparse
+import os
+import time
+
+from benchmarks.utils import format_latencies
+from components.text2cypher import Text2Cypher
+from driver.neo4j import Neo4jDatabase
+from fewshot_examples import get_fewshot_examples
+from llm.openai import OpenAIChat
+
+QUESTIONS = [
+    "How many national societies are there?",
+    "How many national societies are there in Africa?",
+    "Which national societies have been affected by an earthquake?",
+    "Which research projects include Uganda?",
+    "What are the income groups?",
+    "What are the crisis drivers?",
+    "What are the hazards?",
+    "How many national societies have been affected by a cyclone?",
+    "Which countries in Asia have been affected by a flood?",
+    "Which hazards are related to the most lessons?",
+]
+
+
+def measure(text2cypher: Text2Cypher, repeat: int):
+    latencies = []
+    failures = 0
+    for _ in range(repeat):
+        for question in QUESTIONS:
+            start = time.perf_counter()
+            result = text2cypher.run(question)
+            latencies.append(time.perf_counter() - start)
+            output = result["output"]
+            if result["generated_cypher"] is None or (
+                output and "code" in output[0]
+            ):
+                failures += 1
+    return latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--candidates", type=int, default=3)
+    parser.add_argument("--model", default="gpt-3.5-turbo-16k")
+    args = parser.parse_args()
+
+    api_key = os.environ["OPENAI_API_KEY"]
+    database = Neo4jDatabase(
+        host=os.environ.get("NEO4J_URL", "neo4j+s://demo.neo4jlabs.com"),
+        user=os.environ.get("NEO4J_USER", "companies"),
+        password=os.environ.get("NEO4J_PASS", "companies"),
+        database=os.environ.get("NEO4J_DATABASE", "companies"),
+    )
+    llm = OpenAIChat(openai_api_key=api_key, model_name=args.model)
+
+    modes = {
+        "heal loop": 1,
+        f"{args.candidates} parallel candidates": args.candidates,
+    }
+    for name, candidates in modes.items():
+        text2cypher = Text2Cypher(
+            database=database,
+            llm=llm,
+            cypher_examples=get_fewshot_examples(api_key),
+            ignore_relationship_direction=False,
+            candidates=candidates,
+        )
+        latencies, failures = measure(text2cypher, args.repeat)
+        print(format_latencies(name, latencies) + f" failed={failures}")
+
+
+if __name__ == "__main__":
+    main()
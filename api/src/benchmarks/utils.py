@@ -0,0 +1,22 @@
+from typing import Dict, List
+
+from utils.metrics import percentile
+
+
+def summarize_latencies(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "max": max(values) if values else float("nan"),
+    }
+
+
+def format_latencies(name: str, values: List[float]) -> str:
+    summary = summarize_latencies(values)
+    return (
+        f"{name:<32} n={summary['count']:<5} "
+        f"p50={summary['p50'] * 1000:8.1f}ms "
+        f"p95={summary['p95'] * 1000:8.1f}ms "
+        f"max={summary['max'] * 1000:8.1f}ms"
+    )
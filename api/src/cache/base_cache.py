@@ -0,0 +1,50 @@
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from utils.metrics import CACHE_REQUESTS
+
+
+def cache_key(*parts: Any) -> str:
+    """Hashes JSON serialisable parts, such as prompt messages, into a cache key"""
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class BaseCache(ABC):
+    """Key value cache for JSON serialisable values.
+
+    Keys are grouped by namespace, e.g. "schema" or "cypher", and lookups are
+    counted per namespace in the metrics.
+    """
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        value = self._get(f"{namespace}:{key}")
+        CACHE_REQUESTS.inc(namespace=namespace, result="miss" if value is None else "hit")
+        return value
+
+    def set(
+        self, namespace: str, key: str, value: Any, ttl: Optional[float] = None
+    ) -> None:
+        """Stores value for ttl seconds, or until it is evicted when ttl is None"""
+        self._set(f"{namespace}:{key}", value, ttl)
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._delete(f"{namespace}:{key}")
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Any]:
+        """Returns the value or None if it is missing or expired"""
+
+    @abstractmethod
+    def _set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        """Stores the value"""
+
+    @abstractmethod
+    def _delete(self, key: str) -> None:
+        """Removes the value"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Removes all values"""
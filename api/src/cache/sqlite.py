@@ -0,0 +1,105 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from cache.base_cache import BaseCache
+
+create_table_query = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    created_at REAL NOT NULL
+)
+"""
+
+# Evict the oldest entries once the table is full, checked every N writes
+EVICTION_INTERVAL = 100
+
+
+class SQLiteCache(BaseCache):
+    """Cache in a SQLite database in WAL mode, shared by all processes on the host.
+
+    Gunicorn workers pointing at the same path share warm entries, and the
+    entries survive restarts. Readers never block the writer in WAL mode.
+    Once there are more than max_entries, or the values take more than
+    max_bytes, the oldest entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = "/tmp/nallm-cache.sqlite3",
+        max_entries: int = 100000,
+        busy_timeout: float = 5.0,
+        max_bytes: Optional[int] = None,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._writes = 0
+        self._connection().execute(create_table_query)
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, and new ones after a fork
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=self.busy_timeout, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _get(self, key: str) -> Optional[Any]:
+        row = (
+            self._connection()
+            .execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self._delete(key)
+            return None
+        return json.loads(value)
+
+    def _set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + ttl if ttl is not None else None, now),
+        )
+        self._writes += 1
+        if self._writes % EVICTION_INTERVAL == 0:
+            self._evict(connection, now)
+
+    def _evict(self, connection: sqlite3.Connection, now: float) -> None:
+        connection.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+        connection.execute(
+            "DELETE FROM cache WHERE key IN ("
+            "SELECT key FROM cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        if self.max_bytes is not None:
+            connection.execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM (SELECT key, SUM(length(value)) OVER "
+                "(ORDER BY created_at DESC) AS total FROM cache) WHERE total > ?)",
+                (self.max_bytes,),
+            )
+
+    def _delete(self, key: str) -> None:
+        self._connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        self._connection().execute("DELETE FROM cache")
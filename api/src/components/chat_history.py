@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from llm.basellm import BaseLLM
+
+logger = logging.getLogger(__name__)
+
+
+def generate_system_message() -> str:
+    return """
+Your task is to maintain a running summary of a conversation between a user and an assistant that answers questions about a Neo4j database.
+You will be given the current summary and the messages that happened after it.
+Return an updated summary that keeps the entities, filters, numbers and open questions needed to understand follow-up questions.
+Make the summary as concise as possible and do not use more than 150 words. Only return the summary, no other text.
+"""
+
+
+def generate_prompt(summary: str, messages: List[Dict[str, str]]) -> str:
+    conversation = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    return f"""Current summary:
+{summary or "There is no summary yet."}
+New messages:
+{conversation}
+"""
+
+
+class ChatHistory:
+    """
+    Chat history that keeps the newest messages within a token budget.
+
+    Older messages are folded into a rolling summary by the LLM in a background
+    task. Until the fold completes, the folded messages are still returned so
+    that no context is lost in between.
+    """
+
+    def __init__(self, llm: BaseLLM, max_tokens: int = 1000) -> None:
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.summary = ""
+        self._summary_tokens = 0
+        self.turns = []
+        self._messages = []
+        self._folding = []
+        self._unbounded_tokens = 0
+        self._fold_task: Optional[asyncio.Task] = None
+
+    def _num_tokens(self, message: Dict[str, str]) -> int:
+        return self.llm.num_tokens_from_string(message["content"])
+
+    def append(self, message: Dict[str, str]) -> None:
+        tokens = self._num_tokens(message)
+        self._messages.append((message, tokens))
+        self._unbounded_tokens += tokens
+
+    def get_messages(self) -> List[Dict[str, str]]:
+        messages = []
+        if self.summary:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": "Summary of the earlier conversation: " + self.summary,
+                }
+            )
+        messages.extend(message for message, _ in self._folding)
+        messages.extend(message for message, _ in self._messages)
+        return messages
+
+    def num_tokens(self) -> int:
+        """Number of tokens the history currently adds to a prompt"""
+        return (
+            self._summary_tokens
+            + sum(tokens for _, tokens in self._folding)
+            + sum(tokens for _, tokens in self._messages)
+        )
+
+    def record_prompt_tokens(self, prompt_tokens: int) -> Dict[str, int]:
+        """Records the prompt size of a turn next to the history size with and without the budget"""
+        turn = {
+            "prompt_tokens": prompt_tokens,
+            "history_tokens": self.num_tokens(),
+            "unbounded_history_tokens": self._unbounded_tokens,
+        }
+        self.turns.append(turn)
+        return turn
+
+    def compact(self) -> None:
+        """Starts folding the oldest messages into the summary if the budget is exceeded"""
+        if self._fold_task is not None and not self._fold_task.done():
+            return
+        tokens = sum(tokens for _, tokens in self._messages)
+        # Always keep the newest message verbatim
+        while tokens > self.max_tokens and len(self._messages) > 1:
+            message = self._messages.pop(0)
+            self._folding.append(message)
+            tokens -= message[1]
+        if self._folding:
+            self._fold_task = asyncio.create_task(self._fold())
+
+    async def _fold(self) -> None:
+        messages = [
+            {"role": "system", "content": generate_system_message()},
+            {
+                "role": "user",
+                "content": generate_prompt(
+                    self.summary, [message for message, _ in self._folding]
+                ),
+            },
+        ]
+        try:
+            summary = await asyncio.to_thread(self.llm.generate, messages)
+        except Exception as e:
+            summary = f"Error: {e}"
+        if summary.startswith("Error:"):
+            # Keep the messages around and try again on the next turn
+            logger.warning("Could not summarise chat history", extra={"error": summary})
+            return
+        self.summary = summary
+        self._summary_tokens = self.llm.num_tokens_from_string(summary)
+        self._folding = []
@@ -1,37 +1,150 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from cache.base_cache import BaseCache, cache_key
 from components.base_component import BaseComponent
 from components.summarize_cypher_result import SummarizeCypherResult
-from driver.neo4j import Neo4jDatabase
+from driver.neo4j import BaseNeo4jDatabase
 from llm.basellm import BaseLLM
+from utils.concurrency import call_async, run_sync
 
 HARD_LIMIT_CONTEXT_RECORDS = 10
 
+# Reports cached without a data version expire after this many seconds at most
+UNVERSIONED_CACHE_TTL = 300.0
+
+logger = logging.getLogger(__name__)
+
+# The lookups are scoped to the Organization label so that they use its name index
+company_query = """
+MATCH (n:Organization {name:$companyName})
+RETURN n.summary, n.isDissolved, n.nbrEmployees, n.name, n.motto, n.isPublic, n.revenue
+"""
+
+relation_query = """
+MATCH (n:Organization {name:$companyName})-[r]->(m) WHERE NOT m:Article
+OPTIONAL MATCH (m)-[:IN_COUNTRY]->(c:Country)
+WITH r,m,c
+RETURN r,m,c
+"""
+
+category_query = """
+MATCH (n:Organization {name:$companyName})-[:HAS_CATEGORY]-(c:IndustryCategory)
+RETURN c.name LIMIT 1
+"""
+
+article_query = """
+MATCH (n:Organization {name:$companyName})<-[:MENTIONS]-(a:Article)-[:HAS_CHUNK]->(c:Chunk)
+RETURN c.text, a.title, a.siteName
+"""
+
 
 class CompanyReport(BaseComponent):
     def __init__(
         self,
-        database: Neo4jDatabase,
+        database: BaseNeo4jDatabase,
         company: str,
         llm: BaseLLM,
+        cache: Optional[BaseCache] = None,
+        cache_ttl: Optional[float] = 86400.0,
     ) -> None:
+        """
+        With a cache, reports are reused until the data changes, detected by
+        the database's data version.
+        """
         self.database = database
         self.company = company
         self.llm = llm
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.summarize_results = SummarizeCypherResult(llm=llm)
 
     def run(self):
-        summarize_results = SummarizeCypherResult(
-            llm=self.llm,
+        return run_sync(self.run_async())
+
+    async def run_async(self):
+        if self.cache is None:
+            return await self.generate_report()
+
+        data_version = await call_async(self.database.data_version)
+        key = cache_key(self.company, data_version, getattr(self.llm, "model", None))
+        report = await call_async(self.cache.get, "company_report", key)
+        if report is not None:
+            return report
+
+        report = await self.generate_report()
+        ttl = self.cache_ttl
+        if data_version is None:
+            ttl = min(ttl or UNVERSIONED_CACHE_TTL, UNVERSIONED_CACHE_TTL)
+        await call_async(self.cache.set, "company_report", key, report, ttl)
+        return report
+
+    async def query(self, cypher: str, company: str) -> List[Dict[str, Any]]:
+        return await call_async(
+            self.database.query, cypher, {"companyName": company}
         )
-        print("CompanyReport")
-        company_data = self.database.query(
-            "MATCH (n {name:$companyName}) return n.summary, n.isDissolved, n.nbrEmployees, n.name, n.motto, n.isPublic, n.revenue",
-            {"companyName": self.company},
+
+    async def summarize_articles(
+        self, question: str, article_data: List[Dict[str, Any]]
+    ) -> str:
+        return await call_async(
+            self.summarize_results.run,
+            question,
+            article_data[:HARD_LIMIT_CONTEXT_RECORDS],
         )
-        print(company_data)
-        relation_data = self.database.query(
-            "MATCH (n {name:$companyName})-[r]->(m) WHERE NOT m:Article OPTIONAL MATCH (m)-[:IN_COUNTRY]->(c:Country) WITH r,m,c return r,m,c",
-            {"companyName": self.company},
+
+    async def category(self, company: str) -> Optional[str]:
+        category_result = await self.query(category_query, company)
+        if len(category_result) > 0:
+            return category_result[0]["c.name"]
+        return None
+
+    async def supplier(self, node: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "summary": node.get("summary", None),
+            "revenue": node.get("revenue", None),
+            "isDissolved": node.get("isDissolved", None),
+            "name": node.get("name", None),
+            "isPublic": node.get("isPublic", None),
+            "category": await self.category(node.get("name", None)),
+        }
+
+    async def subsidiary(self, node: Dict[str, Any]) -> Dict[str, Any]:
+        name = node.get("name", None)
+        category, article_data = await asyncio.gather(
+            self.category(name), self.query(article_query, name)
         )
-        print(relation_data)
+        logger.debug("Article data", extra={"output": article_data, "sampled": True})
+
+        output = "There is not articles about this company."
+        if len(article_data) > 0:
+            output = await self.summarize_articles(
+                "Can you summarize the following articles in 50 words about "
+                + name
+                + " ?",
+                article_data,
+            )
+        return {
+            "summary": node.get("summary", None),
+            "revenue": node.get("revenue", None),
+            "isDissolved": node.get("isDissolved", None),
+            "name": name,
+            "isPublic": node.get("isPublic", None),
+            "category": category,
+            "articleSummary": output,
+        }
+
+    async def generate_report(self) -> Dict[str, Any]:
+        logger.info("Generating company report", extra={"company": self.company})
+        company_data, relation_data, article_data = await asyncio.gather(
+            self.query(company_query, self.company),
+            self.query(relation_query, self.company),
+            self.query(article_query, self.company),
+        )
+        logger.debug("Company data", extra={"output": company_data})
+        logger.debug("Relation data", extra={"output": relation_data})
+
         company_data_output = {
             "name": company_data[0]["n.name"],
             "motto": company_data[0]["n.motto"],
@@ -41,13 +154,10 @@ class CompanyReport(BaseComponent):
             "isPublic": company_data[0]["n.isPublic"],
             "revenue": company_data[0].get("n.revenue", None),
         }
-        print(company_data_output)
-        print("all data fetched")
         offices = []
         suppliers = []
         subsidiaries = []
         for relation in relation_data:
-            print(relation)
             relation_type = relation["r"][1]
             if relation_type == "IN_CITY":
                 offices.append(
@@ -60,73 +170,35 @@ class CompanyReport(BaseComponent):
             elif relation_type == "HAS_CATEGORY":
                 company_data_output["industry"] = relation["m"]["name"]
             elif relation_type == "HAS_SUPPLIER":
-                category_result = self.database.query(
-                    "MATCH (n {name:$companyName})-[HAS_CATEGORY]-(c:IndustryCategory) return c.name LIMIT 1",
-                    {"companyName": relation["m"].get("name", None)},
-                )
-                category = None
-                if len(category_result) > 0:
-                    category = category_result[0]["c.name"]
-
-                suppliers.append(
-                    {
-                        "summary": relation["m"].get("summary", None),
-                        "revenue": relation["m"].get("revenue", None),
-                        "isDissolved": relation["m"].get("isDissolved", None),
-                        "name": relation["m"].get("name", None),
-                        "isPublic": relation["m"].get("isPublic", None),
-                        "category": category,
-                    }
-                )
+                suppliers.append(relation["m"])
             elif relation_type == "HAS_SUBSIDIARY":
-                category_result = self.database.query(
-                    "MATCH (n {name:$companyName})-[HAS_CATEGORY]-(c:IndustryCategory) return c.name LIMIT 1",
-                    {"companyName": relation["m"].get("name", None)},
-                )
-                category = None
-                if len(category_result) > 0:
-                    category = category_result[0]["c.name"]
-                article_data = self.database.query(
-                    "MATCH p=(n {name:$companyName})<-[:MENTIONS]-(a:Article)-[:HAS_CHUNK]->(c:Chunk) return  c.text, a.title, a.siteName",
-                    {"companyName": relation["m"].get("name", None)},
-                )
-                print("Article data: " + str(article_data))
-
-                output = "There is not articles about this company."
-                if len(article_data) > 0:
-                    output = summarize_results.run(
-                        "Can you summarize the following articles in 50 words about "
-                        + relation["m"].get("name", None)
-                        + " ?",
-                        article_data[:HARD_LIMIT_CONTEXT_RECORDS],
-                    )
-                subsidiaries.append(
-                    {
-                        "summary": relation["m"].get("summary", None),
-                        "revenue": relation["m"].get("revenue", None),
-                        "isDissolved": relation["m"].get("isDissolved", None),
-                        "name": relation["m"].get("name", None),
-                        "isPublic": relation["m"].get("isPublic", None),
-                        "category": category,
-                        "articleSummary": output,
-                    }
-                )
+                subsidiaries.append(relation["m"])
             elif relation_type == "HAS_CEO":
                 company_data_output["ceo"] = relation["m"]["name"]
         company_data_output["offices"] = offices
-        article_data = self.database.query(
-            "MATCH p=(n {name:$companyName})<-[:MENTIONS]-(a:Article)-[:HAS_CHUNK]->(c:Chunk) return  c.text, a.title, a.siteName",
-            {"companyName": self.company},
-        )
 
-        output = summarize_results.run(
-            "Can you summarize the following articles about " + self.company + " ?",
-            article_data[:HARD_LIMIT_CONTEXT_RECORDS],
+        # The article summary only needs the articles, run it alongside the
+        # supplier and subsidiary lookups
+        article_summary = asyncio.ensure_future(
+            self.summarize_articles(
+                "Can you summarize the following articles about "
+                + self.company
+                + " ?",
+                article_data,
+            )
         )
-        print("output: " + output)
+        try:
+            suppliers, subsidiaries = await asyncio.gather(
+                asyncio.gather(*[self.supplier(node) for node in suppliers]),
+                asyncio.gather(*[self.subsidiary(node) for node in subsidiaries]),
+            )
+            output = await article_summary
+        finally:
+            article_summary.cancel()
+        logger.debug("Article summary", extra={"output": output})
         return {
             "company": company_data_output,
-            "subsidiaries": subsidiaries,
-            "suppliers": suppliers,
+            "subsidiaries": list(subsidiaries),
+            "suppliers": list(suppliers),
             "articleSummary": output,
         }
@@ -3,6 +3,7 @@ import re
 from itertools import groupby
 
 from components.base_component import BaseComponent
+from utils.metrics import time_stage
 from utils.unstructured_data_utils import (
     nodesTextToListOfDict,
     relationshipTextToListOfDict,
@@ -79,7 +80,8 @@ class DataDisambiguation(BaseComponent):
                 {"role": "system", "content": generate_system_message_for_nodes()},
                 {"role": "user", "content": generate_prompt(disString)},
             ]
-            rawNodes = self.llm.generate(messages)
+            with time_stage("disambiguate"):
+                rawNodes = self.llm.generate(messages)
 
             n = re.findall(internalRegex, rawNodes)
 
@@ -109,7 +111,8 @@ class DataDisambiguation(BaseComponent):
             },
             {"role": "user", "content": generate_prompt(relationship_data)},
         ]
-        rawRelationships = self.llm.generate(messages)
+        with time_stage("disambiguate"):
+            rawRelationships = self.llm.generate(messages)
         rels = re.findall(internalRegex, rawRelationships)
         new_relationships.extend(relationshipTextToListOfDict(rels))
         return {"nodes": new_nodes, "relationships": new_relationships}
@@ -1,19 +1,33 @@
-from typing import Any, Dict, List, Union
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+from cache.base_cache import BaseCache, cache_key
 from components.base_component import BaseComponent
-from driver.neo4j import Neo4jDatabase
+from driver.neo4j import BaseNeo4jDatabase
+from driver.reservoir import NodeReservoir
 from llm.basellm import BaseLLM
+from utils.concurrency import call_async, run_sync
+from utils.metrics import time_stage
 import re
 
+logger = logging.getLogger(__name__)
+
 
 class QuestionProposalGenerator(BaseComponent):
     def __init__(
         self,
         llm: BaseLLM,
-        database: Neo4jDatabase,
+        database: BaseNeo4jDatabase,
+        reservoir: Optional[NodeReservoir] = None,
+        schema_format: str = "raw",
     ) -> None:
+        """The database sample comes from the reservoir if it has one"""
         self.llm = llm
         self.database = database
+        self.reservoir = reservoir
+        self.schema_format = schema_format
 
     def get_system_message(self) -> str:
         system = f"""
@@ -21,31 +35,43 @@ class QuestionProposalGenerator(BaseComponent):
         The questions should be separated by a new line and each line should only contain one question.
         To do this, you need to understand the schema of the database. Therefore it's very important that you read the schema carefully. You can find the schema below.
         Schema: 
-        {self.database.schema}
+        {self.database.formatted_schema(self.schema_format)}
         """
 
         return system
 
-    def get_database_sample(self) -> str:
-        return self.database.query(
+    async def get_database_sample(self) -> str:
+        if self.reservoir is not None:
+            sample = self.reservoir.sample_any(5)
+            if sample:
+                return sample
+        return await call_async(
+            self.database.query,
             """MATCH (n)
                 WITH n
                 WHERE rand() < 0.3
                 RETURN apoc.map.removeKey(n, 'embedding') AS properties, LABELS(n) as labels
-                LIMIT 5"""
+                LIMIT 5""",
         )
 
     def run(self) -> Dict[str, Union[str, List[Dict[str, Any]]]]:
+        return run_sync(self.run_async())
+
+    async def run_async(self) -> Dict[str, Union[str, List[Dict[str, Any]]]]:
         messages = [{"role": "system", "content": self.get_system_message()}]
-        sample = self.get_database_sample()
+        sample = await self.get_database_sample()
         messages.append(
             {
                 "role": "user",
                 "content": f"""Please generate 5 questions about the content of the database. Here is a sample of the database you can use when generating questions: {sample}""",
             }
         )
-        print(messages)
-        questionsString = self.llm.generate(messages)
+        logger.debug(
+            "Generating question proposals",
+            extra={"messages": messages, "sampled": True},
+        )
+        with time_stage("question_proposals"):
+            questionsString = await call_async(self.llm.generate, messages)
         questions = [
             # remove number and dot from the beginning of the question
             re.sub(r"\A\d\.?\s*", "", question)
@@ -54,3 +80,99 @@ class QuestionProposalGenerator(BaseComponent):
         return {
             "output": questions,
         }
+
+
+class QuestionProposals:
+    """Question proposals generated off the request path, once per schema version.
+
+    `refresh` starts generating proposals in the background unless the current
+    schema version already has them, in memory or in the shared cache. `get`
+    only returns what is stored, the proposals of the previous schema version
+    or the defaults until the new ones are ready, so token spend follows schema
+    changes rather than traffic. After a failed generation, the schema version
+    is not tried again for retry_interval seconds.
+    """
+
+    def __init__(
+        self,
+        database: BaseNeo4jDatabase,
+        create_generator: Callable[[str], QuestionProposalGenerator],
+        default: List[str],
+        cache: Optional[BaseCache] = None,
+        cache_ttl: Optional[float] = None,
+        retry_interval: float = 300.0,
+    ) -> None:
+        self.database = database
+        self.create_generator = create_generator
+        self.default = default
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.retry_interval = retry_interval
+        self.version = ""
+        self.proposals: List[str] = []
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Schema version of the last failed generation, and when it failed
+        self._failure: Optional[Tuple[str, float]] = None
+
+    def get(self) -> List[str]:
+        return self.proposals or self.default
+
+    def refresh(self, api_key: Optional[str]) -> None:
+        """Starts generating proposals for the current schema if there are none yet"""
+        version = self.database.schema_version
+        if not version or not api_key:
+            return
+        if version == self.version or version in self._tasks:
+            return
+        if self._failure is not None:
+            failed_version, failed_at = self._failure
+            if (
+                failed_version == version
+                and time.monotonic() - failed_at < self.retry_interval
+            ):
+                return
+        self._tasks[version] = asyncio.ensure_future(self._generate(version, api_key))
+
+    async def _generate(self, version: str, api_key: str) -> None:
+        # Databases with the same schema have different nodes to sample
+        key = cache_key(self.database.identity, version)
+        try:
+            proposals = None
+            if self.cache is not None:
+                proposals = await call_async(self.cache.get, "question_proposals", key)
+            if proposals is None:
+                result = await self.create_generator(api_key).run_async()
+                proposals = [q.strip() for q in result["output"] if q.strip()]
+                if not proposals or proposals[0].startswith("Error: "):
+                    logger.warning(
+                        "Could not generate question proposals",
+                        extra={"schema_version": version, "output": proposals},
+                    )
+                    self._failure = (version, time.monotonic())
+                    return
+                if self.cache is not None:
+                    await call_async(
+                        self.cache.set,
+                        "question_proposals",
+                        key,
+                        proposals,
+                        self.cache_ttl,
+                    )
+            # The schema may have changed again while generating
+            if version == self.database.schema_version:
+                self.version = version
+                self.proposals = proposals
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(
+                "Could not generate question proposals",
+                extra={"schema_version": version, "error": str(e)},
+            )
+            self._failure = (version, time.monotonic())
+        finally:
+            self._tasks.pop(version, None)
+
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
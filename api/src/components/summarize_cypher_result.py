@@ -1,7 +1,16 @@
-from typing import Any, Awaitable, Callable, Dict, List
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
+from cache.base_cache import BaseCache, cache_key
 from components.base_component import BaseComponent
 from llm.basellm import BaseLLM
+from llm.prompt_profiler import profiler
+from utils.concurrency import call_async
+from utils.metrics import STAGE_DURATION, time_stage
+from utils.result_encoding import encode_results
+
+logger = logging.getLogger(__name__)
 
 system = f"""
 Your task is to generate a natural language answer to a given question based on given data.
@@ -14,10 +23,12 @@ Use bullet points for lists longer than three items.
 
 def remove_large_lists(d: Dict[str, Any]) -> Dict[str, Any]:
     """
-    The idea is to remove all properties that have large lists (embeddings) or text as values
+    The idea is to remove all properties that have large lists (embeddings) or text as values.
+    Works on a copy, the caller's records are left as they are.
     """
     LIST_CUTOFF = 56
     CHARACTER_CUTOFF = 5000
+    d = dict(d)
     # iterate over all key-value pairs in the dictionary
     for key, value in d.items():
         # if the value is a list and has more than list cutoff elements
@@ -29,7 +40,7 @@ def remove_large_lists(d: Dict[str, Any]) -> Dict[str, Any]:
         # if the value is a dictionary
         elif isinstance(value, dict):
             # recurse into the nested dictionary
-            remove_large_lists(d[key])
+            d[key] = remove_large_lists(value)
     return d
 
 
@@ -37,34 +48,93 @@ class SummarizeCypherResult(BaseComponent):
     llm: BaseLLM
     exclude_embeddings: bool
 
-    def __init__(self, llm: BaseLLM, exclude_embeddings: bool = True) -> None:
+    def __init__(
+        self,
+        llm: BaseLLM,
+        exclude_embeddings: bool = True,
+        cache: Optional[BaseCache] = None,
+        cache_ttl: Optional[float] = 3600.0,
+    ) -> None:
+        """
+        With a cache, summaries are reused for the same question and results,
+        so they never outlive the data they describe.
+        """
         self.llm = llm
         self.exclude_embeddings = exclude_embeddings
-
-    def generate_user_prompt(self, question: str, results: List[Dict[str, str]]) -> str:
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+
+    def _cache_key(self, messages: List[Dict[str, str]]) -> str:
+        return cache_key(getattr(self.llm, "model", None), messages)
+
+    def _profile(
+        self, messages: List[Dict[str, str]], question: str, encoded_results: str
+    ) -> None:
+        profiler.record(
+            "summarize",
+            getattr(self.llm, "model", None),
+            messages,
+            question=question,
+            results=encoded_results,
+        )
+
+    def encode_results(self, results: List[Dict[str, Any]]) -> str:
+        """The results as they are written into the prompt"""
+        if self.exclude_embeddings:
+            results = [remove_large_lists(el) for el in results]
+        return encode_results(results)
+
+    def generate_user_prompt(self, question: str, encoded_results: str) -> str:
         return f"""
         Answer the question below, delimited by triple backticks.
         Question: ```{question}```
         Answer the question using the following data, delimited by triple backticks.
         Data:
-        ```{[remove_large_lists(el) for el in  results] if self.exclude_embeddings else results}```
+        ```{encoded_results}```
         """
 
+    def construct_messages(
+        self, question: str, encoded_results: str
+    ) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": system},
+            {
+                "role": "user",
+                "content": self.generate_user_prompt(question, encoded_results),
+            },
+        ]
+
     def run(
         self,
         question: str,
         results: List[Dict[str, Any]],
     ) -> Dict[str, str]:
-        messages = [
-            {"role": "system", "content": system},
-            {"role": "user", "content": self.generate_user_prompt(question, results)},
-        ]
+        # Encoded once, for the prompt and the profiler
+        encoded_results = self.encode_results(results)
+        messages = self.construct_messages(question, encoded_results)
 
-        print(f"Generating summary of cypher results with the following messages:\n\n{messages}\n")
+        logger.debug(
+            "Generating summary of cypher results",
+            extra={"messages": messages, "sampled": True},
+        )
 
-        output = self.llm.generate(messages)
+        if self.cache is not None:
+            key = self._cache_key(messages)
+            output = self.cache.get("summary", key)
+            if output is not None:
+                return output
 
-        print(f"LLM response with summary of cypher results:\n{output}\n")
+        self._profile(messages, question, encoded_results)
+        with time_stage("summarize"):
+            output = self.llm.generate(messages)
+
+        # LLM errors are returned as text, do not cache them
+        if self.cache is not None and not output.startswith("Error: "):
+            self.cache.set("summary", key, output, self.cache_ttl)
+
+        logger.debug(
+            "LLM response with summary of cypher results", extra={"output": output}
+        )
 
         return output
 
@@ -74,16 +144,54 @@ class SummarizeCypherResult(BaseComponent):
         results: List[Dict[str, Any]],
         callback: Callable[[str], Awaitable[Any]] = None,
     ) -> Dict[str, str]:
-        messages = [
-            {"role": "system", "content": system},
-            {"role": "user", "content": self.generate_user_prompt(question, results)},
-        ]
-
-        print(f"Streaming summary of cypher results with the following messages:\n\n{messages}\n")
-        print("LLM streamed response with summary of cypher results:\n")
-
-        output = await self.llm.generateStreaming(messages, onTokenCallback=callback)
-
-        print(output)
-
-        return "".join(output)
+        # Encoded once, for the prompt and the profiler
+        encoded_results = self.encode_results(results)
+        messages = self.construct_messages(question, encoded_results)
+
+        logger.debug(
+            "Streaming summary of cypher results",
+            extra={"messages": messages, "sampled": True},
+        )
+
+        if self.cache is not None:
+            key = self._cache_key(messages)
+            output = await call_async(self.cache.get, "summary", key)
+            if output is not None:
+                # Replay the cached summary in the shape of a streamed response
+                if callback is not None:
+                    await callback(
+                        {
+                            "choices": [
+                                {"delta": {"content": output}, "finish_reason": None}
+                            ]
+                        }
+                    )
+                    await callback({"choices": [{"delta": {}, "finish_reason": "stop"}]})
+                return output
+
+        self._profile(messages, question, encoded_results)
+        start = time.perf_counter()
+        first_token = True
+
+        async def onToken(token):
+            nonlocal first_token
+            if first_token:
+                first_token = False
+                STAGE_DURATION.observe(
+                    time.perf_counter() - start, stage="summarize_first_token"
+                )
+            if callback is not None:
+                await callback(token)
+
+        with time_stage("summarize"):
+            output = await self.llm.generateStreaming(messages, onTokenCallback=onToken)
+
+        logger.debug(
+            "LLM streamed response with summary of cypher results",
+            extra={"output": output},
+        )
+
+        output = "".join(output)
+        if self.cache is not None:
+            await call_async(self.cache.set, "summary", key, output, self.cache_ttl)
+        return output
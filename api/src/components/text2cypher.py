@@ -1,9 +1,21 @@
+import asyncio
+import logging
 import re
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+from cache.base_cache import BaseCache, cache_key
 from components.base_component import BaseComponent
-from driver.neo4j import Neo4jDatabase
+from driver.neo4j import QUERY_ERROR_CODES, BaseNeo4jDatabase, format_schema
 from llm.basellm import BaseLLM
+from llm.prompt_profiler import profiler
+from utils.concurrency import call_async, run_sync
+from utils.metrics import SCHEMA_PRUNING, time_stage
+
+logger = logging.getLogger(__name__)
+
+
+# Database error codes the LLM is asked to fix by regenerating the Cypher statement
+HEALABLE_ERROR_CODES = ("invalid_cypher", "query_timeout", "too_many_rows")
 
 
 def remove_relationship_direction(cypher):
@@ -14,19 +26,70 @@ class Text2Cypher(BaseComponent):
     def __init__(
         self,
         llm: BaseLLM,
-        database: Neo4jDatabase,
+        database: BaseNeo4jDatabase,
         use_schema: bool = True,
         cypher_examples: str = "",
         ignore_relationship_direction: bool = True,
+        candidates: int = 1,
+        candidate_temperature: float = 0.7,
+        cache: Optional[BaseCache] = None,
+        cache_ttl: Optional[float] = 3600.0,
+        prune_schema: bool = False,
+        schema_format: str = "raw",
     ) -> None:
+        """
+        schema_format is one of driver.neo4j.SCHEMA_FORMATS, "compact" writes
+        the schema in fewer tokens than the raw property maps.
+
+        With prune_schema the prompt only contains the labels the question
+        mentions and their neighbours, selected with the database's schema
+        index, or the full schema if the question matches none of them.
+
+        With candidates > 1 the LLM is asked for several Cypher statements at
+        once, each is validated with EXPLAIN in parallel and the first valid
+        one is executed, instead of waiting for a failed query to heal it.
+
+        With a cache, Cypher statements that ran without errors are reused for
+        the same prompt, which includes the schema, question and history.
+        Query results are never cached.
+        """
         self.llm = llm
         self.database = database
         self.cypher_examples = cypher_examples
         self.ignore_relationship_direction = ignore_relationship_direction
+        self.candidates = candidates
+        self.candidate_temperature = candidate_temperature
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.prune_schema = prune_schema
+        self.schema_format = schema_format
         if use_schema:
-            self.schema = database.schema
+            self.schema = database.formatted_schema(schema_format)
+
+    def schema_for(self, question: str, history=[]) -> Optional[str]:
+        schema = getattr(self, "schema", None)
+        if not schema or not self.prune_schema:
+            return schema
+        # Follow-up questions refer to what the user asked before
+        text = " ".join(
+            [m["content"] for m in history if m["role"] == "user"] + [question]
+        )
+        pruned = self.database.schema_index.prune(text)
+        if pruned is None:
+            return schema
+        return format_schema(pruned, self.schema_format)
+
+    def get_system_message(self, schema: Optional[str] = None) -> str:
+        if schema is None:
+            schema = getattr(self, "schema", None)
+        # A Text2Cypher is created per question, the database keeps the
+        # message for every request that shares the schema and examples
+        return self.database.prompt(
+            ("text2cypher", schema, self.cypher_examples),
+            lambda: self._build_system_message(schema),
+        )
 
-    def get_system_message(self) -> str:
+    def _build_system_message(self, schema: Optional[str]) -> str:
         system = """
         Your task is to convert questions about the contents of a Neo4j database into Cypher query statements that will return the data needed to answer those questions.
         
@@ -43,11 +106,11 @@ class Text2Cypher(BaseComponent):
         (n1:Label1 {property1: value1})-[:TYPE {property2: value2}]->(n2:Label2 {property3: value3})```
 
         """
-        if hasattr(self, 'schema') and self.schema:
+        if schema:
             system += f"""
             Step 3. Carefully review the database schema, delimited below between triple backticks, and identify the node labels, node properties, relationship types and relationship properties that can be used to formulate the Cypher query statement:
             Schema:
-            ```{self.schema}```
+            ```{schema}```
 
             Use only the node labels, node properties, relationship types and relationship properties that you find in the schema to construct a Cypher statement.
             """
@@ -75,8 +138,29 @@ class Text2Cypher(BaseComponent):
         """
         return system
 
-    def construct_cypher(self, question: str, history=[]) -> str:
-        messages = [{"role": "system", "content": self.get_system_message()}]
+    def profile_messages(
+        self, messages: List[Dict[str, str]], question: str, history=[]
+    ) -> None:
+        schema = self.schema_for(question, history)
+        if self.prune_schema and schema:
+            SCHEMA_PRUNING.inc(result="full" if schema == self.schema else "pruned")
+        profiler.record(
+            "text2cypher",
+            getattr(self.llm, "model", None),
+            messages,
+            schema=schema,
+            fewshot=self.cypher_examples,
+            history="".join(m["content"] for m in history),
+            question=question,
+        )
+
+    def construct_messages(self, question: str, history=[]) -> List[Dict[str, str]]:
+        messages = [
+            {
+                "role": "system",
+                "content": self.get_system_message(self.schema_for(question, history)),
+            }
+        ]
         messages.extend(history)
         messages.append(
             {
@@ -84,18 +168,116 @@ class Text2Cypher(BaseComponent):
                 "content": question,
             }
         )
-        
-        print(f"\nConstructing Cypher from the following messages:\n{[el for el in messages]}\n")
-        #print([el for el in messages if not el["role"] == "system"])
+        return messages
 
-        cypher = self.llm.generate(messages)
-        
-        print(f"LLM response with generated cypher:\n{cypher}\n")
+    def cypher_messages(self, question: str, history=[]) -> List[Dict[str, str]]:
+        messages = self.construct_messages(question, history)
+        logger.debug(
+            "Constructing Cypher", extra={"messages": messages, "sampled": True}
+        )
+        self.profile_messages(messages, question, history)
+        return messages
+
+    def construct_cypher(self, question: str, history=[]) -> str:
+        messages = self.cypher_messages(question, history)
+
+        with time_stage("text2cypher_generate"):
+            cypher = self.llm.generate(messages)
+
+        logger.debug("LLM response with generated cypher", extra={"response": cypher})
+
+        return cypher
+
+    async def construct_cypher_async(self, question: str, history=[]) -> str:
+        """construct_cypher, aborting the LLM request if the task is cancelled"""
+        messages = self.cypher_messages(question, history)
+
+        with time_stage("text2cypher_generate"):
+            cypher = await self.llm.generate_async(messages)
+
+        logger.debug("LLM response with generated cypher", extra={"response": cypher})
 
         return cypher
 
+    def extract_cypher(self, cypher: str) -> Optional[str]:
+        # finds the first string wrapped in triple backticks. Where the match include the backticks and the first group in the match is the cypher
+        match = re.search("```([\w\W]*?)```", cypher)
+        #match = cypher['cypher']
+        if match is None:
+            return None
+
+        extracted_cypher = match.group(1)
+
+        if self.ignore_relationship_direction:
+            extracted_cypher = remove_relationship_direction(extracted_cypher)
+
+        return extracted_cypher
+
+    async def construct_validated_cypher(
+        self, question: str, history=[]
+    ) -> Tuple[str, Optional[str], Optional[List[Dict[str, Any]]]]:
+        """
+        Generates several candidates and returns the raw response and Cypher
+        of the first one that passes EXPLAIN. If none is valid, the first
+        candidate is returned together with its EXPLAIN error so that it can
+        be healed.
+        """
+        messages = self.construct_messages(question, history)
+        logger.debug(
+            "Constructing Cypher candidates",
+            extra={"messages": messages, "sampled": True},
+        )
+        self.profile_messages(messages, question, history)
+        with time_stage("text2cypher_generate"):
+            responses = await self.llm.generate_candidates_async(
+                messages,
+                self.candidates,
+                temperature=self.candidate_temperature,
+            )
+        candidates = [
+            (response, self.extract_cypher(response)) for response in responses
+        ]
+        candidates = [(response, cypher) for response, cypher in candidates if cypher]
+        logger.debug("Generated Cypher candidates", extra={"candidates": candidates})
+        if not candidates:
+            return responses[0], None, None
+
+        async def validate(index, cypher):
+            return index, await call_async(self.database.explain, cypher)
+
+        tasks = [
+            asyncio.ensure_future(validate(index, cypher))
+            for index, (_, cypher) in enumerate(candidates)
+        ]
+        errors = {}
+        try:
+            with time_stage("text2cypher_validate"):
+                for task in asyncio.as_completed(tasks):
+                    index, error = await task
+                    if error is None:
+                        return candidates[index][0], candidates[index][1], None
+                    errors[index] = error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return candidates[0][0], candidates[0][1], [errors[0]]
+
     def run(
-        self, question: str, history: List = [], heal_cypher: bool = True
+        self,
+        question: str,
+        history: List = [],
+        heal_cypher: bool = True,
+        query_id: Optional[str] = None,
+    ) -> Dict[str, Union[str, List[Dict[str, Any]]]]:
+        return run_sync(self.run_async(question, history, heal_cypher, query_id))
+
+    async def run_async(
+        self,
+        question: str,
+        history: List = [],
+        heal_cypher: bool = True,
+        query_id: Optional[str] = None,
     ) -> Dict[str, Union[str, List[Dict[str, Any]]]]:
         # Add prefix if not part of self-heal loop
         final_question = (
@@ -103,30 +285,45 @@ class Text2Cypher(BaseComponent):
             if heal_cypher
             else question
         )
-        cypher = self.construct_cypher(final_question, history)
-        # finds the first string wrapped in triple backticks. Where the match include the backticks and the first group in the match is the cypher
-        match = re.search("```([\w\W]*?)```", cypher)
-        #match = cypher['cypher']
+        output = None
+        key = None
+        cached = None
+        if self.cache is not None and heal_cypher:
+            key = cache_key(
+                getattr(self.llm, "model", None),
+                self.construct_messages(final_question, history),
+            )
+            cached = await call_async(self.cache.get, "cypher", key)
+        if cached is not None:
+            cypher = "```" + cached + "```"
+            extracted_cypher = cached
+        elif heal_cypher and self.candidates > 1:
+            cypher, extracted_cypher, output = await self.construct_validated_cypher(
+                final_question, history
+            )
+        else:
+            cypher = await self.construct_cypher_async(final_question, history)
+            extracted_cypher = self.extract_cypher(cypher)
 
         # If the LLM didn't return any Cypher statement (error, missing context, etc..)
-        if match is None:
-            print("LLM didn't return any Cypher statement")
+        if extracted_cypher is None:
+            logger.info("LLM didn't return any Cypher statement")
             return {"output": [{"message": cypher}], "generated_cypher": None}
-        
-        extracted_cypher = match.group(1)
 
-        if self.ignore_relationship_direction:
-            print("Removing relationship direction")
-            extracted_cypher = remove_relationship_direction(extracted_cypher)
+        logger.info("Generated cypher", extra={"cypher": extracted_cypher})
 
-        print(f"Generated cypher:\n{extracted_cypher}\n")
-
-        output = self.database.query(extracted_cypher)
+        if output is None:
+            output = await call_async(
+                self.database.query, extracted_cypher, query_id=query_id
+            )
 
-        print(f"Database response from cypher query:\n\n{output}\n")
+        logger.debug(
+            "Database response from cypher query",
+            extra={"output": output, "sampled": True},
+        )
 
-        # Catch Cypher syntax error
-        if heal_cypher and output and output[0].get("code") == "invalid_cypher":
+        # Catch Cypher syntax errors, timeouts and oversized results
+        if heal_cypher and output and output[0].get("code") in HEALABLE_ERROR_CODES:
             syntax_messages = [{"role": "system", "content": self.get_system_message()}]
             syntax_messages.extend(
                 [
@@ -135,12 +332,32 @@ class Text2Cypher(BaseComponent):
                 ]
             )
             # Try to heal Cypher syntax only once
-            print("Trying to heal Cypher syntax")
-            return self.run(
-                output[0].get("message"), syntax_messages, heal_cypher=False
+            logger.info(
+                "Trying to heal Cypher syntax", extra={"code": output[0].get("code")}
             )
-        
-        return {
+            healed = await self.run_async(
+                output[0].get("message"),
+                syntax_messages,
+                heal_cypher=False,
+                query_id=query_id,
+            )
+            await self._store(key, healed)
+            return healed
+
+        result = {
             "output": output,
             "generated_cypher": extracted_cypher,
         }
+        await self._store(key, result)
+        return result
+
+    async def _store(self, key: Optional[str], result: Dict[str, Any]) -> None:
+        # Only Cypher statements that ran without errors are worth reusing
+        if key is None or not result["generated_cypher"]:
+            return
+        output = result["output"]
+        if output and output[0].get("code") in QUERY_ERROR_CODES:
+            return
+        await call_async(
+            self.cache.set, "cypher", key, result["generated_cypher"], self.cache_ttl
+        )
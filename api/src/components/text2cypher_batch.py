@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+from uuid import uuid4
+
+from components.summarize_cypher_result import SummarizeCypherResult
+from components.text2cypher import Text2Cypher
+from utils.concurrency import call_async
+from utils.metrics import percentile
+
+logger = logging.getLogger(__name__)
+
+
+def latency_stats(latencies: List[float]) -> Optional[Dict[str, float]]:
+    if not latencies:
+        return None
+    # The same percentiles as the benchmarks report
+    return {
+        "mean": sum(latencies) / len(latencies),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": max(latencies),
+    }
+
+
+class Text2CypherBatch:
+    """Answers many independent questions with one Text2Cypher.
+
+    The questions share the Text2Cypher, so its system message with the
+    schema and few-shot examples is built once for the batch. At most
+    `concurrency` questions are in flight against the LLM and Neo4j at a time.
+    Results are yielded as the questions finish, followed by the timings of
+    the whole batch.
+    """
+
+    def __init__(
+        self,
+        text2cypher: Text2Cypher,
+        summarize: Optional[SummarizeCypherResult] = None,
+        concurrency: int = 8,
+        max_context_records: int = 10,
+    ) -> None:
+        self.text2cypher = text2cypher
+        self.summarize = summarize
+        self.concurrency = concurrency
+        self.max_context_records = max_context_records
+
+    async def answer(self, index: int, question: str) -> Dict[str, Any]:
+        result: Dict[str, Any] = {
+            "type": "result",
+            "index": index,
+            "question": question,
+        }
+        timings = {}
+        start = time.perf_counter()
+        query_id = uuid4().hex
+        try:
+            try:
+                results = await self.text2cypher.run_async(
+                    question, [], query_id=query_id
+                )
+            except asyncio.CancelledError:
+                await call_async(self.text2cypher.database.cancel, query_id)
+                raise
+            timings["cypher"] = time.perf_counter() - start
+            result["generated_cypher"] = results["generated_cypher"]
+            result["output"] = results["output"]
+            if self.summarize is not None:
+                summary_start = time.perf_counter()
+                result["summary"] = await self.summarize.run_async(
+                    question, results["output"][: self.max_context_records]
+                )
+                timings["summary"] = time.perf_counter() - summary_start
+        except Exception as e:
+            logger.warning(
+                "Batch question failed", extra={"index": index, "error": str(e)}
+            )
+            result["error"] = str(e)
+        timings["total"] = time.perf_counter() - start
+        result["timings"] = timings
+        return result
+
+    async def stream(self, questions: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        start = time.perf_counter()
+        running = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(index: int, question: str) -> Dict[str, Any]:
+            async with running:
+                return await self.answer(index, question)
+
+        tasks = [
+            asyncio.ensure_future(bounded(index, question))
+            for index, question in enumerate(questions)
+        ]
+        latencies: Dict[str, List[float]] = {"cypher": [], "summary": [], "total": []}
+        errors = 0
+        try:
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                if "error" in result:
+                    errors += 1
+                for stage, seconds in result["timings"].items():
+                    latencies[stage].append(seconds)
+                yield result
+        finally:
+            # Closed early, e.g. the client went away, stop spending tokens
+            for task in tasks:
+                task.cancel()
+
+        elapsed = time.perf_counter() - start
+        yield {
+            "type": "stats",
+            "questions": len(questions),
+            "errors": errors,
+            "concurrency": self.concurrency,
+            "elapsed": elapsed,
+            "questions_per_second": len(questions) / elapsed if elapsed else None,
+            "latency": {
+                stage: latency_stats(values) for stage, values in latencies.items()
+            },
+        }
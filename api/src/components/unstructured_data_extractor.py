@@ -1,14 +1,20 @@
+import logging
 import re
 import os
-from typing import List
+from typing import Dict, List, Union
 
 from components.base_component import BaseComponent
+from driver.neo4j import format_schema
 from llm.basellm import BaseLLM
+from llm.prompt_profiler import profiler
+from utils.metrics import time_stage
 from utils.unstructured_data_utils import (
     nodesTextToListOfDict,
     relationshipTextToListOfDict,
 )
 
+logger = logging.getLogger(__name__)
+
 
 def generate_system_message_with_schema() -> str:
     return """
@@ -131,8 +137,12 @@ class DataExtractor(BaseComponent):
             {"role": "system", "content": generate_system_message()},
             {"role": "user", "content": generate_prompt(chunk)},
         ]
-        print(messages)
-        output = self.llm.generate(messages)
+        logger.debug("Extracting data", extra={"messages": messages, "sampled": True})
+        profiler.record(
+            "extract", getattr(self.llm, "model", None), messages, data=chunk
+        )
+        with time_stage("extract"):
+            output = self.llm.generate(messages)
         return output
 
     def process_with_labels(self, chunk, labels):
@@ -140,8 +150,16 @@ class DataExtractor(BaseComponent):
             {"role": "system", "content": generate_system_message_with_schema()},
             {"role": "user", "content": generate_prompt_with_labels(chunk, labels)},
         ]
-        print(messages)
-        output = self.llm.generate(messages)
+        logger.debug("Extracting data", extra={"messages": messages, "sampled": True})
+        profiler.record(
+            "extract",
+            getattr(self.llm, "model", None),
+            messages,
+            data=chunk,
+            labels=labels,
+        )
+        with time_stage("extract"):
+            output = self.llm.generate(messages)
         return output
 
     def run(self, data: str) -> List[str]:
@@ -156,14 +174,13 @@ class DataExtractor(BaseComponent):
 
         results = []
         labels = set()
-        print("Starting chunked processing")
+        logger.info("Starting chunked processing", extra={"chunks": len(chunked_data)})
         for chunk in chunked_data:
             proceededChunk = self.process_with_labels(chunk, list(labels))
-            print("proceededChunk", proceededChunk)
+            logger.debug("Processed chunk", extra={"output": proceededChunk})
             chunkResult = getNodesAndRelationshipsFromResult([proceededChunk])
-            print("chunkResult", chunkResult)
             newLabels = [node["label"] for node in chunkResult["nodes"]]
-            print("newLabels", newLabels)
+            logger.debug("New labels", extra={"labels": newLabels})
             results.append(proceededChunk)
             labels.update(newLabels)
 
@@ -173,10 +190,14 @@ class DataExtractor(BaseComponent):
 class DataExtractorWithSchema(BaseComponent):
     llm: BaseLLM
 
-    def __init__(self, llm) -> None:
+    def __init__(self, llm, schema_format: str = "raw") -> None:
+        """Structured schemas, as kept by the database, are written in schema_format"""
         self.llm = llm
+        self.schema_format = schema_format
 
-    def run(self, data: str, schema: str) -> List[str]:
+    def run(self, data: str, schema: Union[str, Dict[str, List]]) -> List[str]:
+        if isinstance(schema, dict):
+            schema = format_schema(schema, self.schema_format)
         system_message = generate_system_message_with_schema()
         prompt_string = (
             generate_system_message_with_schema()
@@ -190,10 +211,9 @@ class DataExtractorWithSchema(BaseComponent):
             llm=self.llm, string=data, token_use_per_string=token_usage_per_prompt
         )
         result = []
-        print("Starting chunked processing")
+        logger.info("Starting chunked processing", extra={"chunks": len(chunked_data)})
 
         for chunk in chunked_data:
-            print("prompt", generate_prompt_with_schema(chunk, schema))
             messages = [
                 {
                     "role": "system",
@@ -201,6 +221,17 @@ class DataExtractorWithSchema(BaseComponent):
                 },
                 {"role": "user", "content": generate_prompt_with_schema(chunk, schema)},
             ]
-            output = self.llm.generate(messages)
+            logger.debug(
+                "Extracting data", extra={"messages": messages, "sampled": True}
+            )
+            profiler.record(
+                "extract_with_schema",
+                getattr(self.llm, "model", None),
+                messages,
+                data=chunk,
+                schema=schema,
+            )
+            with time_stage("extract"):
+                output = self.llm.generate(messages)
             result.append(output)
         return getNodesAndRelationshipsFromResult(result)
@@ -1,6 +1,25 @@
-from typing import Any, Dict, List, Optional
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Callable, Dict, Hashable, List, Optional
 
-from neo4j import GraphDatabase, exceptions
+from cache.base_cache import BaseCache
+from driver.schema_index import SchemaIndex
+from neo4j import (
+    READ_ACCESS,
+    WRITE_ACCESS,
+    AsyncGraphDatabase,
+    GraphDatabase,
+    exceptions,
+)
+from utils.concurrency import call_async
+from utils.metrics import NEO4J_QUERIES, NEO4J_WASTED_SECONDS, time_stage
+
+logger = logging.getLogger(__name__)
 
 node_properties_query = """
 CALL apoc.meta.data()
@@ -23,11 +42,56 @@ rel_query = """
 CALL apoc.meta.data()
 YIELD label, other, elementType, type, property
 WHERE type = "RELATIONSHIP" AND elementType = "node"
-RETURN "(:" + label + ")-[:" + property + "]->(:" + toString(other[0]) + ")" AS output
+RETURN {start: label, type: property, end: toString(other[0])} AS output
+"""
+
+find_transactions_query = """
+SHOW TRANSACTIONS
+YIELD transactionId, metaData
+WHERE metaData.query_id = $query_id
+RETURN transactionId
 """
 
+terminate_transactions_query = "TERMINATE TRANSACTIONS $transaction_ids"
+
+data_version_query = """
+SHOW DATABASE $database
+YIELD lastCommittedTxn
+RETURN lastCommittedTxn
+"""
+
+# Error codes returned when a transaction exceeds its timeout or is terminated
+TIMEOUT_ERROR_CODES = (
+    "Neo.ClientError.Transaction.TransactionTimedOut",
+    "Neo.ClientError.Transaction.TransactionTimedOutClientConfiguration",
+)
+TERMINATED_ERROR_CODES = (
+    "Neo.ClientError.Transaction.Terminated",
+    "Neo.TransientError.Transaction.Terminated",
+)
+
+# Codes of the error records returned by `query` instead of raising
+QUERY_ERROR_CODES = (
+    "invalid_cypher",
+    "query_timeout",
+    "too_many_rows",
+    "cancelled",
+    "error",
+)
+
+# Number of cancelled query ids remembered for queries that have not started yet
+MAX_PENDING_CANCELLATIONS = 1024
+
+# Number of prompts, e.g. one per distinct pruned schema, kept per schema version
+MAX_PROMPTS = 256
+
+
+def relationship_pattern(rel: Dict[str, str]) -> str:
+    return f"(:{rel['start']})-[:{rel['type']}]->(:{rel['end']})"
+
 
 def schema_text(node_props, rel_props, rels) -> str:
+    rels = [relationship_pattern(rel) for rel in rels]
     return f"""
   This is the schema representation of the Neo4j database.
   Node properties are the following:
@@ -39,86 +103,417 @@ def schema_text(node_props, rel_props, rels) -> str:
   """
 
 
-class Neo4jDatabase:
+def properties_text(properties: List[Dict[str, str]]) -> str:
+    # Duplicate properties, e.g. one per value type, are listed once
+    types = {}
+    for prop in properties:
+        types.setdefault(prop["property"], prop["type"])
+    return ", ".join(f"{name}: {type}" for name, type in types.items())
+
+
+def compact_schema_text(node_props, rel_props, rels) -> str:
+    """The schema as `Label {property: TYPE}` lines and deduplicated patterns"""
+    lines = ["Node labels and their properties:"]
+    for node in node_props:
+        properties = properties_text(node["properties"])
+        if properties:
+            lines.append(f"{node['labels']} {{{properties}}}")
+        else:
+            lines.append(node["labels"])
+    if rel_props:
+        lines.append("Relationship types and their properties:")
+        for rel in rel_props:
+            lines.append(f"{rel['type']} {{{properties_text(rel['properties'])}}}")
+    lines.append("Relationships:")
+    lines.extend(dict.fromkeys(relationship_pattern(rel) for rel in rels))
+    return "\n".join(lines)
+
+
+# Schema serialisations, selectable per prompt
+SCHEMA_FORMATS = {"raw": schema_text, "compact": compact_schema_text}
+
+
+def format_schema(
+    structured_schema: Dict[str, List], schema_format: str = "raw"
+) -> str:
+    return SCHEMA_FORMATS[schema_format](**structured_schema)
+
+
+class RowLimitExceeded(Exception):
+    def __init__(self, max_rows: int) -> None:
+        super().__init__(f"Query returned more than {max_rows} rows")
+        self.max_rows = max_rows
+
+
+def error_output(
+    e: Exception, timeout: Optional[float]
+) -> Optional[List[Dict[str, Any]]]:
+    """Translates a query exception into the error record returned by `query`
+
+    Returns None for errors that should be raised to the caller.
+    """
+    if isinstance(e, RowLimitExceeded):
+        return [
+            {
+                "code": "too_many_rows",
+                "message": f"The Cypher statement returned more than {e.max_rows} rows. "
+                "Rewrite it to aggregate the data or to return fewer rows.",
+            }
+        ]
+    # Catch Cypher syntax errors
+    if isinstance(e, exceptions.CypherSyntaxError):
+        return [
+            {
+                "code": "invalid_cypher",
+                "message": f"Invalid Cypher statement due to an error: {e}",
+            }
+        ]
+    if not isinstance(e, exceptions.Neo4jError):
+        return None
+    if e.code in TIMEOUT_ERROR_CODES:
+        return [
+            {
+                "code": "query_timeout",
+                "message": f"The Cypher statement did not finish within {timeout} seconds. "
+                "Rewrite it so that it touches fewer nodes, for example by "
+                "bounding variable-length patterns.",
+            }
+        ]
+    if e.code in TERMINATED_ERROR_CODES:
+        return [{"code": "cancelled", "message": "The query was cancelled"}]
+    # Catch access mode errors
+    if e.code == "Neo.ClientError.Statement.AccessMode":
+        return [
+            {
+                "code": "error",
+                "message": "Couldn't execute the query due to the read only access to Neo4j",
+            }
+        ]
+    if isinstance(e, exceptions.ClientError):
+        return [{"code": "error", "message": e}]
+    return None
+
+
+def connection_error(e: Exception) -> ValueError:
+    if isinstance(e, exceptions.AuthError):
+        return ValueError(
+            "Could not connect to Neo4j database. "
+            "Please ensure that the username and password are correct"
+        )
+    return ValueError(
+        "Could not connect to Neo4j database. "
+        "Please ensure that the url is correct"
+    )
+
+
+class BaseNeo4jDatabase:
+    """Configuration and bookkeeping shared by the sync and async databases"""
+
     def __init__(
         self,
-        host: str = "neo4j://localhost:7687",
-        user: str = "neo4j",
-        password: str = "pleaseletmein",
+        host: str,
         database: str = "neo4j",
         read_only: bool = True,
+        query_timeout: Optional[float] = 30.0,
+        max_rows: Optional[int] = 1000,
+        fetch_size: int = 1000,
+        cache: Optional[BaseCache] = None,
+        schema_cache_ttl: Optional[float] = 300.0,
     ) -> None:
-        """Initialize a neo4j database"""
-        self._driver = GraphDatabase.driver(host, auth=(user, password))
         self._database = database
         self._read_only = read_only
+        self._query_timeout = query_timeout
+        self._max_rows = max_rows
+        self._fetch_size = fetch_size
+        self._cache = cache
+        # Identifies the database in the keys of caches shared between databases
+        self.identity = f"{host}/{database}"
+        self._schema_cache_ttl = schema_cache_ttl
+        self._cancelled = OrderedDict()
+        self._cancelled_lock = threading.Lock()
         self.schema = ""
+        # Labels, properties and relationships the schema text is made from
+        self.structured_schema = {"node_props": [], "rel_props": [], "rels": []}
+        self.schema_index = SchemaIndex(**self.structured_schema)
+        self._formatted_schemas: Dict[str, str] = {}
+        self._prompts: Dict[Hashable, str] = {}
+        self.schema_version = ""
+        self._schema_listeners: List[Callable[[str], None]] = []
+
+    @staticmethod
+    def driver_config(
+        max_connection_pool_size: int,
+        connection_acquisition_timeout: float,
+        max_connection_lifetime: float,
+    ) -> Dict[str, Any]:
+        return {
+            "max_connection_pool_size": max_connection_pool_size,
+            "connection_acquisition_timeout": connection_acquisition_timeout,
+            "max_connection_lifetime": max_connection_lifetime,
+        }
+
+    def _session_config(self, read_only: bool) -> Dict[str, Any]:
+        return {
+            "database": self._database,
+            "default_access_mode": READ_ACCESS if read_only else WRITE_ACCESS,
+            "fetch_size": self._fetch_size,
+        }
+
+    @property
+    def max_rows(self) -> Optional[int]:
+        """Most rows a query may return when limits are enforced"""
+        return self._max_rows
+
+    def _limits(self, enforce_limits: bool):
+        if not enforce_limits:
+            return None, None
+        return self._query_timeout, self._max_rows
+
+    def _record(
+        self, output: List[Dict[str, Any]], query_id: Optional[str]
+    ) -> List[Dict[str, Any]]:
+        status = output[0].get("code") if output else None
+        NEO4J_QUERIES.inc(status=status if status in QUERY_ERROR_CODES else "ok")
+        if status in QUERY_ERROR_CODES:
+            logger.info(
+                "Neo4j query failed",
+                extra={"code": status, "query_id": query_id},
+            )
+        return output
+
+    def _mark_cancelled(self, query_id: str) -> None:
+        with self._cancelled_lock:
+            self._cancelled[query_id] = True
+            while len(self._cancelled) > MAX_PENDING_CANCELLATIONS:
+                self._cancelled.popitem(last=False)
+
+    def _pop_cancelled(self, query_id: str) -> bool:
+        with self._cancelled_lock:
+            return self._cancelled.pop(query_id, False)
+
+    def _data_version(self, records) -> Optional[str]:
+        # One row per server in a cluster
+        versions = [r["lastCommittedTxn"] for r in records]
+        versions = [v for v in versions if v is not None]
+        return str(max(versions)) if versions else None
+
+    def add_schema_listener(self, listener: Callable[[str], None]) -> None:
+        """Calls listener with the new schema version whenever the schema changes"""
+        self._schema_listeners.append(listener)
+
+    def formatted_schema(self, schema_format: str = "raw") -> str:
+        """The schema in one of SCHEMA_FORMATS, rendered once per schema version"""
+        if schema_format not in self._formatted_schemas:
+            self._formatted_schemas[schema_format] = format_schema(
+                self.structured_schema, schema_format
+            )
+        return self._formatted_schemas[schema_format]
+
+    def prompt(self, key: Hashable, build: Callable[[], str]) -> str:
+        """The prompt built by build for key, built once per key and schema version
+
+        Components are created per request, prompts kept here are reused by
+        every request to this database until its schema changes.
+        """
+        prompt = self._prompts.get(key)
+        if prompt is None:
+            prompt = build()
+            if len(self._prompts) < MAX_PROMPTS:
+                self._prompts[key] = prompt
+        return prompt
+
+    def _set_schema(self, structured_schema: Dict[str, List]) -> None:
+        self.structured_schema = structured_schema
+        self.schema_index = SchemaIndex(**structured_schema)
+        self._formatted_schemas = {}
+        self._prompts = {}
+        schema = schema_text(**structured_schema)
+        self.schema = schema
+        # Short fingerprint of the schema, part of the keys of schema dependent caches
+        version = hashlib.sha256(schema.encode("utf-8")).hexdigest()[:16]
+        changed = version != self.schema_version
+        self.schema_version = version
+        logger.debug("Refreshed schema", extra={"schema": schema, "sampled": True})
+        if changed:
+            logger.info("Schema changed", extra={"schema_version": version})
+            for listener in self._schema_listeners:
+                listener(version)
+
+
+class Neo4jDatabase(BaseNeo4jDatabase):
+    def __init__(
+        self,
+        host: str = "neo4j://localhost:7687",
+        user: str = "neo4j",
+        password: str = "pleaseletmein",
+        database: str = "neo4j",
+        read_only: bool = True,
+        query_timeout: Optional[float] = 30.0,
+        max_rows: Optional[int] = 1000,
+        max_connection_pool_size: int = 100,
+        connection_acquisition_timeout: float = 60.0,
+        max_connection_lifetime: float = 3600.0,
+        fetch_size: int = 1000,
+        cache: Optional[BaseCache] = None,
+        schema_cache_ttl: Optional[float] = 300.0,
+    ) -> None:
+        """Initialize a neo4j database
+
+        query_timeout (seconds) and max_rows limit every query run through
+        `query`; set them to None to disable the limit. With a cache, the schema
+        is shared with other workers using the same cache for schema_cache_ttl
+        seconds.
+        """
+        super().__init__(
+            host,
+            database,
+            read_only,
+            query_timeout,
+            max_rows,
+            fetch_size,
+            cache,
+            schema_cache_ttl,
+        )
+        self._driver = GraphDatabase.driver(
+            host,
+            auth=(user, password),
+            **self.driver_config(
+                max_connection_pool_size,
+                connection_acquisition_timeout,
+                max_connection_lifetime,
+            ),
+        )
         # Verify connection
         try:
             self._driver.verify_connectivity()
-        except exceptions.ServiceUnavailable:
-            raise ValueError(
-                "Could not connect to Neo4j database. "
-                "Please ensure that the url is correct"
-            )
-        except exceptions.AuthError:
-            raise ValueError(
-                "Could not connect to Neo4j database. "
-                "Please ensure that the username and password are correct"
-            )
+        except (exceptions.ServiceUnavailable, exceptions.AuthError) as e:
+            raise connection_error(e)
         try:
             self.refresh_schema()
         except:
             raise ValueError("Missing APOC Core plugin")
 
-    @staticmethod
-    def _execute_read_only_query(tx, cypher_query: str, params: Optional[Dict] = {}):
-        result = tx.run(cypher_query, params)
-        return [r.data() for r in result]
+    def _fetch(self, result, max_rows: Optional[int]) -> List[Dict[str, Any]]:
+        if max_rows is None:
+            return [r.data() for r in result]
+        records = [r.data() for r in islice(result, max_rows + 1)]
+        if len(records) > max_rows:
+            raise RowLimitExceeded(max_rows)
+        return records
 
     def query(
-        self, cypher_query: str, params: Optional[Dict] = {}
+        self,
+        cypher_query: str,
+        params: Optional[Dict] = {},
+        query_id: Optional[str] = None,
+        enforce_limits: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """Run a Cypher query and return its records as dictionaries.
+
+        When `query_id` is given, the transaction is tagged with it so that it
+        can be terminated with `cancel`. Internal queries such as the schema
+        introspection pass `enforce_limits=False` to skip the timeout and row cap.
+        """
+        with time_stage("neo4j_query"):
+            output = self._query(cypher_query, params, query_id, enforce_limits)
+        return self._record(output, query_id)
+
+    def _query(
+        self,
+        cypher_query: str,
+        params: Optional[Dict],
+        query_id: Optional[str],
+        enforce_limits: bool,
     ) -> List[Dict[str, Any]]:
-        with self._driver.session(database=self._database) as session:
+        if query_id is not None and self._pop_cancelled(query_id):
+            return [{"code": "cancelled", "message": "The query was cancelled"}]
+
+        timeout, max_rows = self._limits(enforce_limits)
+        metadata = {"query_id": query_id} if query_id is not None else None
+
+        with self._driver.session(**self._session_config(self._read_only)) as session:
             try:
-                if self._read_only:
-                    result = session.read_transaction(
-                        self._execute_read_only_query, cypher_query, params
-                    )
+                with session.begin_transaction(
+                    timeout=timeout, metadata=metadata
+                ) as tx:
+                    result = self._fetch(tx.run(cypher_query, params), max_rows)
+                    tx.commit()
                     return result
-                else:
-                    result = session.run(cypher_query, params)
-                    # Limit to at most 10 results
-                    return [r.data() for r in result]
-
-            # Catch Cypher syntax errors
-            except exceptions.CypherSyntaxError as e:
-                return [
-                    {
-                        "code": "invalid_cypher",
-                        "message": f"Invalid Cypher statement due to an error: {e}",
-                    }
+            except Exception as e:
+                output = error_output(e, timeout)
+                if output is None:
+                    raise
+                return output
+            finally:
+                if query_id is not None:
+                    self._pop_cancelled(query_id)
+
+    def explain(self, cypher_query: str) -> Optional[Dict[str, Any]]:
+        """Plan the query without running it and return the error, if any"""
+        output = self.query("EXPLAIN " + cypher_query, enforce_limits=False)
+        if output and "code" in output[0]:
+            return output[0]
+        return None
+
+    def cancel(self, query_id: str) -> None:
+        """Terminate the in-flight transaction tagged with `query_id`.
+
+        If the query has not started yet it is skipped once it does.
+        """
+        self._mark_cancelled(query_id)
+        with self._driver.session(**self._session_config(False)) as session:
+            try:
+                transaction_ids = [
+                    r["transactionId"]
+                    for r in session.run(find_transactions_query, query_id=query_id)
                 ]
+                if transaction_ids:
+                    session.run(
+                        terminate_transactions_query, transaction_ids=transaction_ids
+                    ).consume()
+            except exceptions.Neo4jError as e:
+                logger.warning(
+                    "Could not terminate query",
+                    extra={"query_id": query_id, "error": str(e)},
+                )
 
-            except exceptions.ClientError as e:
-                # Catch access mode errors
-                if e.code == "Neo.ClientError.Statement.AccessMode":
-                    return [
-                        {
-                            "code": "error",
-                            "message": "Couldn't execute the query due to the read only access to Neo4j",
-                        }
-                    ]
-                else:
-                    return [{"code": "error", "message": e}]
-
-    def refresh_schema(self) -> None:
-        node_props = [el["output"] for el in self.query(node_properties_query)]
-        rel_props = [el["output"] for el in self.query(rel_properties_query)]
-        rels = [el["output"] for el in self.query(rel_query)]
-        schema = schema_text(node_props, rel_props, rels)
-        self.schema = schema
-        #print(schema)
+    def data_version(self) -> Optional[str]:
+        """Id of the last committed transaction, which changes with every write.
+
+        Returns None if the server does not report it.
+        """
+        with self._driver.session(database="system") as session:
+            try:
+                records = list(session.run(data_version_query, database=self._database))
+            except exceptions.Neo4jError as e:
+                logger.warning("Could not read data version", extra={"error": str(e)})
+                return None
+        return self._data_version(records)
+
+    def refresh_schema(self, use_cache: bool = True) -> None:
+        """Load the schema, from the cache unless use_cache is False"""
+        schema = None
+        if self._cache is not None and use_cache:
+            schema = self._cache.get("structured_schema", self.identity)
+        if schema is None:
+            node_props = [
+                el["output"]
+                for el in self.query(node_properties_query, enforce_limits=False)
+            ]
+            rel_props = [
+                el["output"]
+                for el in self.query(rel_properties_query, enforce_limits=False)
+            ]
+            rels = [el["output"] for el in self.query(rel_query, enforce_limits=False)]
+            schema = {"node_props": node_props, "rel_props": rel_props, "rels": rels}
+            if self._cache is not None:
+                self._cache.set(
+                    "structured_schema",
+                    self.identity,
+                    schema,
+                    self._schema_cache_ttl,
+                )
+        self._set_schema(schema)
 
     def check_if_empty(self) -> bool:
         data = self.query(
@@ -129,3 +524,207 @@ class Neo4jDatabase:
         """
         )
         return data[0]["output"]
+
+
+class AsyncNeo4jDatabase(BaseNeo4jDatabase):
+    """Neo4j database on the async driver, with the same surface as Neo4jDatabase.
+
+    The driver is created without any I/O, call `initialize` to verify the
+    connection and load the schema.
+    """
+
+    def __init__(
+        self,
+        host: str = "neo4j://localhost:7687",
+        user: str = "neo4j",
+        password: str = "pleaseletmein",
+        database: str = "neo4j",
+        read_only: bool = True,
+        query_timeout: Optional[float] = 30.0,
+        max_rows: Optional[int] = 1000,
+        max_connection_pool_size: int = 100,
+        connection_acquisition_timeout: float = 60.0,
+        max_connection_lifetime: float = 3600.0,
+        fetch_size: int = 1000,
+        cache: Optional[BaseCache] = None,
+        schema_cache_ttl: Optional[float] = 300.0,
+    ) -> None:
+        super().__init__(
+            host,
+            database,
+            read_only,
+            query_timeout,
+            max_rows,
+            fetch_size,
+            cache,
+            schema_cache_ttl,
+        )
+        self._driver = AsyncGraphDatabase.driver(
+            host,
+            auth=(user, password),
+            **self.driver_config(
+                max_connection_pool_size,
+                connection_acquisition_timeout,
+                max_connection_lifetime,
+            ),
+        )
+
+    async def initialize(self) -> None:
+        try:
+            await self._driver.verify_connectivity()
+        except (exceptions.ServiceUnavailable, exceptions.AuthError) as e:
+            raise connection_error(e)
+        try:
+            await self.refresh_schema()
+        except:
+            raise ValueError("Missing APOC Core plugin")
+
+    async def close(self) -> None:
+        await self._driver.close()
+
+    async def _fetch(self, result, max_rows: Optional[int]) -> List[Dict[str, Any]]:
+        records = []
+        async for record in result:
+            records.append(record.data())
+            if max_rows is not None and len(records) > max_rows:
+                raise RowLimitExceeded(max_rows)
+        return records
+
+    async def query(
+        self,
+        cypher_query: str,
+        params: Optional[Dict] = {},
+        query_id: Optional[str] = None,
+        enforce_limits: bool = True,
+    ) -> List[Dict[str, Any]]:
+        """Run a Cypher query and return its records as dictionaries.
+
+        Cancelling the awaiting task rolls the transaction back.
+        """
+        start = time.perf_counter()
+        try:
+            with time_stage("neo4j_query"):
+                output = await self._query(
+                    cypher_query, params, query_id, enforce_limits
+                )
+        except asyncio.CancelledError:
+            NEO4J_WASTED_SECONDS.inc(time.perf_counter() - start)
+            raise
+        return self._record(output, query_id)
+
+    async def _query(
+        self,
+        cypher_query: str,
+        params: Optional[Dict],
+        query_id: Optional[str],
+        enforce_limits: bool,
+    ) -> List[Dict[str, Any]]:
+        if query_id is not None and self._pop_cancelled(query_id):
+            return [{"code": "cancelled", "message": "The query was cancelled"}]
+
+        timeout, max_rows = self._limits(enforce_limits)
+        metadata = {"query_id": query_id} if query_id is not None else None
+
+        async with self._driver.session(
+            **self._session_config(self._read_only)
+        ) as session:
+            try:
+                async with await session.begin_transaction(
+                    timeout=timeout, metadata=metadata
+                ) as tx:
+                    result = await self._fetch(
+                        await tx.run(cypher_query, params), max_rows
+                    )
+                    await tx.commit()
+                    return result
+            except Exception as e:
+                output = error_output(e, timeout)
+                if output is None:
+                    raise
+                return output
+            finally:
+                if query_id is not None:
+                    self._pop_cancelled(query_id)
+
+    async def explain(self, cypher_query: str) -> Optional[Dict[str, Any]]:
+        """Plan the query without running it and return the error, if any"""
+        output = await self.query("EXPLAIN " + cypher_query, enforce_limits=False)
+        if output and "code" in output[0]:
+            return output[0]
+        return None
+
+    async def cancel(self, query_id: str) -> None:
+        """Terminate the in-flight transaction tagged with `query_id`.
+
+        If the query has not started yet it is skipped once it does.
+        """
+        self._mark_cancelled(query_id)
+        async with self._driver.session(**self._session_config(False)) as session:
+            try:
+                result = await session.run(find_transactions_query, query_id=query_id)
+                transaction_ids = [r["transactionId"] async for r in result]
+                if transaction_ids:
+                    result = await session.run(
+                        terminate_transactions_query, transaction_ids=transaction_ids
+                    )
+                    await result.consume()
+            except exceptions.Neo4jError as e:
+                logger.warning(
+                    "Could not terminate query",
+                    extra={"query_id": query_id, "error": str(e)},
+                )
+
+    async def data_version(self) -> Optional[str]:
+        """Id of the last committed transaction, which changes with every write.
+
+        Returns None if the server does not report it.
+        """
+        async with self._driver.session(database="system") as session:
+            try:
+                result = await session.run(data_version_query, database=self._database)
+                records = [record async for record in result]
+            except exceptions.Neo4jError as e:
+                logger.warning("Could not read data version", extra={"error": str(e)})
+                return None
+        return self._data_version(records)
+
+    async def refresh_schema(self, use_cache: bool = True) -> None:
+        """Load the schema, from the cache unless use_cache is False"""
+        schema = None
+        if self._cache is not None and use_cache:
+            schema = await call_async(
+                self._cache.get, "structured_schema", self.identity
+            )
+        if schema is None:
+            node_props = [
+                el["output"]
+                for el in await self.query(node_properties_query, enforce_limits=False)
+            ]
+            rel_props = [
+                el["output"]
+                for el in await self.query(rel_properties_query, enforce_limits=False)
+            ]
+            rels = [
+                el["output"]
+                for el in await self.query(rel_query, enforce_limits=False)
+            ]
+            schema = {"node_props": node_props, "rel_props": rel_props, "rels": rels}
+            if self._cache is not None:
+                await call_async(
+                    self._cache.set,
+                    "structured_schema",
+                    self.identity,
+                    schema,
+                    self._schema_cache_ttl,
+                )
+        self._set_schema(schema)
+
+    async def check_if_empty(self) -> bool:
+        data = await self.query(
+            """
+        MATCH (n)
+        WITH count(n) as c
+        RETURN CASE WHEN c > 0 THEN true ELSE false END AS output
+        """
+        )
+        return data[0]["output"]
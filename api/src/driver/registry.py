@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from driver.neo4j import AsyncNeo4jDatabase
+from utils.metrics import NEO4J_REGISTRY_ENTRIES, NEO4J_REGISTRY_EVICTIONS
+
+logger = logging.getLogger(__name__)
+
+# (url, database)
+DatabaseKey = Tuple[str, str]
+
+
+class RegistryEntry:
+    def __init__(self, database: AsyncNeo4jDatabase) -> None:
+        self.database = database
+        self.ready: Optional[asyncio.Future] = None
+        self.users = 0
+        self.last_used = time.monotonic()
+
+
+class DatabaseRegistry:
+    """Neo4j connections per (url, database), created on first use.
+
+    Every entry has its own driver and connection pool, schema and rendered
+    schemas. Once there are more than max_entries, the least recently used
+    entries that no request is using are closed, as are entries idle for
+    longer than idle_timeout seconds, so memory stays bounded however many
+    databases are served. Idle entries are found when connections are
+    acquired or released and by `run`, which sweeps periodically for
+    databases that get no more requests.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str, str], AsyncNeo4jDatabase],
+        max_entries: int = 4,
+        idle_timeout: Optional[float] = 600.0,
+        on_evict: Optional[Callable[[AsyncNeo4jDatabase], None]] = None,
+    ) -> None:
+        self.factory = factory
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[DatabaseKey, RegistryEntry]" = OrderedDict()
+        self._lock = asyncio.Lock()
+
+    @asynccontextmanager
+    async def connection(
+        self, url: str, database: str
+    ) -> AsyncIterator[AsyncNeo4jDatabase]:
+        """The initialized connection, which is not evicted while in use"""
+        entry = await self._acquire((url, database))
+        try:
+            yield entry.database
+        finally:
+            entry.users -= 1
+            entry.last_used = time.monotonic()
+            await self.evict()
+
+    async def _acquire(self, key: DatabaseKey) -> RegistryEntry:
+        async with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                logger.info(
+                    "Connecting to Neo4j database",
+                    extra={"url": key[0], "database": key[1]},
+                )
+                entry = RegistryEntry(self.factory(*key))
+                entry.ready = asyncio.ensure_future(entry.database.initialize())
+                self._entries[key] = entry
+                NEO4J_REGISTRY_ENTRIES.set(len(self._entries))
+            self._entries.move_to_end(key)
+            entry.users += 1
+        try:
+            # Requests waiting for the same connection share one initialization
+            await asyncio.shield(entry.ready)
+        except BaseException:
+            entry.users -= 1
+            if entry.ready.done() and not entry.ready.cancelled():
+                await self._remove(key, entry)
+            raise
+        await self.evict()
+        return entry
+
+    async def _remove(self, key: DatabaseKey, entry: RegistryEntry) -> None:
+        async with self._lock:
+            if self._entries.get(key) is not entry:
+                return
+            del self._entries[key]
+            NEO4J_REGISTRY_ENTRIES.set(len(self._entries))
+        await self._close(entry)
+
+    async def _close(self, entry: RegistryEntry) -> None:
+        if self.on_evict is not None:
+            self.on_evict(entry.database)
+        try:
+            await entry.database.close()
+        except Exception as e:
+            logger.warning("Could not close Neo4j connection", extra={"error": str(e)})
+
+    async def evict(self) -> None:
+        """Closes idle entries beyond max_entries or idle for over idle_timeout"""
+        now = time.monotonic()
+        evicted = []
+        async with self._lock:
+            # Oldest first
+            for key, entry in list(self._entries.items()):
+                if entry.users > 0 or not entry.ready.done():
+                    continue
+                expired = (
+                    self.idle_timeout is not None
+                    and now - entry.last_used > self.idle_timeout
+                )
+                if expired or len(self._entries) > self.max_entries:
+                    del self._entries[key]
+                    evicted.append((key, entry))
+            NEO4J_REGISTRY_ENTRIES.set(len(self._entries))
+        for key, entry in evicted:
+            logger.info(
+                "Closing idle Neo4j connection",
+                extra={"url": key[0], "database": key[1]},
+            )
+            NEO4J_REGISTRY_EVICTIONS.inc()
+            await self._close(entry)
+
+    async def run(self, interval: float = 60.0) -> None:
+        """Evicts idle entries every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict()
+            except Exception as e:
+                logger.warning("Registry sweep failed", extra={"error": str(e)})
+
+    async def for_each(
+        self, func: Callable[[AsyncNeo4jDatabase], Awaitable[Any]]
+    ) -> None:
+        """Calls func with every initialized connection, holding it open meanwhile"""
+        async with self._lock:
+            entries = [
+                (key, entry)
+                for key, entry in self._entries.items()
+                if entry.ready.done()
+                and not entry.ready.cancelled()
+                and entry.ready.exception() is None
+            ]
+            for _, entry in entries:
+                entry.users += 1
+        try:
+            for key, entry in entries:
+                try:
+                    await func(entry.database)
+                except Exception as e:
+                    logger.warning(
+                        "Registry call failed",
+                        extra={"url": key[0], "database": key[1], "error": str(e)},
+                    )
+        finally:
+            for _, entry in entries:
+                entry.users -= 1
+            await self.evict()
+
+    async def close(self) -> None:
+        async with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            NEO4J_REGISTRY_ENTRIES.set(0)
+        for entry in entries:
+            entry.ready.cancel()
+            await self._close(entry)
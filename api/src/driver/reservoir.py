@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import random
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from driver.neo4j import BaseNeo4jDatabase
+from utils.concurrency import call_async
+
+logger = logging.getLogger(__name__)
+
+labels_query = "CALL db.labels() YIELD label RETURN label"
+
+
+def sample_query(label: str) -> str:
+    # Keeps the $size nodes with the lowest random key while scanning the label,
+    # a top-k that needs no sort of the whole label and no id order.
+    # Labels cannot be parameters, so the label is escaped into the query.
+    return f"""
+MATCH (n:`{label.replace("`", "``")}`)
+WITH n, rand() AS key ORDER BY key LIMIT $size
+RETURN elementId(n) AS id, apoc.map.removeKey(n, 'embedding') AS properties, labels(n) AS labels
+"""
+
+
+class NodeReservoir:
+    """Random node samples per label, maintained in the background.
+
+    `run` draws a fresh uniform sample of every label every `interval`
+    seconds, with one scan of the label in Neo4j that keeps only `size`
+    nodes, and replaces the previous sample with it, so the samples follow
+    new and deleted nodes over time. Samples are served from memory without
+    touching Neo4j.
+    """
+
+    def __init__(
+        self,
+        database: BaseNeo4jDatabase,
+        size: int = 100,
+        interval: float = 60.0,
+        seed: Optional[int] = None,
+    ) -> None:
+        if database.max_rows is not None and size > database.max_rows:
+            raise ValueError(
+                f"Sample size {size} is larger than the row cap {database.max_rows}"
+            )
+        self.database = database
+        self.size = size
+        self.interval = interval
+        self._rng = random.Random(seed)
+        self._samples: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+
+    def sample(self, label: str, k: int) -> List[Dict[str, Any]]:
+        """Up to k distinct random nodes with the label, as properties and labels"""
+        with self._lock:
+            items = self._samples.get(label, [])
+        return [node for _, node in self._rng.sample(items, min(k, len(items)))]
+
+    def sample_any(self, k: int) -> List[Dict[str, Any]]:
+        """Up to k distinct random nodes of any label"""
+        with self._lock:
+            # Nodes with several labels are in several samples
+            nodes = {
+                node_id: node
+                for items in self._samples.values()
+                for node_id, node in items
+            }
+        return self._rng.sample(list(nodes.values()), min(k, len(nodes)))
+
+    async def refresh(self) -> None:
+        """Draws a new sample of every label"""
+        labels = [
+            record["label"]
+            for record in await call_async(self.database.query, labels_query)
+        ]
+        for label in labels:
+            await self._refresh_label(label)
+        with self._lock:
+            for label in set(self._samples) - set(labels):
+                del self._samples[label]
+
+    async def _refresh_label(self, label: str) -> None:
+        records = await call_async(
+            self.database.query, sample_query(label), {"size": self.size}
+        )
+        if records and "code" in records[0]:
+            logger.warning(
+                "Could not sample nodes",
+                extra={"label": label, "error": str(records[0]["message"])},
+            )
+            return
+        items = [
+            (
+                record["id"],
+                {"properties": record["properties"], "labels": record["labels"]},
+            )
+            for record in records
+        ]
+        with self._lock:
+            self._samples[label] = items
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Node sampling failed", extra={"error": str(e)})
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,148 @@
+"""
+Keyword index of the database schema, for question-aware schema pruning.
+
+Labels, relationship types and distinctive property names are split into
+words (NationalSociety -> national, society; AFFECTED_BY -> affected) and
+stemmed. A question selects the labels whose words it mentions, the end
+labels of the relationship types it mentions and the labels with the
+properties it mentions, plus their one-hop neighbourhood, which includes the
+labels in between seeds two hops apart. The full schema is used when the
+selection is uncertain: nothing matches, the question names something the
+schema does not (a capitalised word such as "Africa" is usually a property
+value, and the label holding it may be outside the neighbourhood), or the
+selection covers half the schema or more anyway.
+"""
+import re
+from typing import Any, Dict, List, Optional, Set
+
+# Words that say nothing about which part of the schema a question is about
+STOP_WORDS = set(
+    """
+    a about all an and any are as at be been by can convert converted cypher do
+    does for from give has have how in is it list many me most much of on or
+    question show that the their there these this those to was were what when
+    where which who with
+    """.split()
+)
+
+
+def split_words(name: str) -> List[str]:
+    """Splits camelCase, snake_case and UPPER_CASE names into lower case words"""
+    words = re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+", name)
+    return [word.lower() for word in words]
+
+
+def stem(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def proper_nouns(text: str) -> Set[str]:
+    """Stems of the capitalised words that do not start a sentence"""
+    words = re.findall(r"(?<![.?!:]\s)(?<!^)\b([A-Z][A-Za-z]*)", text.strip())
+    return {stem(word.lower()) for word in words} - STOP_WORDS
+
+
+def keywords(text: str) -> Set[str]:
+    return {
+        stem(word) for word in split_words(text) if word not in STOP_WORDS
+    } - STOP_WORDS
+
+
+class SchemaIndex:
+    def __init__(
+        self,
+        node_props: List[Dict[str, Any]],
+        rel_props: List[Dict[str, Any]],
+        rels: List[Dict[str, str]],
+        max_share: float = 0.5,
+    ) -> None:
+        """
+        Selections with max_share of the labels or more fall back to the
+        full schema, they would save little and risk missing a label.
+        """
+        self.node_props = node_props
+        self.rel_props = rel_props
+        self.rels = rels
+        self.max_share = max_share
+        self.labels = {node["labels"] for node in node_props} | {
+            label for rel in rels for label in (rel["start"], rel["end"])
+        }
+        self.label_keywords = {label: keywords(label) for label in self.labels}
+        self.type_keywords = {rel["type"]: keywords(rel["type"]) for rel in rels}
+        # Properties most labels have, such as name, do not tell labels apart
+        owners: Dict[str, Set[str]] = {}
+        for node in node_props:
+            for prop in node["properties"]:
+                owners.setdefault(prop["property"], set()).add(node["labels"])
+        self.property_owners = {
+            prop: labels
+            for prop, labels in owners.items()
+            if len(labels) <= max(1, len(self.labels) // 2)
+        }
+        self.property_keywords = {
+            prop: keywords(prop) for prop in self.property_owners
+        }
+
+    def select(self, text: str) -> Optional[Set[str]]:
+        """The labels relevant to the text, or None to use the full schema"""
+        words = keywords(text)
+        seeds = {
+            label
+            for label, label_words in self.label_keywords.items()
+            if label_words and label_words <= words
+        }
+        matched_words = set().union(*(self.label_keywords[label] for label in seeds))
+        # HAS_HAZARD says no more than a mentioned Hazard does
+        types = {
+            rel_type
+            for rel_type, type_words in self.type_keywords.items()
+            if type_words and type_words <= words and not type_words <= matched_words
+        }
+        for prop, prop_words in self.property_keywords.items():
+            if prop_words and prop_words <= words:
+                seeds |= self.property_owners[prop]
+        seeds |= {
+            label
+            for rel in self.rels
+            if rel["type"] in types
+            for label in (rel["start"], rel["end"])
+        }
+        if not seeds:
+            return None
+        # Names the schema does not know, the labels they belong to are unknown
+        known = set().union(
+            *self.label_keywords.values(),
+            *self.type_keywords.values(),
+            *self.property_keywords.values(),
+        )
+        if proper_nouns(text) - known:
+            return None
+        # One-hop neighbourhood, for the paths between the mentioned labels
+        selected = set(seeds)
+        for rel in self.rels:
+            if rel["start"] in seeds or rel["end"] in seeds:
+                selected |= {rel["start"], rel["end"]}
+        if len(selected) >= self.max_share * len(self.labels):
+            return None
+        return selected
+
+    def prune(self, text: str) -> Optional[Dict[str, List]]:
+        """The part of the schema relevant to the text, or None to use the full schema"""
+        labels = self.select(text)
+        if labels is None:
+            return None
+        rels = [
+            rel for rel in self.rels if rel["start"] in labels and rel["end"] in labels
+        ]
+        types = {rel["type"] for rel in rels}
+        return {
+            "node_props": [
+                node for node in self.node_props if node["labels"] in labels
+            ],
+            "rel_props": [rel for rel in self.rel_props if rel["type"] in types],
+            "rels": rels,
+        }
@@ -1,7 +1,9 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import (
     Any,
     List,
+    Optional,
 )
 
 
@@ -16,6 +18,35 @@ class BaseLLM(ABC):
     def generate(self, messages: List[str]) -> str:
         """Comment"""
 
+    def generate_candidates(
+        self, messages: List[str], n: int, temperature: Optional[float] = None
+    ) -> List[str]:
+        """Returns up to n completions for the same messages.
+
+        generate takes no temperature, so the default cannot make completions
+        differ and returns a single one instead of paying for n identical
+        ones. LLMs that can sample must override it to return n completions
+        at the given temperature.
+        """
+        return [self.generate(messages)]
+
+    async def generate_async(self, messages: List[str]) -> str:
+        """generate without blocking the event loop.
+
+        Runs generate in a worker thread, so cancelling the awaiting task does
+        not stop the call. LLMs with an async client override it to abort the
+        request instead.
+        """
+        return await asyncio.to_thread(self.generate, messages)
+
+    async def generate_candidates_async(
+        self, messages: List[str], n: int, temperature: Optional[float] = None
+    ) -> List[str]:
+        """generate_candidates without blocking the event loop"""
+        return await asyncio.to_thread(
+            self.generate_candidates, messages, n, temperature=temperature
+        )
+
     @abstractmethod
     async def generateStreaming(
         self, messages: List[str], onTokenCallback
@@ -0,0 +1,138 @@
+from typing import Any, List, Optional
+
+from cache.base_cache import BaseCache, cache_key
+from llm.basellm import BaseLLM
+from utils.concurrency import call_async
+
+# Modes of CachedLLM
+READ_WRITE = "read_write"
+REPLAY = "replay"
+
+
+class CacheMiss(Exception):
+    def __init__(self, model: str) -> None:
+        super().__init__(f"No recorded response for this {model} request")
+
+
+class CachedLLM(BaseLLM):
+    """Serves repeated LLM requests from a cache.
+
+    Responses are keyed by model, temperature, max_tokens and the messages. By
+    default only deterministic calls (temperature 0) are cached; with
+    deterministic_only=False sampled responses are recorded too. In REPLAY
+    mode the wrapped LLM is never called and a missing response raises
+    CacheMiss, for offline benchmarks against recorded responses.
+    """
+
+    def __init__(
+        self,
+        llm: BaseLLM,
+        cache: BaseCache,
+        mode: str = READ_WRITE,
+        deterministic_only: bool = True,
+    ) -> None:
+        self.llm = llm
+        self.cache = cache
+        self.mode = mode
+        self.deterministic_only = deterministic_only
+
+    def __getattr__(self, name: str) -> Any:
+        # model, max_tokens, temperature, ... of the wrapped LLM
+        return getattr(self.llm, name)
+
+    def _key(
+        self, temperature: float, messages: List[str], *extra: Any
+    ) -> Optional[str]:
+        # None when the call should not be cached
+        if self.mode != REPLAY and self.deterministic_only and temperature:
+            return None
+        return cache_key(
+            self.llm.model, temperature, self.llm.max_tokens, messages, *extra
+        )
+
+    def _lookup(self, value: Any) -> Any:
+        if value is None and self.mode == REPLAY:
+            raise CacheMiss(self.llm.model)
+        return value
+
+    def generate(self, messages: List[str]) -> str:
+        key = self._key(self.llm.temperature, messages)
+        if key is None:
+            return self.llm.generate(messages)
+        output = self._lookup(self.cache.get("llm", key))
+        if output is None:
+            output = self.llm.generate(messages)
+            # Errors are returned as text, do not record them
+            if not output.startswith("Error: "):
+                self.cache.set("llm", key, output)
+        return output
+
+    def generate_candidates(
+        self, messages: List[str], n: int, temperature: Optional[float] = None
+    ) -> List[str]:
+        key = self._key(
+            self.llm.temperature if temperature is None else temperature, messages, n
+        )
+        if key is None:
+            return self.llm.generate_candidates(messages, n, temperature=temperature)
+        outputs = self._lookup(self.cache.get("llm", key))
+        if outputs is None:
+            outputs = self.llm.generate_candidates(messages, n, temperature=temperature)
+            if not any(output.startswith("Error: ") for output in outputs):
+                self.cache.set("llm", key, outputs)
+        return outputs
+
+    async def generate_async(self, messages: List[str]) -> str:
+        key = self._key(self.llm.temperature, messages)
+        if key is None:
+            return await self.llm.generate_async(messages)
+        output = self._lookup(await call_async(self.cache.get, "llm", key))
+        if output is None:
+            output = await self.llm.generate_async(messages)
+            if not output.startswith("Error: "):
+                await call_async(self.cache.set, "llm", key, output)
+        return output
+
+    async def generate_candidates_async(
+        self, messages: List[str], n: int, temperature: Optional[float] = None
+    ) -> List[str]:
+        key = self._key(
+            self.llm.temperature if temperature is None else temperature, messages, n
+        )
+        if key is None:
+            return await self.llm.generate_candidates_async(
+                messages, n, temperature=temperature
+            )
+        outputs = self._lookup(await call_async(self.cache.get, "llm", key))
+        if outputs is None:
+            outputs = await self.llm.generate_candidates_async(
+                messages, n, temperature=temperature
+            )
+            if not any(output.startswith("Error: ") for output in outputs):
+                await call_async(self.cache.set, "llm", key, outputs)
+        return outputs
+
+    async def generateStreaming(
+        self, messages: List[str], onTokenCallback=None
+    ) -> List[str]:
+        key = self._key(self.llm.temperature, messages, "stream")
+        if key is None:
+            return await self.llm.generateStreaming(messages, onTokenCallback)
+        tokens = self._lookup(await call_async(self.cache.get, "llm", key))
+        if tokens is None:
+            tokens = await self.llm.generateStreaming(messages, onTokenCallback)
+            await call_async(self.cache.set, "llm", key, tokens)
+            return tokens
+        # Replay the recorded tokens in the shape of the streamed chunks
+        for token in tokens:
+            await onTokenCallback(
+                {"choices": [{"delta": {"content": token}, "finish_reason": None}]}
+            )
+        await onTokenCallback({"choices": [{"delta": {}, "finish_reason": "stop"}]})
+        return tokens
+
+    def num_tokens_from_string(self, string: str) -> int:
+        return self.llm.num_tokens_from_string(string)
+
+    def max_allowed_token_length(self) -> int:
+        return self.llm.max_allowed_token_length()
@@ -1,12 +1,86 @@
+import asyncio
+import functools
+import logging
+import time
 from typing import (
     Callable,
+    Iterable,
     List,
+    Optional,
 )
 
-import openai
-import tiktoken
 from llm.basellm import BaseLLM
-from retry import retry
+from llm.scheduler import INTERACTIVE, LLMScheduler, scheduler
+from utils.metrics import LLM_REQUESTS, LLM_TOKENS, LLM_WASTED_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# openai and tiktoken are imported on first use, they account for a large part
+# of the API's import time. warm_up loads them ahead of the first request.
+
+# Attempts of every call and seconds between them
+RETRY_TRIES = 3
+RETRY_DELAY = 1
+
+
+@functools.lru_cache(maxsize=None)
+def encoding_for_model(model_name: str):
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model_name)
+
+
+def retry_after(e: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait in a rate limit response, if any"""
+    headers = getattr(e, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# One HTTP session for all async OpenAI calls, opened at startup. Without it
+# the client opens a session per request and, in openai 0.27, leaves it open
+# when the request is cancelled before the response arrives.
+_client_session = None
+
+
+async def open_client_session() -> None:
+    import aiohttp
+
+    global _client_session
+    if _client_session is None or _client_session.closed:
+        _client_session = aiohttp.ClientSession()
+
+
+async def close_client_session() -> None:
+    global _client_session
+    if _client_session is not None:
+        await _client_session.close()
+        _client_session = None
+
+
+def use_client_session() -> None:
+    """Makes the async OpenAI calls of the current task use the shared session"""
+    import openai
+
+    if _client_session is not None and not _client_session.closed:
+        # A context variable, set per task
+        openai.aiosession.set(_client_session)
+
+
+def warm_up(model_names: Iterable[str]) -> None:
+    """Imports the OpenAI client and loads the tokenizers of the given models"""
+    import openai  # noqa: F401
+
+    for model_name in model_names:
+        try:
+            encoding_for_model(model_name)
+        except Exception as e:
+            logger.warning(
+                "Could not load tokenizer",
+                extra={"model": model_name, "error": str(e)},
+            )
 
 
 class OpenAIChat(BaseLLM):
@@ -18,59 +92,249 @@ class OpenAIChat(BaseLLM):
         model_name: str = "gpt-3.5-turbo",
         max_tokens: int = 1000,
         temperature: float = 0.0,
+        priority: int = INTERACTIVE,
+        scheduler: LLMScheduler = scheduler,
     ) -> None:
+        """
+        Every call waits for rate limit budget in the process-wide scheduler,
+        where calls with a lower priority value are served first.
+        """
+        import openai
+
         openai.api_key = openai_api_key
         self.model = model_name
         self.max_tokens = max_tokens
         self.temperature = temperature
+        self.priority = priority
+        self.scheduler = scheduler
+
+    def _estimate_tokens(self, messages: List[str], completions: int = 1) -> int:
+        prompt = self.num_tokens_from_string("".join(m["content"] for m in messages))
+        return prompt + self.max_tokens * completions
+
+    def _record_usage(self, completions, estimated_tokens: int) -> int:
+        """Records a successful call and returns the tokens it used"""
+        LLM_REQUESTS.inc(model=self.model, status="ok")
+        self.scheduler.report_success()
+        usage = completions.get("usage")
+        if not usage:
+            return estimated_tokens
+        LLM_TOKENS.inc(usage["prompt_tokens"], model=self.model, kind="prompt")
+        LLM_TOKENS.inc(usage["completion_tokens"], model=self.model, kind="completion")
+        return usage["total_tokens"]
+
+    def _record_cancelled(self, prompt_tokens: int, completion_tokens: int = 0) -> int:
+        """Records a cancelled call and returns the tokens it was billed for"""
+        # The provider bills the prompt once the request reached it, and every
+        # completion token it streamed before the request was aborted
+        LLM_REQUESTS.inc(model=self.model, status="cancelled")
+        LLM_WASTED_TOKENS.inc(prompt_tokens, model=self.model, kind="prompt")
+        LLM_WASTED_TOKENS.inc(completion_tokens, model=self.model, kind="completion")
+        return prompt_tokens + completion_tokens
+
+    def _record_rate_limit(self, e: Exception) -> None:
+        LLM_REQUESTS.inc(model=self.model, status="rate_limited")
+        logger.warning("LLM rate limited", extra={"error": str(e)})
+        self.scheduler.report_rate_limit(retry_after(e))
+
+    def _create(
+        self, messages: List[str], n: int = 1, temperature: Optional[float] = None
+    ):
+        """ChatCompletion.create, retried under one scheduler reservation.
+
+        Returns the completions, or the error text for errors that are not
+        retried. The reservation is settled with the tokens used, none if
+        every attempt failed.
+        """
+        import openai
+
+        estimated_tokens = self._estimate_tokens(messages, n)
+        used_tokens = 0
+        self.scheduler.acquire(estimated_tokens, self.priority)
+        try:
+            for attempt in range(RETRY_TRIES):
+                if attempt:
+                    time.sleep(RETRY_DELAY)
+                    # Another request, the tokens are reserved already
+                    self.scheduler.acquire(0, self.priority)
+                try:
+                    completions = openai.ChatCompletion.create(
+                        model=self.model,
+                        temperature=(
+                            self.temperature if temperature is None else temperature
+                        ),
+                        max_tokens=self.max_tokens,
+                        messages=messages,
+                        n=n,
+                    )
+                    used_tokens = self._record_usage(completions, estimated_tokens)
+                    return completions
+                # catch context length / do not retry
+                except openai.error.InvalidRequestError as e:
+                    LLM_REQUESTS.inc(model=self.model, status="invalid_request")
+                    return str(f"Error: {e}")
+                # catch authorization errors / do not retry
+                except openai.error.AuthenticationError as e:
+                    LLM_REQUESTS.inc(model=self.model, status="authentication_error")
+                    return "Error: The provided OpenAI API key is invalid"
+                # wait for the scheduler's backoff, then retry
+                except openai.error.RateLimitError as e:
+                    self._record_rate_limit(e)
+                except Exception as e:
+                    LLM_REQUESTS.inc(model=self.model, status="retry")
+                    logger.warning("Retrying LLM call", extra={"error": str(e)})
+            raise Exception()
+        finally:
+            self.scheduler.settle(estimated_tokens, used_tokens)
 
-    @retry(tries=3, delay=1)
     def generate(
         self,
         messages: List[str],
     ) -> str:
+        completions = self._create(messages)
+        if isinstance(completions, str):
+            return completions
+        return completions.choices[0].message.content
+
+    def generate_candidates(
+        self,
+        messages: List[str],
+        n: int,
+        temperature: Optional[float] = None,
+    ) -> List[str]:
+        completions = self._create(messages, n, temperature)
+        if isinstance(completions, str):
+            return [completions]
+        return [choice.message.content for choice in completions.choices]
+
+    async def _acreate(
+        self, messages: List[str], n: int = 1, temperature: Optional[float] = None
+    ):
+        """_create without blocking the event loop.
+
+        Cancelling the awaiting task aborts the HTTP request.
+        """
+        import openai
+
+        estimated_tokens = self._estimate_tokens(messages, n)
+        used_tokens = 0
+        await self.scheduler.acquire_async(estimated_tokens, self.priority)
         try:
-            completions = openai.ChatCompletion.create(
-                model=self.model,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                messages=messages,
-            )
-            return completions.choices[0].message.content
-        # catch context length / do not retry
-        except openai.error.InvalidRequestError as e:
-            return str(f"Error: {e}")
-        # catch authorization errors / do not retry
-        except openai.error.AuthenticationError as e:
-            return "Error: The provided OpenAI API key is invalid"
-        except Exception as e:
-            print(f"Retrying LLM call {e}")
+            for attempt in range(RETRY_TRIES):
+                if attempt:
+                    await asyncio.sleep(RETRY_DELAY)
+                    # Another request, the tokens are reserved already
+                    await self.scheduler.acquire_async(0, self.priority)
+                use_client_session()
+                try:
+                    completions = await openai.ChatCompletion.acreate(
+                        model=self.model,
+                        temperature=(
+                            self.temperature if temperature is None else temperature
+                        ),
+                        max_tokens=self.max_tokens,
+                        messages=messages,
+                        n=n,
+                    )
+                    used_tokens = self._record_usage(completions, estimated_tokens)
+                    return completions
+                except asyncio.CancelledError:
+                    prompt = "".join(m["content"] for m in messages)
+                    used_tokens = self._record_cancelled(
+                        self.num_tokens_from_string(prompt)
+                    )
+                    raise
+                # catch context length / do not retry
+                except openai.error.InvalidRequestError as e:
+                    LLM_REQUESTS.inc(model=self.model, status="invalid_request")
+                    return str(f"Error: {e}")
+                # catch authorization errors / do not retry
+                except openai.error.AuthenticationError as e:
+                    LLM_REQUESTS.inc(model=self.model, status="authentication_error")
+                    return "Error: The provided OpenAI API key is invalid"
+                # wait for the scheduler's backoff, then retry
+                except openai.error.RateLimitError as e:
+                    self._record_rate_limit(e)
+                except Exception as e:
+                    LLM_REQUESTS.inc(model=self.model, status="retry")
+                    logger.warning("Retrying LLM call", extra={"error": str(e)})
             raise Exception()
+        finally:
+            self.scheduler.settle(estimated_tokens, used_tokens)
+
+    async def generate_async(self, messages: List[str]) -> str:
+        completions = await self._acreate(messages)
+        if isinstance(completions, str):
+            return completions
+        return completions.choices[0].message.content
+
+    async def generate_candidates_async(
+        self,
+        messages: List[str],
+        n: int,
+        temperature: Optional[float] = None,
+    ) -> List[str]:
+        completions = await self._acreate(messages, n, temperature)
+        if isinstance(completions, str):
+            return [completions]
+        return [choice.message.content for choice in completions.choices]
 
     async def generateStreaming(
         self,
         messages: List[str],
         onTokenCallback=Callable[[str], None],
     ) -> str:
-        result = []
-        completions = openai.ChatCompletion.create(
-            model=self.model,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            messages=messages,
-            stream=True,
+        import openai
+
+        prompt_tokens = self.num_tokens_from_string(
+            "".join(m["content"] for m in messages)
         )
+        estimated_tokens = prompt_tokens + self.max_tokens
+        used_tokens = 0
+        await self.scheduler.acquire_async(estimated_tokens, self.priority)
         result = []
-        for message in completions:
-            # Process the streamed messages or perform any other desired action
-            delta = message["choices"][0]["delta"]
-            if "content" in delta:
-                result.append(delta["content"])
-            await onTokenCallback(message)
-        return result
+        completions = None
+        try:
+            use_client_session()
+            try:
+                completions = await openai.ChatCompletion.acreate(
+                    model=self.model,
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    messages=messages,
+                    stream=True,
+                )
+                async for message in completions:
+                    # Process the streamed messages or perform any other desired action
+                    delta = message["choices"][0]["delta"]
+                    if "content" in delta:
+                        result.append(delta["content"])
+                    await onTokenCallback(message)
+            except openai.error.RateLimitError as e:
+                self._record_rate_limit(e)
+                raise
+            except asyncio.CancelledError:
+                # Closing the stream closes the connection, so the provider stops
+                # generating tokens nobody will read
+                if completions is not None:
+                    await completions.aclose()
+                used_tokens = self._record_cancelled(
+                    prompt_tokens, self.num_tokens_from_string("".join(result))
+                )
+                raise
+            # Streamed responses carry no usage, so estimate it with the tokenizer
+            completion_tokens = self.num_tokens_from_string("".join(result))
+            LLM_REQUESTS.inc(model=self.model, status="ok")
+            LLM_TOKENS.inc(prompt_tokens, model=self.model, kind="prompt")
+            LLM_TOKENS.inc(completion_tokens, model=self.model, kind="completion")
+            self.scheduler.report_success()
+            used_tokens = prompt_tokens + completion_tokens
+            return result
+        finally:
+            self.scheduler.settle(estimated_tokens, used_tokens)
 
     def num_tokens_from_string(self, string: str) -> int:
-        encoding = tiktoken.encoding_for_model(self.model)
+        encoding = encoding_for_model(self.model)
         num_tokens = len(encoding.encode(string))
         return num_tokens
 
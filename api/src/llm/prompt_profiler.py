@@ -0,0 +1,130 @@
+"""
+Token counts per prompt segment.
+
+Components tag the parts their prompts are assembled from, e.g. the schema,
+the few-shot examples, the chat history and the result data, when they send
+the prompt to the LLM. Whatever is not tagged, the fixed instructions, is
+counted as "instructions". Tokens are counted with the cached tiktoken
+encoder of the model, or estimated from the length when it is unavailable.
+The aggregates are served by the /promptProfile endpoint and exported as a
+Prometheus counter.
+"""
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from utils.metrics import PROMPT_TOKENS
+
+
+# Seconds between attempts to load a tokenizer that could not be loaded
+ENCODING_RETRY_INTERVAL = 60.0
+
+_encodings: Dict[Optional[str], Any] = {}
+_encoding_failures: Dict[Optional[str], float] = {}
+
+
+def _encoding(model: Optional[str]):
+    from llm.openai import encoding_for_model
+
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    failed = _encoding_failures.get(model)
+    if failed is not None and time.monotonic() - failed < ENCODING_RETRY_INTERVAL:
+        return None
+    try:
+        encoding = encoding_for_model(model)
+    except Exception:
+        # Unknown model or no tokenizer download, estimate until the next attempt
+        _encoding_failures[model] = time.monotonic()
+        return None
+    # Only successful loads are kept, a failure may be temporary
+    _encodings[model] = encoding
+    _encoding_failures.pop(model, None)
+    return encoding
+
+
+def count_tokens(model: Optional[str], text: str) -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+class PromptProfiler:
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._calls: Dict[str, int] = defaultdict(int)
+        self._tokens: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._max: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(
+        self,
+        component: str,
+        model: Optional[str],
+        messages: List[Dict[str, str]],
+        **segments: Any,
+    ) -> None:
+        """Counts the tokens of the messages and of each tagged segment in them"""
+        if not self.enabled:
+            return
+        total = count_tokens(model, "".join(m["content"] for m in messages))
+        counts = {
+            segment: count_tokens(model, text if isinstance(text, str) else str(text))
+            for segment, text in segments.items()
+            if text
+        }
+        counts["instructions"] = max(0, total - sum(counts.values()))
+        with self._lock:
+            self._calls[component] += 1
+            for segment, tokens in counts.items():
+                self._tokens[component][segment] += tokens
+                self._max[component][segment] = max(
+                    self._max[component][segment], tokens
+                )
+        for segment, tokens in counts.items():
+            PROMPT_TOKENS.inc(tokens, component=component, segment=segment)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            profile = {}
+            for component, calls in self._calls.items():
+                total = sum(self._tokens[component].values()) or 1
+                profile[component] = {
+                    "calls": calls,
+                    "segments": {
+                        segment: {
+                            "tokens": tokens,
+                            "mean": tokens / calls,
+                            "max": self._max[component][segment],
+                            "share": tokens / total,
+                        }
+                        for segment, tokens in sorted(
+                            self._tokens[component].items(),
+                            key=lambda item: -item[1],
+                        )
+                    },
+                }
+            return profile
+
+    def report(self) -> str:
+        lines = []
+        for component, profile in self.snapshot().items():
+            lines.append(f"{component} ({profile['calls']} prompts)")
+            for segment, stats in profile["segments"].items():
+                lines.append(
+                    f"  {segment:<14} mean={stats['mean']:8.1f} "
+                    f"max={stats['max']:6} share={stats['share']:6.1%}"
+                )
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._calls.clear()
+            self._tokens.clear()
+            self._max.clear()
+
+
+profiler = PromptProfiler()
@@ -0,0 +1,148 @@
+"""
+Process-wide scheduler for LLM calls.
+
+Every call waits for budget in two token buckets, one for requests and one for
+tokens per minute, so that the provider's quota is shared rather than
+exhausted. Waiting calls are served strictly by priority, then in arrival
+order, so a bulk import cannot starve interactive chat. Rate limit responses
+pause all calls with exponential backoff.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Optional
+
+from utils.metrics import LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_RATE_LIMITED
+
+# Priority classes, lower is served first
+INTERACTIVE = 0
+BACKGROUND = 1
+BULK = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background", BULK: "bulk"}
+
+# Longest a waiting call sleeps before checking the budget again
+POLL_INTERVAL = 0.05
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Requests larger than the bucket only wait for a full bucket
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+
+class LLMScheduler:
+    def __init__(
+        self,
+        requests_per_minute: float = 3500,
+        tokens_per_minute: float = 90000,
+        max_backoff: float = 60.0,
+    ) -> None:
+        self._lock = threading.Lock()
+        self._waiting = []
+        self._counter = itertools.count()
+        self._backoff = 0.0
+        self._paused_until = 0.0
+        self.max_backoff = max_backoff
+        self.configure(requests_per_minute, tokens_per_minute)
+
+    def configure(self, requests_per_minute: float, tokens_per_minute: float) -> None:
+        with self._lock:
+            self._requests = TokenBucket(requests_per_minute)
+            self._tokens = TokenBucket(tokens_per_minute)
+
+    def _try_acquire(self, ticket, tokens: int) -> float:
+        """Takes the budget if the ticket is next in line and returns 0, or the time to wait"""
+        with self._lock:
+            if self._waiting[0] != ticket:
+                return POLL_INTERVAL
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self._requests.tokens -= 1
+            self._tokens.tokens -= tokens
+            heapq.heappop(self._waiting)
+            return 0.0
+
+    def _enqueue(self, priority: int):
+        ticket = (priority, next(self._counter))
+        with self._lock:
+            heapq.heappush(self._waiting, ticket)
+        LLM_QUEUE_DEPTH.inc(priority=PRIORITY_NAMES[priority])
+        return ticket
+
+    def _dequeue(self, ticket, start: float) -> None:
+        with self._lock:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+        name = PRIORITY_NAMES[ticket[0]]
+        LLM_QUEUE_DEPTH.dec(priority=name)
+        LLM_QUEUE_WAIT.observe(time.monotonic() - start, priority=name)
+
+    def acquire(self, tokens: int, priority: int = INTERACTIVE) -> None:
+        """Blocks until the call may be made, for calls from worker threads"""
+        start = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                wait = self._try_acquire(ticket, tokens)
+                if wait == 0:
+                    break
+                time.sleep(min(wait, POLL_INTERVAL))
+        finally:
+            self._dequeue(ticket, start)
+
+    async def acquire_async(self, tokens: int, priority: int = INTERACTIVE) -> None:
+        """Waits without blocking the event loop until the call may be made"""
+        start = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                wait = self._try_acquire(ticket, tokens)
+                if wait == 0:
+                    break
+                await asyncio.sleep(min(wait, POLL_INTERVAL))
+        finally:
+            self._dequeue(ticket, start)
+
+    def settle(self, estimated_tokens: int, used_tokens: int) -> None:
+        """Corrects the token bucket once the actual usage of a call is known"""
+        with self._lock:
+            self._tokens.tokens = min(
+                self._tokens.capacity,
+                self._tokens.tokens + estimated_tokens - used_tokens,
+            )
+
+    def report_success(self) -> None:
+        with self._lock:
+            self._backoff = 0.0
+
+    def report_rate_limit(self, retry_after: Optional[float] = None) -> None:
+        """Pauses all calls, doubling the pause on consecutive rate limits"""
+        LLM_RATE_LIMITED.inc()
+        with self._lock:
+            self._backoff = min(self.max_backoff, max(1.0, self._backoff * 2))
+            pause = max(self._backoff, retry_after or 0.0)
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+
+
+scheduler = LLMScheduler()
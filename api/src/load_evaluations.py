@@ -1,5 +1,6 @@
 import requests
 from requests.auth import HTTPBasicAuth
+import hashlib
 import json
 from PyPDF2 import PdfReader
 from io import BytesIO
@@ -7,7 +8,9 @@ from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.text_splitter import CharacterTextSplitter
 import openai
 import os
+import tempfile
 import tiktoken
+from urllib.parse import urlparse
 from neo4j import GraphDatabase
 
 openai.api_key  = os.environ.get('OPENAI_API_KEY')
@@ -19,6 +22,34 @@ password = os.environ.get("NEO4J_PASS")
 database = os.environ.get("NEO4J_DATABASE", "neo4j")
 driver = GraphDatabase.driver(host, auth=(user, password))
 
+# The manifest records the ETag, Last-Modified and content hash of every
+# document loaded, so unchanged documents are neither downloaded nor parsed
+# again. The checkpoint lists the documents the current run has finished, a
+# run that crashed skips them when it is started again.
+manifest_path = os.environ.get("EVALUATIONS_MANIFEST", "evaluations_manifest.json")
+checkpoint_path = os.environ.get("EVALUATIONS_CHECKPOINT", manifest_path + ".checkpoint")
+# Reload every document, e.g. after changing how they are parsed or chunked
+full_refresh = os.environ.get("EVALUATIONS_FULL_REFRESH", "false") == "true"
+
+def load_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+# Write to a temporary file first so a crash never leaves half a file behind
+def save_json(path, value):
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+        json.dump(value, f)
+    os.replace(f.name, path)
+
+def content_hash(content) -> str:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
 # Get the number of tokens for a text string
 def num_tokens_from_string(string: str, encoding_name = "cl100k_base") -> int:
     """Returns the number of tokens in a text string."""
@@ -26,8 +57,8 @@ def num_tokens_from_string(string: str, encoding_name = "cl100k_base") -> int:
     num_tokens = len(encoding.encode(string))
     return num_tokens
 
-# Create chunk nodes for text
-def create_chunk_nodes(parent_url, title, author, page_num, num_pages, summary, text):
+# Create chunk nodes for the text of every page
+def create_chunk_nodes(parent_url, title, author, page_texts):
 
     # We need to split the text that we read into smaller chunks so that during information retreival we don't hit the token size limits. 
     text_splitter = CharacterTextSplitter(        
@@ -37,31 +68,42 @@ def create_chunk_nodes(parent_url, title, author, page_num, num_pages, summary,
         length_function = len,
     )
 
-    chunks = text_splitter.split_text(text)
-    num_chunks = len(chunks)
+    chunks = []
+    for page_num, page_text in enumerate(page_texts):
+        page_chunks = text_splitter.split_text(page_text)
+        for chunk_index, chunk_text in enumerate(page_chunks):
+            chunks.append({
+                "page": page_num,
+                "chunk": chunk_index + 1,
+                "chunks": len(page_chunks),
+                "text": chunk_text,
+                "hash": content_hash(chunk_text),
+            })
 
-    # Delete any existing child chunk nodes and use UNWIND to iterate through each chunk and create a new child chunk node
-    driver.execute_query("""
+    # Only chunks whose text changed are deleted and created again, the others keep their uuid and embedding
+    summary = driver.execute_query("""
         MATCH (parent:WebResource {url: $parent_url})
-        OPTIONAL MATCH (parent)-[r:HAS_CHUNK]->(existing_chunk:Chunk)
+        OPTIONAL MATCH (parent)-[:HAS_CHUNK]->(existing_chunk:Chunk)
+        WHERE NOT [existing_chunk.page, existing_chunk.chunk, coalesce(existing_chunk.hash, '')] IN $keys
         DETACH DELETE existing_chunk
-        WITH parent
-        UNWIND range(0, size($chunks)-1) as chunk_index
-        CREATE (new_chunk:Chunk {uuid: randomUUID(), text: $chunks[chunk_index], chars: size($chunks[chunk_index]), url: $url, title: $title, author: $author, page: $page_num, pages: $num_pages, chunk: chunk_index+1, chunks: $num_chunks, updated: datetime()})
-        CREATE (parent)-[r:HAS_CHUNK]->(new_chunk)
+        WITH DISTINCT parent
+        UNWIND $chunks AS chunk
+        MERGE (parent)-[:HAS_CHUNK]->(c:Chunk {url: $url, page: chunk.page, chunk: chunk.chunk})
+            ON CREATE SET c.uuid = randomUUID(), c.updated = datetime()
+            ON MATCH SET c.updated = CASE c.hash WHEN chunk.hash THEN c.updated ELSE datetime() END
+        SET c.text = chunk.text, c.hash = chunk.hash, c.chars = size(chunk.text), c.title = $title, c.author = $author, c.pages = $num_pages, c.chunks = chunk.chunks
         """,
         parent_url=parent_url,
         url=parent_url,
         chunks=chunks,
+        keys=[[chunk["page"], chunk["chunk"], chunk["hash"]] for chunk in chunks],
         title=title,
         author=author,
-        page_num=page_num,
-        num_pages=num_pages,
-        num_chunks=num_chunks,
-        database_="neo4j"
-    )
+        num_pages=len(page_texts),
+        database_=database
+    ).summary
 
-    print(f"{num_chunks} chunks created")
+    print(f"{len(chunks)} chunks, {summary.counters.nodes_created} created and {summary.counters.nodes_deleted} deleted")
 
 # Define the URL and authentication credentials
 url = os.environ.get("GOAPI_URL")
@@ -74,6 +116,28 @@ response = requests.get(url, auth=HTTPBasicAuth(username, password))
 # Parse the JSON data from the response
 data = json.loads(response.content)
 
+# The evaluation list is the parent WebResource that links to every document
+parent_url = url
+document_urls = [item['EVA_document'] for item in data]
+
+manifest = {} if full_refresh else load_json(manifest_path, {})
+checkpoint = set(load_json(checkpoint_path, []))
+if checkpoint:
+    print(f"Resuming, {len(checkpoint)} documents were loaded before the last run stopped")
+
+# Record a document as loaded, with its manifest entry if it was downloaded
+def record_loaded(url, entry=None):
+    if entry is not None:
+        manifest[url] = entry
+        save_json(manifest_path, manifest)
+    checkpoint.add(url)
+    save_json(checkpoint_path, sorted(checkpoint))
+
+# Reuse connections to the document host
+session = requests.Session()
+errors = []
+unchanged = 0
+
 for item in data:
     #print('EVA_Hidden:', item['EVA_Hidden'])
     #print('EVA_Id:', item['EVA_Id'])
@@ -86,14 +150,42 @@ for item in data:
     #print('EVA_title:', item['EVA_title'])
     #print()
 
-    errors = []
     url = item['EVA_document']
-    doc_response = requests.get(url)
-
-    # Read the content of the PDF file into a BytesIO object
-    pdf_file = BytesIO(doc_response.content)
+    if url in checkpoint:
+        continue
 
     try:
+        # Ask the server to only send the document if it changed since the last run
+        entry = manifest.get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        doc_response = session.get(url, headers=headers, timeout=60)
+        if doc_response.status_code == 304:
+            unchanged += 1
+            print(f"Unchanged: {url}")
+            record_loaded(url)
+            continue
+        doc_response.raise_for_status()
+
+        # Servers without validators send the document again, compare its hash
+        doc_hash = content_hash(doc_response.content)
+        new_entry = {
+            "etag": doc_response.headers.get("ETag"),
+            "last_modified": doc_response.headers.get("Last-Modified"),
+            "content_hash": doc_hash,
+        }
+        if entry.get("content_hash") == doc_hash:
+            unchanged += 1
+            print(f"Unchanged: {url}")
+            record_loaded(url, new_entry)
+            continue
+
+        # Read the content of the PDF file into a BytesIO object
+        pdf_file = BytesIO(doc_response.content)
+
         # Create a PDF reader object
         pdf_reader = PdfReader(pdf_file)
 
@@ -109,10 +201,9 @@ for item in data:
         creation_date = metadata.creation_date if metadata is not None and metadata.creation_date is not None else ""
         modification_date = metadata.modification_date if metadata is not None and metadata.modification_date is not None else ""
 
-        # Extract text from PDF
-        text = ""
-        for page in range(num_pages):
-            text += pages[page].extract_text()
+        # Extract text from PDF, once per page
+        page_texts = [page.extract_text() for page in pages]
+        text = "".join(page_texts)
 
         chars = len(text)
         words = len(text.split())
@@ -120,12 +211,15 @@ for item in data:
         summary = "" # get_summary(text, math.floor(words/3))
 
         # Create a "WebResource" node
+        processed_urls = sorted(checkpoint | {url})
+        urls_to_process = [u for u in document_urls if u not in checkpoint and u != url]
         driver.execute_query("""
-            MATCH (parent:WebResource) WHERE parent.url = $parent_url
-            SET parent.processed_urls = $processed_urls, parent.processed_urls_count = $processed_urls_count, parent.urls_to_process = $urls_to_process, parent.urls_to_process = $urls_to_process, parent.updated = datetime()
+            MERGE (parent:WebResource {url: $parent_url})
+                ON CREATE SET parent.uuid = randomUUID()
+            SET parent.processed_urls = $processed_urls, parent.processed_urls_count = $processed_urls_count, parent.urls_to_process = $urls_to_process, parent.urls_to_process_count = $urls_to_process_count, parent.updated = datetime()
             MERGE (p:WebResource:Pdf {url: $url})
                 ON CREATE SET p.uuid = randomUUID()
-                SET p.canonical_url = $canonical_url, p.hostname = $hostname, p.contenttype = $content_type, p.title = $title, p.author = $author, p.summary = $summary, p.text = $text, p.words = $words, p.chars = $chars, p.tokens = $tokens, p.pages = $numpages, p.creation_date = $creation_date, p.modification_date = $modification_date, p.updated = datetime()
+                SET p.canonical_url = $canonical_url, p.hostname = $hostname, p.contenttype = $content_type, p.title = $title, p.author = $author, p.summary = $summary, p.text = $text, p.words = $words, p.chars = $chars, p.tokens = $tokens, p.pages = $numpages, p.creation_date = $creation_date, p.modification_date = $modification_date, p.content_hash = $content_hash, p.updated = datetime()
             MERGE (parent)-[r:LINKS_TO]->(p)
             RETURN id(p) as id
             """,
@@ -135,9 +229,9 @@ for item in data:
             urls_to_process=urls_to_process,
             urls_to_process_count=len(urls_to_process),
             url=url,
-            canonical_url=canonical_url,
-            hostname=hostname,
-            content_type=content_type,
+            canonical_url=doc_response.url,
+            hostname=urlparse(doc_response.url).hostname,
+            content_type=doc_response.headers.get("Content-Type"),
             title=title,
             author=author,
             summary=summary,
@@ -147,15 +241,18 @@ for item in data:
             tokens=tokens,
             numpages=num_pages,
             creation_date=creation_date,
-            modification_date=modification_date
+            modification_date=modification_date,
+            content_hash=doc_hash,
+            database_=database
         )
         
         print(f"PDF WebResource node created with url: {url}, title: {title} and {chars} characters of text")
 
         # For each page, split the text into chunks and create a child node for each chunk
-        for page in range(num_pages):
-            # Split the page text into chunks
-            create_chunk_nodes(url, title, author, page, num_pages, pages[page].extract_text())
+        create_chunk_nodes(url, title, author, page_texts)
+
+        # Record the document only once it is fully loaded
+        record_loaded(url, new_entry)
 
     except Exception as e:
         errors.append(e)
@@ -168,9 +265,16 @@ total_items = len(data)
 # Print the total number of items
 print('Total items:', total_items)
 
+# Print the number of documents that did not change since the last run
+print('Unchanged items:', unchanged)
+
 # Print the total number of errors
 print('Total errors:', len(errors))
 
+# The run is complete, the next one starts from the beginning again
+if os.path.exists(checkpoint_path):
+    os.remove(checkpoint_path)
+
 # Print the error messages
 for error in errors:
     print(error)
@@ -1,24 +1,53 @@
+import asyncio
+import json
+import logging
 import os
-from typing import Optional
+import time
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager
+from typing import Dict, List, Optional, Union
+from uuid import uuid4
+from cache.base_cache import cache_key
+from cache.lru import LRUCache
+from cache.sqlite import SQLiteCache
+from components.chat_history import ChatHistory
 from components.company_report import CompanyReport
 
 from components.data_disambiguation import DataDisambiguation
 from components.question_proposal_generator import (
     QuestionProposalGenerator,
+    QuestionProposals,
 )
 from components.summarize_cypher_result import SummarizeCypherResult
 from components.text2cypher import Text2Cypher
+from components.text2cypher_batch import Text2CypherBatch
 from components.unstructured_data_extractor import (
     DataExtractor,
     DataExtractorWithSchema,
 )
-from driver.neo4j import Neo4jDatabase
+from driver.neo4j import AsyncNeo4jDatabase
+from driver.registry import DatabaseRegistry
+from driver.reservoir import NodeReservoir
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fewshot_examples import get_fewshot_examples
-from llm.openai import OpenAIChat
+from llm.cached import CachedLLM
+from llm.openai import (
+    OpenAIChat,
+    close_client_session,
+    open_client_session,
+    warm_up,
+)
+from llm.prompt_profiler import profiler
+from llm.scheduler import BACKGROUND, BULK, scheduler
 from pydantic import BaseModel
+from utils import metrics
+from utils.logging_config import configure_logging
+from utils.single_flight import SingleFlight
+from utils.stream_batcher import StreamBatcher
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 
 class Payload(BaseModel):
@@ -29,32 +58,281 @@ class Payload(BaseModel):
 
 class ImportPayload(BaseModel):
     input: str
-    neo4j_schema: Optional[str]
+    # Schema text, or node_props, rel_props and rels as kept by the database
+    neo4j_schema: Optional[Union[str, Dict[str, List]]]
+    api_key: Optional[str]
+
+
+class BatchPayload(BaseModel):
+    questions: List[str]
     api_key: Optional[str]
+    database: Optional[str]
+    summarize: bool = False
+    concurrency: Optional[int]
 
 
 class questionProposalPayload(BaseModel):
     api_key: Optional[str]
+    database: Optional[str]
 
 
 # Maximum number of records used in the context
 HARD_LIMIT_CONTEXT_RECORDS = 10
 
-neo4j_connection = Neo4jDatabase(
-    host=os.environ.get("NEO4J_URL", "neo4j+s://demo.neo4jlabs.com"),
-    user=os.environ.get("NEO4J_USER", "companies"),
-    password=os.environ.get("NEO4J_PASS", "companies"),
-    database=os.environ.get("NEO4J_DATABASE", "companies"),
-    #host=os.environ.get("AURA_URL", "neo4j+s://demo.neo4jlabs.com"),
-    #user=os.environ.get("AURA_USER", "companies"),
-    #password=os.environ.get("AURA_PASS", "companies"),
-    #database=os.environ.get("AURA_DATABASE", "neo4j"),
+# Number of Cypher candidates generated and validated in parallel per question
+TEXT2CYPHER_CANDIDATES = int(os.environ.get("TEXT2CYPHER_CANDIDATES", 1))
+# Only put the part of the schema a question is about into its prompt
+TEXT2CYPHER_PRUNE_SCHEMA = os.environ.get("TEXT2CYPHER_PRUNE_SCHEMA", "false") == "true"
+# How the schema is written into prompts, "compact" or "raw"
+TEXT2CYPHER_SCHEMA_FORMAT = os.environ.get("TEXT2CYPHER_SCHEMA_FORMAT", "compact")
+QUESTION_PROPOSALS_SCHEMA_FORMAT = os.environ.get(
+    "QUESTION_PROPOSALS_SCHEMA_FORMAT", "compact"
+)
+# Structured schemas sent to /data2cypher, text schemas are used as they are
+DATA2CYPHER_SCHEMA_FORMAT = os.environ.get("DATA2CYPHER_SCHEMA_FORMAT", "compact")
+
+# Token budget for the chat history replayed to the LLM, older turns are summarised
+CHAT_HISTORY_MAX_TOKENS = int(os.environ.get("CHAT_HISTORY_MAX_TOKENS", 1000))
+
+# "memory" keeps a cache per worker, "sqlite" shares one between all workers on the host
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 10000))
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 3600))
+
+if CACHE_BACKEND == "sqlite":
+    cache = SQLiteCache(
+        path=os.environ.get("CACHE_PATH", "/tmp/nallm-cache.sqlite3"),
+        max_entries=CACHE_MAX_ENTRIES,
+    )
+else:
+    cache = LRUCache(max_entries=CACHE_MAX_ENTRIES)
+
+# "off" stops reusing Cypher statements, summaries and reports between requests
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "on")
+response_cache = cache if RESPONSE_CACHE != "off" else None
+
+NEO4J_URL = os.environ.get("NEO4J_URL", "neo4j+s://demo.neo4jlabs.com")
+
+
+def createDatabase(host: str, database: str) -> AsyncNeo4jDatabase:
+    return AsyncNeo4jDatabase(
+        host=host,
+        user=os.environ.get("NEO4J_USER", "companies"),
+        password=os.environ.get("NEO4J_PASS", "companies"),
+        database=database,
+        query_timeout=float(os.environ.get("NEO4J_QUERY_TIMEOUT", 30)),
+        max_rows=int(os.environ.get("NEO4J_QUERY_MAX_ROWS", 1000)),
+        max_connection_pool_size=int(
+            os.environ.get("NEO4J_MAX_CONNECTION_POOL_SIZE", 100)
+        ),
+        connection_acquisition_timeout=float(
+            os.environ.get("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", 60)
+        ),
+        max_connection_lifetime=float(
+            os.environ.get("NEO4J_MAX_CONNECTION_LIFETIME", 3600)
+        ),
+        fetch_size=int(os.environ.get("NEO4J_FETCH_SIZE", 1000)),
+        cache=cache,
+        schema_cache_ttl=float(os.environ.get("NEO4J_SCHEMA_CACHE_TTL", 300)),
+        #host=os.environ.get("AURA_URL", "neo4j+s://demo.neo4jlabs.com"),
+        #user=os.environ.get("AURA_USER", "companies"),
+        #password=os.environ.get("AURA_PASS", "companies"),
+        #database=os.environ.get("AURA_DATABASE", "neo4j"),
+    )
+
+
+neo4j_connection = createDatabase(
+    NEO4J_URL, os.environ.get("NEO4J_DATABASE", "companies")
+)
+
+# Further databases requests can target by name, as a JSON object of names to
+# {"url": ..., "database": ...}, by default NEO4J_URL and the name
+NEO4J_DATABASES = json.loads(os.environ.get("NEO4J_DATABASES", "{}"))
+
+
+# Random nodes per label, sampled in the background for the endpoints that
+# show examples of the data
+node_reservoir = NodeReservoir(
+    neo4j_connection,
+    size=int(os.environ.get("NODE_SAMPLE_SIZE", 100)),
+    interval=float(os.environ.get("NODE_SAMPLE_INTERVAL", 60)),
 )
 
 
 # Initialize LLM modules
 openai_api_key = os.environ.get("OPENAI_API_KEY", None)
 
+# Models whose tokenizers are loaded during startup
+LLM_MODELS = ["gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-3.5-turbo-0613"]
+
+# "read_write" records LLM responses to disk and reuses them, "replay" only
+# serves recorded responses, e.g. for offline benchmarks
+LLM_CACHE = os.environ.get("LLM_CACHE", "off")
+
+if LLM_CACHE != "off":
+    llm_cache = SQLiteCache(
+        path=os.environ.get("LLM_CACHE_PATH", "/tmp/nallm-llm-cache.sqlite3"),
+        max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 100000)),
+        max_bytes=int(os.environ.get("LLM_CACHE_MAX_BYTES", 256_000_000)),
+    )
+
+
+def create_llm(**kwargs):
+    llm = OpenAIChat(**kwargs)
+    if LLM_CACHE == "off":
+        return llm
+    return CachedLLM(
+        llm,
+        llm_cache,
+        mode=LLM_CACHE,
+        deterministic_only=os.environ.get("LLM_CACHE_DETERMINISTIC_ONLY", "true")
+        == "true",
+    )
+
+
+# Token counts per prompt segment, served by /promptProfile
+profiler.enabled = os.environ.get("PROMPT_PROFILE", "true") == "true"
+
+# OpenAI quota shared by all LLM calls of this process
+scheduler.configure(
+    requests_per_minute=float(os.environ.get("LLM_REQUESTS_PER_MINUTE", 3500)),
+    tokens_per_minute=float(os.environ.get("LLM_TOKENS_PER_MINUTE", 90000)),
+)
+
+# Shown until question proposals have been generated for the current schema
+DEFAULT_QUESTION_PROPOSALS = [
+    'How many national societies are there?',
+    'How many national societies are there in Africa?',
+    'Which national societies have been affected by an earthquake?',
+    'Which research projects include Uganda?',
+    'What are the core principles of the IFRC?',
+    'What are the income groups?',
+    'what are the crisis drivers?',
+    'what are the hazards?',
+    'How many national societies have been affected by a cyclone?',
+    'What are the key lessons related to ensuring preparedness and resilient communities?',
+]
+
+
+def createQuestionProposalGenerator(
+    api_key: str, database: AsyncNeo4jDatabase
+) -> QuestionProposalGenerator:
+    return QuestionProposalGenerator(
+        database=database,
+        reservoir=node_reservoir if database is neo4j_connection else None,
+        schema_format=QUESTION_PROPOSALS_SCHEMA_FORMAT,
+        llm=create_llm(
+            openai_api_key=api_key,
+            model_name="gpt-3.5-turbo-0613",
+            max_tokens=512,
+            temperature=0.8,
+            priority=BACKGROUND,
+        ),
+    )
+
+
+# Proposals are generated in the background, once per schema version of each
+# database
+question_proposals = {}
+
+
+def questionProposalsFor(database: AsyncNeo4jDatabase) -> QuestionProposals:
+    proposals = question_proposals.get(database)
+    if proposals is None:
+        proposals = QuestionProposals(
+            database,
+            lambda api_key: createQuestionProposalGenerator(api_key, database),
+            DEFAULT_QUESTION_PROPOSALS,
+            cache=cache,
+        )
+        database.add_schema_listener(
+            lambda version: proposals.refresh(openai_api_key)
+        )
+        question_proposals[database] = proposals
+    return proposals
+
+
+questionProposalsFor(neo4j_connection)
+
+
+def forgetDatabase(database: AsyncNeo4jDatabase) -> None:
+    proposals = question_proposals.pop(database, None)
+    if proposals is not None:
+        proposals.cancel()
+
+
+# Connections to the databases of NEO4J_DATABASES, opened on first use and
+# closed once idle
+NEO4J_REGISTRY_IDLE_TIMEOUT = float(os.environ.get("NEO4J_REGISTRY_IDLE_TIMEOUT", 600))
+database_registry = DatabaseRegistry(
+    createDatabase,
+    max_entries=int(os.environ.get("NEO4J_REGISTRY_MAX_ENTRIES", 4)),
+    idle_timeout=NEO4J_REGISTRY_IDLE_TIMEOUT,
+    on_evict=forgetDatabase,
+)
+
+
+@asynccontextmanager
+async def databaseFor(name: Optional[str]):
+    """The default database, or the one of NEO4J_DATABASES with the name"""
+    if not name:
+        yield neo4j_connection
+        return
+    if name not in NEO4J_DATABASES:
+        raise HTTPException(status_code=404, detail=f"Unknown database {name}")
+    config = NEO4J_DATABASES[name]
+    async with database_registry.connection(
+        config.get("url", NEO4J_URL), config.get("database", name)
+    ) as database:
+        yield database
+
+# Seconds between checks of the Neo4j schema for changes
+SCHEMA_REFRESH_INTERVAL = float(os.environ.get("SCHEMA_REFRESH_INTERVAL", 600))
+
+# Identical questions asked at the same time share one pipeline run
+questionFlights = SingleFlight()
+
+
+def questionKey(
+    question: str,
+    history,
+    database: AsyncNeo4jDatabase,
+    database_name: Optional[str],
+    api_key: str,
+) -> str:
+    # Questions that only differ in case, whitespace or trailing punctuation
+    # are the same question. Only callers with the same API key share an
+    # answer, so each key pays for and is limited by its own calls. With the
+    # server's OPENAI_API_KEY that is every caller. The key is only hashed.
+    normalized = " ".join(question.lower().split()).rstrip("?!. ")
+    return cache_key(
+        normalized, database_name, database.schema_version, history, api_key
+    )
+
+
+# Streamed tokens are sent in one frame per interval or once this many bytes
+# are pending, an interval of 0 sends every token in its own frame
+STREAM_FLUSH_INTERVAL = float(os.environ.get("STREAM_FLUSH_INTERVAL_MS", 50)) / 1000
+STREAM_FLUSH_BYTES = int(os.environ.get("STREAM_FLUSH_BYTES", 1024))
+
+# Questions a WebSocket answers at the same time, and unanswered questions it
+# accepts before it stops reading from the socket
+WS_MAX_CONCURRENT_QUESTIONS = int(os.environ.get("WS_MAX_CONCURRENT_QUESTIONS", 4))
+WS_MAX_PENDING_QUESTIONS = int(os.environ.get("WS_MAX_PENDING_QUESTIONS", 16))
+
+# Questions a /text2cypher/batch request may contain, and how many of them are
+# answered at the same time at most
+BATCH_MAX_QUESTIONS = int(os.environ.get("BATCH_MAX_QUESTIONS", 1000))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", 8))
+
+# Seconds a request waits for startup to finish before it is rejected
+STARTUP_WAIT_TIMEOUT = float(os.environ.get("STARTUP_WAIT_TIMEOUT", 30))
+
+# Connecting to Neo4j, loading the schema and warming up the LLM client happen
+# in a background task so the server accepts connections immediately
+startup_state = {"neo4j": "pending", "llm": "pending", "error": None}
+startup_complete = asyncio.Event()
+
 
 # Define FastAPI endpoint
 app = FastAPI()
@@ -72,6 +350,82 @@ app.add_middleware(
 )
 
 
+async def initializeDatabase():
+    attempt = 0
+    while True:
+        try:
+            await neo4j_connection.initialize()
+            startup_state["neo4j"] = "ready"
+            startup_state["error"] = None
+            return
+        except Exception as e:
+            attempt += 1
+            startup_state["error"] = str(e)
+            delay = min(2**attempt, 30)
+            logger.warning(
+                "Neo4j initialisation failed, retrying",
+                extra={"attempt": attempt, "delay": delay, "error": str(e)},
+            )
+            await asyncio.sleep(delay)
+
+
+async def initializeLLM():
+    await open_client_session()
+    await asyncio.to_thread(warm_up, LLM_MODELS)
+    startup_state["llm"] = "ready"
+
+
+async def watchSchema():
+    while True:
+        await asyncio.sleep(SCHEMA_REFRESH_INTERVAL)
+        try:
+            await neo4j_connection.refresh_schema()
+        except Exception as e:
+            logger.warning("Schema refresh failed", extra={"error": str(e)})
+        # Registry connections are kept open while they refresh
+        await database_registry.for_each(lambda database: database.refresh_schema())
+
+
+async def initialize():
+    start = time.perf_counter()
+    await asyncio.gather(initializeDatabase(), initializeLLM())
+    app.state.background_tasks = [
+        asyncio.create_task(node_reservoir.run()),
+        asyncio.create_task(watchSchema()),
+        asyncio.create_task(
+            database_registry.run(min(60.0, NEO4J_REGISTRY_IDLE_TIMEOUT / 2))
+        ),
+    ]
+    startup_complete.set()
+    logger.info(
+        "Startup complete", extra={"duration": time.perf_counter() - start}
+    )
+
+
+async def waitUntilReady():
+    try:
+        await asyncio.wait_for(startup_complete.wait(), STARTUP_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="The service is starting up")
+
+
+@app.on_event("startup")
+async def startup():
+    app.state.startup_task = asyncio.create_task(initialize())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.startup_task.cancel()
+    for task in getattr(app.state, "background_tasks", []):
+        task.cancel()
+    for proposals in question_proposals.values():
+        proposals.cancel()
+    await database_registry.close()
+    await neo4j_connection.close()
+    await close_client_session()
+
+
 @app.post("/questionProposalsForCurrentDb")
 async def questionProposalsForCurrentDb(payload: questionProposalPayload):
     if not openai_api_key and not payload.api_key:
@@ -80,34 +434,14 @@ async def questionProposalsForCurrentDb(payload: questionProposalPayload):
             detail="Please set OPENAI_API_KEY environment variable or send it as api_key in the request body",
         )
     api_key = openai_api_key if openai_api_key else payload.api_key
+    await waitUntilReady()
 
-    questionProposalGenerator = QuestionProposalGenerator(
-        database=neo4j_connection,
-        llm=OpenAIChat(
-            openai_api_key=api_key,
-            model_name="gpt-3.5-turbo-0613",
-            max_tokens=512,
-            temperature=0.8,
-        ),
-    )
-
-    # Commenting out as this is generating too many tokens.
-    # return questionProposalGenerator.run()
-
-    return {
-            "output": [
-                'How many national societies are there?', 
-                'How many national societies are there in Africa?',
-                'Which national societies have been affected by an earthquake?',
-                'Which research projects include Uganda?',
-                'What are the core principles of the IFRC?',
-                'What are the income groups?',
-                'what are the crisis drivers?',
-                'what are the hazards?',
-                'How many national societies have been affected by a cyclone?',
-                'What are the key lessons related to ensuring preparedness and resilient communities?',
-                ],
-        }
+    # Generating proposals for every request spends too many tokens, serve the
+    # ones generated for the current schema instead
+    async with databaseFor(payload.database) as database:
+        proposals = questionProposalsFor(database)
+        proposals.refresh(api_key)
+        return {"output": proposals.get()}
 
 
 @app.get("/hasapikey")
@@ -117,30 +451,212 @@ async def hasApiKey():
 
 @app.websocket("/text2text")
 async def websocket_endpoint(websocket: WebSocket):
-    async def sendDebugMessage(message):
-        await websocket.send_json({"type": "debug", "detail": message})
-
-    async def sendErrorMessage(message):
-        await websocket.send_json({"type": "error", "detail": message})
+    """
+    Answers questions, streaming the summary as it is generated.
+
+    Questions with an "id" are pipelined: up to WS_MAX_CONCURRENT_QUESTIONS
+    of them are answered at the same time and every frame about a question
+    carries its id. Once WS_MAX_PENDING_QUESTIONS are unanswered and as many
+    messages are buffered, the socket is not read until answers come back, so
+    TCP flow control slows the client down. Questions
+    without an id are answered one at a time, as before. Either way the chat
+    history records questions and answers in the order the questions arrived.
+    """
 
-    async def onToken(token):
-        delta = token["choices"][0]["delta"]
-        if "content" not in delta:
+    async def sendFrame(frame, request_id=None):
+        if request_id is not None:
+            frame["id"] = request_id
+        # Frames of concurrent questions are interleaved, never mixed
+        async with sendLock:
+            await websocket.send_json(frame)
+
+    async def sendDebugMessage(message, request_id=None):
+        await sendFrame({"type": "debug", "detail": message}, request_id)
+
+    async def trySendFrame(frame, request_id=None):
+        # For answers that end after the socket may have closed, there is
+        # nobody to tell then
+        try:
+            await sendFrame(frame, request_id)
+        except Exception as e:
+            logger.debug("Could not send frame", extra={"error": str(e)})
+
+    async def receiveMessages():
+        try:
+            while True:
+                await incoming.put(await websocket.receive_json())
+        except Exception:
+            disconnected.set()
+            await incoming.put(None)
+
+    async def runUntilDisconnect(coroutine):
+        # Cancel the work if the client goes away before it finishes
+        work = asyncio.ensure_future(coroutine)
+        disconnect = asyncio.ensure_future(disconnected.wait())
+        await asyncio.wait({work, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        if not work.done():
+            work.cancel()
+            raise WebSocketDisconnect()
+        disconnect.cancel()
+        return work.result()
+
+    async def answer(data, api_key, request_id, previous, committed):
+        async def sendStream(output):
+            await sendFrame({"type": "stream", "output": output}, request_id)
+
+        async def onToken(token):
+            delta = token["choices"][0]["delta"]
+            if "content" not in delta:
+                return
+            content = delta["content"]
+            if token["choices"][0]["finish_reason"] == "stop":
+                await batcher.flush()
+                await sendFrame({"type": "end", "output": content}, request_id)
+            else:
+                await batcher.add(content)
+
+        batcher = StreamBatcher(
+            sendStream, interval=STREAM_FLUSH_INTERVAL, max_bytes=STREAM_FLUSH_BYTES
+        )
+        try:
+            async with running:
+                await waitUntilReady()
+                async with databaseFor(data.get("database")) as database:
+                    results, output = await answerQuestion(
+                        data, api_key, database, request_id, onToken, batcher
+                    )
+            await sendFrame(
+                {
+                    "type": "end",
+                    "output": output,
+                    "generated_cypher": results["generated_cypher"],
+                },
+                request_id,
+            )
+            # Record the turn once the turns of earlier questions are recorded
+            await previous
+            chatHistory.append({"role": "user", "content": data["question"]})
+            chatHistory.append({"role": "system", "content": output})
+            chatHistory.compact()
+        except WebSocketDisconnect:
+            # The connection is closing, there is nobody to tell
             return
-        content = delta["content"]
-        if token["choices"][0]["finish_reason"] == "stop":
-            await websocket.send_json({"type": "end", "output": content})
-        else:
-            await websocket.send_json({"type": "stream", "output": content})
+        except HTTPException as e:
+            await trySendFrame({"type": "error", "detail": e.detail}, request_id)
+        except Exception as e:
+            await trySendFrame({"type": "error", "detail": str(e)}, request_id)
+        finally:
+            batcher.cancel()
+            # Later questions do not wait for a question that failed
+            if not committed.done():
+                committed.set_result(None)
+        await trySendFrame({"type": "debug", "detail": "output done"}, request_id)
+
+    async def answerQuestion(data, api_key, database, request_id, onToken, batcher):
+        question = data["question"]
+        default_llm = create_llm(
+            openai_api_key=api_key,
+            #model_name=data.get("model_name", "gpt-3.5-turbo-16k"),
+            model_name="gpt-3.5-turbo-16k",
+        )
+        summarize_results = SummarizeCypherResult(
+            llm=create_llm(
+                openai_api_key=api_key,
+                model_name="gpt-3.5-turbo-16k",
+                max_tokens=1000,
+            ),
+            cache=response_cache,
+            cache_ttl=CACHE_TTL,
+        )
 
-        # await websocket.send_json({"token": token})
+        text2cypher = Text2Cypher(
+            database=database,
+            llm=default_llm,
+            cypher_examples=get_fewshot_examples(api_key),
+            use_schema=True,
+            ignore_relationship_direction=False,
+            candidates=TEXT2CYPHER_CANDIDATES,
+            prune_schema=TEXT2CYPHER_PRUNE_SCHEMA,
+            schema_format=TEXT2CYPHER_SCHEMA_FORMAT,
+            cache=response_cache,
+            cache_ttl=CACHE_TTL,
+        )
+
+        await sendDebugMessage("received question: " + question, request_id)
+        # The history recorded so far, and the question itself
+        history = chatHistory.get_messages() + [{"role": "user", "content": question}]
+        prompt = text2cypher.construct_messages(question, history)
+        turn = chatHistory.record_prompt_tokens(
+            default_llm.num_tokens_from_string("".join(m["content"] for m in prompt))
+        )
+        await sendDebugMessage(f"prompt tokens: {turn}", request_id)
+
+        async def runPipeline(publish):
+            # Runs once for all sockets asking the same question at the same
+            # time, terminating the Neo4j transaction if they all go away
+            query_id = uuid4().hex
+            try:
+                results = await text2cypher.run_async(
+                    question, history, query_id=query_id
+                )
+            except asyncio.CancelledError:
+                await database.cancel(query_id)
+                raise
+            await publish({"type": "cypher", "results": results})
+
+            async def publishToken(token):
+                await publish({"type": "token", "token": token})
+
+            output = await summarize_results.run_async(
+                question,
+                results["output"][:HARD_LIMIT_CONTEXT_RECORDS],
+                callback=publishToken,
+            )
+            await publish({"type": "summary", "output": output})
+
+        async def streamAnswer():
+            results = None
+            async with aclosing(
+                questionFlights.stream(
+                    questionKey(
+                        question, history, database, data.get("database"), api_key
+                    ),
+                    runPipeline,
+                )
+            ) as events:
+                async for event in events:
+                    if event["type"] == "cypher":
+                        results = event["results"]
+                        await sendFrame({"type": "start"}, request_id)
+                    elif event["type"] == "token":
+                        await onToken(event["token"])
+                    else:
+                        await batcher.flush()
+                        return results, event["output"]
+
+        return await runUntilDisconnect(streamAnswer())
 
     await websocket.accept()
+    sendLock = asyncio.Lock()
     await sendDebugMessage("connected")
-    chatHistory = []
+    chatHistory = None
+    running = asyncio.Semaphore(WS_MAX_CONCURRENT_QUESTIONS)
+    pending = set()
+    # Resolved once the previous question's turn is in the chat history
+    lastCommit = asyncio.get_running_loop().create_future()
+    lastCommit.set_result(None)
+    # Full while the pending questions are at the limit, then receiveMessages
+    # stops reading and the client is held back by TCP flow control
+    incoming = asyncio.Queue(maxsize=WS_MAX_PENDING_QUESTIONS)
+    disconnected = asyncio.Event()
+    receiver = asyncio.create_task(receiveMessages())
     try:
         while True:
-            data = await websocket.receive_json()
+            while len(pending) >= WS_MAX_PENDING_QUESTIONS:
+                await asyncio.wait(set(pending), return_when=asyncio.FIRST_COMPLETED)
+            data = await incoming.get()
+            if data is None:
+                raise WebSocketDisconnect()
             if not openai_api_key and not data.get("api_key"):
                 raise HTTPException(
                     status_code=422,
@@ -148,69 +664,110 @@ async def websocket_endpoint(websocket: WebSocket):
                 )
             api_key = openai_api_key if openai_api_key else data.get("api_key")
 
-            default_llm = OpenAIChat(
+            if chatHistory is None:
+                chatHistory = ChatHistory(
+                    llm=create_llm(
+                        openai_api_key=api_key,
+                        model_name="gpt-3.5-turbo-16k",
+                        max_tokens=256,
+                        priority=BACKGROUND,
+                    ),
+                    max_tokens=CHAT_HISTORY_MAX_TOKENS,
+                )
+
+            if "type" not in data:
+                await sendFrame({"error": "missing type"}, data.get("id"))
+                continue
+            if data["type"] == "question":
+                request_id = data.get("id")
+                committed = asyncio.get_running_loop().create_future()
+                task = asyncio.create_task(
+                    answer(data, api_key, request_id, lastCommit, committed)
+                )
+                lastCommit = committed
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                if request_id is None:
+                    await task
+    except WebSocketDisconnect:
+        logger.info("WebSocket disconnected")
+    finally:
+        for task in pending:
+            task.cancel()
+        receiver.cancel()
+
+
+@app.post("/text2cypher/batch")
+async def text2cypherBatch(payload: BatchPayload):
+    """
+    Answers a list of independent questions, without chat history, and
+    streams a JSON line per question as it finishes, with its index in the
+    list, the generated Cypher, the records and, if requested, the summary.
+    The last line has the timings of the whole batch.
+    """
+    if not openai_api_key and not payload.api_key:
+        raise HTTPException(
+            status_code=422,
+            detail="Please set OPENAI_API_KEY environment variable or send it as api_key in the request body",
+        )
+    api_key = openai_api_key if openai_api_key else payload.api_key
+    if len(payload.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"A batch can contain at most {BATCH_MAX_QUESTIONS} questions",
+        )
+    concurrency = payload.concurrency or BATCH_MAX_CONCURRENCY
+    await waitUntilReady()
+    async with AsyncExitStack() as stack:
+        database = await stack.enter_async_context(databaseFor(payload.database))
+
+        # Batches run behind interactive chat in the LLM scheduler
+        text2cypher = Text2Cypher(
+            database=database,
+            llm=create_llm(
                 openai_api_key=api_key,
-                #model_name=data.get("model_name", "gpt-3.5-turbo-16k"),
                 model_name="gpt-3.5-turbo-16k",
-            )
-            summarize_results = SummarizeCypherResult(
-                llm=OpenAIChat(
+                priority=BULK,
+            ),
+            cypher_examples=get_fewshot_examples(api_key),
+            use_schema=True,
+            ignore_relationship_direction=False,
+            candidates=TEXT2CYPHER_CANDIDATES,
+            prune_schema=TEXT2CYPHER_PRUNE_SCHEMA,
+            schema_format=TEXT2CYPHER_SCHEMA_FORMAT,
+            cache=response_cache,
+            cache_ttl=CACHE_TTL,
+        )
+        summarize = None
+        if payload.summarize:
+            summarize = SummarizeCypherResult(
+                llm=create_llm(
                     openai_api_key=api_key,
                     model_name="gpt-3.5-turbo-16k",
                     max_tokens=1000,
-                )
+                    priority=BULK,
+                ),
+                cache=response_cache,
+                cache_ttl=CACHE_TTL,
             )
+        batch = Text2CypherBatch(
+            text2cypher,
+            summarize,
+            concurrency=max(1, min(concurrency, BATCH_MAX_CONCURRENCY)),
+            max_context_records=HARD_LIMIT_CONTEXT_RECORDS,
+        )
+        # The database stays in use until the last line is sent
+        resources = stack.pop_all()
 
-            text2cypher = Text2Cypher(
-                database=neo4j_connection,
-                llm=default_llm,
-                cypher_examples=get_fewshot_examples(api_key),
-                use_schema=True,
-                ignore_relationship_direction=False,
-            )
+    async def lines():
+        try:
+            async with aclosing(batch.stream(payload.questions)) as results:
+                async for result in results:
+                    yield json.dumps(result, default=str) + "\n"
+        finally:
+            await resources.aclose()
 
-            if "type" not in data:
-                await websocket.send_json({"error": "missing type"})
-                continue
-            if data["type"] == "question":
-                try:
-                    question = data["question"]
-                    chatHistory.append({"role": "user", "content": question})
-                    await sendDebugMessage("received question: " + question)
-                    results = None
-                    try:
-                        results = text2cypher.run(question, chatHistory)
-                        #print("results", results)
-                    except Exception as e:
-                        await sendErrorMessage(str(e))
-                        continue
-                    if results == None:
-                        await sendErrorMessage("Could not generate Cypher statement")
-                        continue
-
-                    await websocket.send_json(
-                        {
-                            "type": "start",
-                        }
-                    )
-                    output = await summarize_results.run_async(
-                        question,
-                        results["output"][:HARD_LIMIT_CONTEXT_RECORDS],
-                        callback=onToken,
-                    )
-                    chatHistory.append({"role": "system", "content": output})
-                    await websocket.send_json(
-                        {
-                            "type": "end",
-                            "output": output,
-                            "generated_cypher": results["generated_cypher"],
-                        }
-                    )
-                except Exception as e:
-                    await sendErrorMessage(str(e))
-                await sendDebugMessage("output done")
-    except WebSocketDisconnect:
-        print("disconnected")
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @app.post("/data2cypher")
@@ -228,28 +785,36 @@ async def root(payload: ImportPayload):
     try:
         result = ""
 
-        llm = OpenAIChat(
-            openai_api_key=api_key, model_name="gpt-3.5-turbo-16k", max_tokens=4000
+        llm = create_llm(
+            openai_api_key=api_key,
+            model_name="gpt-3.5-turbo-16k",
+            max_tokens=4000,
+            priority=BULK,
         )
 
+        # The import makes many blocking LLM calls, keep them off the event loop
         if not payload.neo4j_schema:
             extractor = DataExtractor(llm=llm)
-            result = extractor.run(data=payload.input)
+            result = await asyncio.to_thread(extractor.run, data=payload.input)
         else:
-            extractor = DataExtractorWithSchema(llm=llm)
-            result = extractor.run(schema=payload.neo4j_schema, data=payload.input)
+            extractor = DataExtractorWithSchema(
+                llm=llm, schema_format=DATA2CYPHER_SCHEMA_FORMAT
+            )
+            result = await asyncio.to_thread(
+                extractor.run, schema=payload.neo4j_schema, data=payload.input
+            )
 
-        print("Extracted result: " + str(result))
+        logger.debug("Extracted result", extra={"output": result})
 
         disambiguation = DataDisambiguation(llm=llm)
-        disambiguation_result = disambiguation.run(result)
+        disambiguation_result = await asyncio.to_thread(disambiguation.run, result)
 
-        print("Disambiguation result " + str(disambiguation_result))
+        logger.debug("Disambiguation result", extra={"output": disambiguation_result})
 
         return {"data": disambiguation_result}
 
     except Exception as e:
-        print(e)
+        logger.exception("Data import failed")
         return f"Error: {e}"
 
 
@@ -268,26 +833,52 @@ async def companyInformation(payload: companyReportPayload):
             detail="Please set OPENAI_API_KEY environment variable or send it as api_key in the request body",
         )
     api_key = openai_api_key if openai_api_key else payload.api_key
+    await waitUntilReady()
 
-    llm = OpenAIChat(
+    llm = create_llm(
         openai_api_key=api_key,
         model_name="gpt-3.5-turbo-16k-0613",
         max_tokens=512,
     )
-    print("Running company report for " + payload.company)
-    company_report = CompanyReport(neo4j_connection, payload.company, llm)
-    result = company_report.run()
+    company_report = CompanyReport(
+        neo4j_connection,
+        payload.company,
+        llm,
+        cache=response_cache,
+        cache_ttl=float(os.environ.get("COMPANY_REPORT_CACHE_TTL", 86400)),
+    )
+    result = await company_report.run_async()
 
     return JSONResponse(content={"output": result})
 
 
 @app.post("/companyReport/list")
 async def companyReportList():
-    company_data = neo4j_connection.query(
-        "MATCH (n:Organization) WITH n WHERE rand() < 0.01 return n.name LIMIT 5",
-    )
+    await waitUntilReady()
+    names = [
+        node["properties"].get("name")
+        for node in node_reservoir.sample("Organization", 5)
+    ]
+    if not names:
+        # The reservoir has not read any organizations yet
+        company_data = await neo4j_connection.query(
+            "MATCH (n:Organization) WITH n WHERE rand() < 0.01 return n.name LIMIT 5",
+        )
+        names = [x["n.name"] for x in company_data]
+
+    return JSONResponse(content={"output": names})
+
 
-    return JSONResponse(content={"output": [x["n.name"] for x in company_data]})
+@app.get("/promptProfile")
+async def promptProfile():
+    return profiler.snapshot()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.get("/health")
@@ -297,10 +888,20 @@ async def health():
 
 @app.get("/ready")
 async def readiness_check():
-    return {"status": "ok"}
+    if not startup_complete.is_set():
+        return JSONResponse(
+            status_code=503, content={"status": "starting", **startup_state}
+        )
+    return {"status": "ok", **startup_state}
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, port=int(os.environ.get("PORT", 7860)), host="0.0.0.0")
+    uvicorn.run(
+        app,
+        port=int(os.environ.get("PORT", 7860)),
+        host="0.0.0.0",
+        ws_per_message_deflate=os.environ.get("WS_PER_MESSAGE_DEFLATE", "true")
+        == "true",
+    )
@@ -0,0 +1,33 @@
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Coroutine
+
+
+async def call_async(func: Callable, *args, **kwargs) -> Any:
+    """Awaits coroutine functions and runs blocking functions in a worker thread
+
+    Lets components work with both Neo4jDatabase and AsyncNeo4jDatabase, and
+    keeps blocking LLM calls off the event loop.
+    """
+    if inspect.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+    result = await asyncio.to_thread(func, *args, **kwargs)
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+def run_sync(coroutine: Coroutine) -> Any:
+    """Runs a coroutine to completion from synchronous code
+
+    Blocks like the synchronous implementations did. When the calling thread
+    already runs an event loop, where asyncio.run raises, the coroutine runs
+    on a private loop in a worker thread instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -0,0 +1,60 @@
+"""
+Structured logging for the API.
+
+LOG_LEVEL sets the level (default INFO), LOG_FORMAT selects "json" or "text"
+output and LOG_SAMPLE_RATE is the fraction of high-volume records, such as
+full prompt dumps, that are kept. High-volume records are logged with
+`extra={"sampled": True}`.
+"""
+import json
+import logging
+import os
+import random
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RESERVED_ATTRIBUTES = set(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime"}
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sampled", False):
+            return random.random() < self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(
+            (key, value)
+            for key, value in record.__dict__.items()
+            if key not in _RESERVED_ATTRIBUTES and key != "sampled"
+        )
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging() -> None:
+    handler = logging.StreamHandler()
+    handler.addFilter(SamplingFilter(float(os.environ.get("LOG_SAMPLE_RATE", 1.0))))
+    if os.environ.get("LOG_FORMAT", "json") == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+        )
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
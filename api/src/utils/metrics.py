@@ -0,0 +1,292 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Metrics are registered in a module level registry when they are created and
+rendered by the /metrics endpoint.
+"""
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+_registry: List["Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Returns the p-th percentile (0-100) of the values using nearest rank"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Metric(ABC):
+    type = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterator[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        """(name, label names, label values, value) of every sample"""
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for name, labelnames, labelvalues, value in self.samples():
+            lines.append(
+                f"{name}{_format_labels(labelnames, labelvalues)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, self.labelnames, key, value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, self.labelnames, key, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            counts = {key: list(value) for key, value in self._counts.items()}
+            sums = dict(self._sums)
+        for key, bucket_counts in counts.items():
+            for bound, count in zip(self.buckets, bucket_counts):
+                yield (
+                    self.name + "_bucket",
+                    self.labelnames + ("le",),
+                    key + (_format_value(bound),),
+                    count,
+                )
+            yield self.name + "_count", self.labelnames, key, bucket_counts[-1]
+            yield self.name + "_sum", self.labelnames, key, sums[key]
+
+
+def render() -> str:
+    """Renders all registered metrics in the Prometheus text format"""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+STAGE_DURATION = Histogram(
+    "nallm_stage_duration_seconds",
+    "Duration of each pipeline stage in seconds",
+    ["stage"],
+)
+STAGE_ERRORS = Counter(
+    "nallm_stage_errors_total",
+    "Number of pipeline stages that raised an exception",
+    ["stage"],
+)
+NEO4J_QUERIES = Counter(
+    "nallm_neo4j_queries_total",
+    "Number of Neo4j queries by outcome",
+    ["status"],
+)
+LLM_REQUESTS = Counter(
+    "nallm_llm_requests_total",
+    "Number of LLM requests by model and outcome",
+    ["model", "status"],
+)
+LLM_TOKENS = Counter(
+    "nallm_llm_tokens_total",
+    "Number of LLM tokens used by model and kind (prompt or completion)",
+    ["model", "kind"],
+)
+
+CACHE_REQUESTS = Counter(
+    "nallm_cache_requests_total",
+    "Number of cache lookups by namespace and result (hit or miss)",
+    ["namespace", "result"],
+)
+
+COALESCED_REQUESTS = Counter(
+    "nallm_coalesced_requests_total",
+    "Number of requests that ran the pipeline (leader) or shared a running one (follower)",
+    ["role"],
+)
+
+LLM_QUEUE_DEPTH = Gauge(
+    "nallm_llm_queue_depth",
+    "Number of LLM calls waiting for rate limit budget by priority",
+    ["priority"],
+)
+LLM_QUEUE_WAIT = Histogram(
+    "nallm_llm_queue_wait_seconds",
+    "Time LLM calls waited for rate limit budget by priority",
+    ["priority"],
+)
+LLM_WASTED_TOKENS = Counter(
+    "nallm_llm_wasted_tokens_total",
+    "Number of tokens spent on cancelled LLM calls by model and kind",
+    ["model", "kind"],
+)
+LLM_RATE_LIMITED = Counter(
+    "nallm_llm_rate_limited_total",
+    "Number of rate limit responses from the LLM provider",
+)
+
+NEO4J_WASTED_SECONDS = Counter(
+    "nallm_neo4j_wasted_seconds_total",
+    "Time spent on cancelled Neo4j queries",
+)
+
+NEO4J_REGISTRY_ENTRIES = Gauge(
+    "nallm_neo4j_registry_entries",
+    "Number of Neo4j connections held by the database registry",
+)
+NEO4J_REGISTRY_EVICTIONS = Counter(
+    "nallm_neo4j_registry_evictions_total",
+    "Number of idle Neo4j connections closed by the database registry",
+)
+
+SCHEMA_PRUNING = Counter(
+    "nallm_schema_pruning_total",
+    "Number of Text2Cypher prompts with a pruned or the full schema",
+    ["result"],
+)
+
+PROMPT_TOKENS = Counter(
+    "nallm_prompt_tokens_total",
+    "Number of prompt tokens by component and prompt segment",
+    ["component", "segment"],
+)
+
+STREAM_TOKENS = Counter(
+    "nallm_stream_tokens_total",
+    "Number of streamed tokens passed to WebSocket clients",
+)
+STREAM_FRAMES = Counter(
+    "nallm_stream_frames_total",
+    "Number of WebSocket frames the streamed tokens were sent in",
+)
+
+
+@contextmanager
+def time_stage(stage: str) -> Iterator[None]:
+    """Records the duration of a pipeline stage and counts it as an error if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
@@ -0,0 +1,97 @@
+"""
+Compact text encodings of Cypher results for LLM prompts.
+
+The Python repr of a list of dicts repeats every column name on every row and
+quotes every string. The encodings here write the values without quotes, as
+a table with one header row or, for few rows with many columns, as one
+`column: value` line per value. Node and map values are flattened into dotted
+columns, a variable prefix shared by all columns such as `n.` is dropped, and
+the shortest encoding of the results is used.
+"""
+import json
+from typing import Any, Dict, List
+
+SEPARATOR = " | "
+
+
+def format_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return value.replace("\n", "\\n").replace("|", "\\|")
+    if isinstance(value, (int, float)):
+        return str(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def flatten(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Flattens map values, e.g. nodes, one level into dotted columns"""
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict) and value:
+            for inner_key, inner_value in value.items():
+                flat[f"{key}.{inner_key}"] = inner_value
+        else:
+            flat[key] = value
+    return flat
+
+
+def common_prefix(columns: List[str]) -> str:
+    # Only whole variable names, e.g. "n." of "n.name" and "n.summary"
+    prefixes = {column.split(".", 1)[0] + "." for column in columns if "." in column}
+    if len(prefixes) != 1:
+        return ""
+    prefix = prefixes.pop()
+    if not all(column.startswith(prefix) for column in columns):
+        return ""
+    return prefix
+
+
+def column_order(records: List[Dict[str, Any]]) -> List[str]:
+    columns = {}
+    for record in records:
+        columns.update(dict.fromkeys(record))
+    return list(columns)
+
+
+def encode_table(records: List[Dict[str, Any]], columns: List[str], prefix: str) -> str:
+    lines = [SEPARATOR.join(column[len(prefix) :] for column in columns)]
+    for record in records:
+        lines.append(
+            SEPARATOR.join(
+                format_value(record.get(column)) for column in columns
+            ).rstrip()
+        )
+    return "\n".join(lines)
+
+
+def encode_records(
+    records: List[Dict[str, Any]], columns: List[str], prefix: str
+) -> str:
+    blocks = []
+    for record in records:
+        blocks.append(
+            "\n".join(
+                f"{column[len(prefix):]}: {format_value(record[column])}"
+                for column in columns
+                if record.get(column) is not None
+            )
+        )
+    return "\n\n".join(blocks)
+
+
+def encode_results(results: List[Any]) -> str:
+    """Encodes query results in the shortest of the table, record and repr forms"""
+    if not results or not all(isinstance(record, dict) for record in results):
+        return str(results)
+    records = [flatten(record) for record in results]
+    columns = column_order(records)
+    prefix = common_prefix(columns)
+    candidates = [
+        encode_table(records, columns, prefix),
+        encode_records(records, columns, prefix),
+        str(results),
+    ]
+    return min(candidates, key=len)
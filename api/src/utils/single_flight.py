@@ -0,0 +1,97 @@
+"""
+Single-flight coalescing of identical concurrent requests.
+
+The first caller for a key starts the work in a background task and every
+caller, including later ones with the same key, receives all events the work
+publishes from the beginning. The work is cancelled when the last caller goes
+away and forgotten as soon as it finishes, so nothing is served stale.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from utils.metrics import COALESCED_REQUESTS
+
+Publish = Callable[[Any], Awaitable[None]]
+
+
+class Flight:
+    def __init__(self) -> None:
+        self.events: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._condition = asyncio.Condition()
+
+    async def publish(self, event: Any) -> None:
+        async with self._condition:
+            self.events.append(event)
+            self._condition.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None) -> None:
+        async with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        index = 0
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(
+                    lambda: index < len(self.events) or self.done
+                )
+                events = self.events[index:]
+                done = self.done
+            index += len(events)
+            for event in events:
+                yield event
+            if done and index == len(self.events):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._flights: Dict[str, Flight] = {}
+
+    async def stream(
+        self, key: str, work: Callable[[Publish], Awaitable[None]]
+    ) -> AsyncIterator[Any]:
+        """Yields the events published by `work`, shared by all callers with this key"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, work))
+            COALESCED_REQUESTS.inc(role="leader")
+        else:
+            COALESCED_REQUESTS.inc(role="follower")
+        flight.subscribers += 1
+        try:
+            async for event in flight.subscribe():
+                yield event
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.task.done():
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def _run(
+        self, key: str, flight: Flight, work: Callable[[Publish], Awaitable[None]]
+    ) -> None:
+        error = None
+        try:
+            await work(flight.publish)
+        except asyncio.CancelledError as e:
+            error = e
+            raise
+        except Exception as e:
+            error = e
+        finally:
+            # Forget the flight before waking subscribers so new callers start afresh
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            await flight.finish(error)
@@ -0,0 +1,64 @@
+"""
+Batching of streamed tokens into fewer WebSocket frames.
+
+Sending every token as its own frame costs one JSON serialisation and one
+frame per token and client. The batcher collects tokens and sends them as one
+chunk once `interval` seconds have passed since the first pending token or
+`max_bytes` of text are pending, whichever comes first. `flush` sends what is
+pending right away, e.g. before the final frame of an answer.
+"""
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+
+from utils.metrics import STREAM_FRAMES, STREAM_TOKENS
+
+
+class StreamBatcher:
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        interval: float = 0.05,
+        max_bytes: int = 1024,
+    ) -> None:
+        """With an interval of 0 every token is sent as soon as it arrives"""
+        self.send = send
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._pending: List[str] = []
+        self._size = 0
+        self._timer: Optional[asyncio.Task] = None
+        # Keeps the chunks in order when the timer and a caller flush at once
+        self._lock = asyncio.Lock()
+
+    async def add(self, text: str) -> None:
+        STREAM_TOKENS.inc()
+        self._pending.append(text)
+        self._size += len(text.encode("utf-8"))
+        if self.interval <= 0 or self._size >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        self.cancel()
+        async with self._lock:
+            if not self._pending:
+                return
+            text = "".join(self._pending)
+            self._pending = []
+            self._size = 0
+            STREAM_FRAMES.inc()
+            await self.send(text)
+
+    def cancel(self) -> None:
+        """Stops the pending timer, e.g. when the client went away"""
+        # The timer is only reset once it is done sleeping, so this never
+        # interrupts a send
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -3,9 +3,12 @@ export type WebSocketRequest = {
   question: string;
   api_key?: string;
   model_name?: string;
+  database?: string;
+  id?: string;
 };
 
-export type WebSocketResponse =
+// Responses to questions sent with an id carry the same id
+export type WebSocketResponse = (
   | { type: "start" }
   | {
       type: "stream";
@@ -23,6 +26,7 @@ export type WebSocketResponse =
   | {
       type: "debug";
       detail: string;
-    };
+    }
+) & { id?: string };
 
 export type ConversationState = "waiting" | "streaming" | "ready" | "error";